@@ -0,0 +1,435 @@
+# ==========================================
+# [Benchmark] Common Helpers (먼저 실행하세요)
+# ==========================================
+# cell3.py 실행 후, 다른 bench/*.py 셀보다 먼저 실행합니다.
+# - synthetic_removal_job: 합성 파노라마 + 마스크 + Gemini 출력 (GPU 불필요)
+# - FakeGeminiClient: google.genai Client의 오프라인 대체 (네트워크/쿼터 없이 벤치마크)
+# - FakeGeminiServer: 429 / 느린 응답을 시뮬레이션하는 로컬 Gemini REST 서버
+# - offline_pipeline: SAM / BEiT 스텁 + FakeGeminiClient로 교체 (모델 / 네트워크 없이 파이프라인 실행)
+# - save_bench_results / compare_with_baseline: 결과 JSON 저장, 기준 실행 대비 회귀 확인
+import asyncio
+import base64
+import collections
+import contextlib
+import glob
+import json
+import os
+import random
+import re
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import cv2
+import numpy as np
+import torch
+
+BENCH_RESULTS_DIR = "bench_results"
+
+BENCH_REGRESSION_TOLERANCE = 0.10  # 기준 대비 10% 이상 느려지면 회귀로 표시
+
+def save_bench_results(name, data):
+    os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(BENCH_RESULTS_DIR, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    print(f"💾 Saved {path}")
+    return path
+
+def save_bench_baseline(name):
+    """현재 bench_results/<name>.json을 이후 실행의 비교 기준(<name>.baseline.json)으로 저장합니다."""
+    src = os.path.join(BENCH_RESULTS_DIR, f"{name}.json")
+    dst = os.path.join(BENCH_RESULTS_DIR, f"{name}.baseline.json")
+    with open(src, encoding="utf-8") as f, open(dst, "w", encoding="utf-8") as out:
+        out.write(f.read())
+    print(f"📌 Baseline saved: {dst}")
+
+def compare_with_baseline(name, metrics, tolerance=BENCH_REGRESSION_TOLERANCE):
+    """
+    metrics({key: ms})를 기준 실행의 "metrics"와 비교합니다. 값이 클수록 나쁜 지표(지연 시간, 메모리)만 넣으세요.
+    반환: {key: {"baseline", "current", "change"}} 중 tolerance 이상 나빠진 항목
+    """
+    path = os.path.join(BENCH_RESULTS_DIR, f"{name}.baseline.json")
+    if not os.path.exists(path):
+        print(f"ℹ️ No baseline for '{name}'. Run save_bench_baseline('{name}') to set one.")
+        return {}
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f).get("metrics", {})
+    regressions = {}
+    for key, current in metrics.items():
+        before = baseline.get(key)
+        if not before or current is None: continue
+        change = (current - before) / before
+        if change > tolerance:
+            regressions[key] = {"baseline": before, "current": current, "change": round(change, 3)}
+    for key, r in regressions.items():
+        print(f"  ❌ {key}: {r['baseline']} -> {r['current']} (+{r['change'] * 100:.0f}%)")
+    print(f"📊 {len(regressions)} regression(s) vs baseline ({len(metrics)} metrics, tolerance {tolerance * 100:.0f}%)")
+    return regressions
+
+def percentiles_ms(samples_s):
+    """초 단위 샘플 -> p50 / p95 / p99 / mean (ms)"""
+    if not samples_s: return {"p50": None, "p95": None, "p99": None, "mean": None, "count": 0}
+    ms = np.asarray(samples_s) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1),
+            "mean": round(float(ms.mean()), 1), "count": len(ms)}
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+class RssSampler:
+    """백그라운드 스레드에서 RSS를 주기적으로 읽어 구간 최대값을 기록합니다. (ru_maxrss는 프로세스 전체 최대값이라 구간 비교 불가)"""
+    def __init__(self, interval_s=0.05):
+        self.interval_s = interval_s
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def result(self):
+        return {"start_mb": round(self.start_mb, 1), "peak_mb": round(self.peak_mb, 1),
+                "growth_mb": round(self.peak_mb - self.start_mb, 1)}
+
+def room_images(max_images=4, synthetic_sizes=((2048, 1024),)):
+    """Blob Store에 업로드된 실제 방 사진(BGR)을 우선 사용하고, 없으면 합성 이미지를 사용합니다."""
+    images = []
+    for path in sorted(glob.glob(os.path.join(BLOB_DIR, "*")))[:max_images * 4]:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is not None: images.append(image)
+        if len(images) >= max_images: break
+    return images or [synthetic_room(w, h, seed) for seed, (w, h) in enumerate(synthetic_sizes)]
+
+def synthetic_room(width, height, seed=0):
+    """그라디언트 + 노이즈 + 가구 모양 사각형이 있는 합성 파노라마 (BGR)"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = np.stack([(xx * 255 // width), (yy * 255 // height), ((xx + yy) * 127 // (width + height))], axis=-1)
+    image = np.clip(base + rng.integers(-12, 12, size=base.shape), 0, 255).astype(np.uint8)
+    del base, xx, yy
+    floor_y = int(height * 0.62)
+    image[floor_y:] = (image[floor_y:] * 0.6 + np.array([60, 90, 120]) * 0.4).astype(np.uint8)
+    for i in range(4):
+        x0 = int(width * (0.1 + 0.22 * i))
+        cv2.rectangle(image, (x0, floor_y - height // 10), (x0 + width // 14, floor_y + height // 14),
+                      tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+    return image
+
+def synthetic_removal_job(width, height, seed=0):
+    """합성 파노라마, 구석의 '램프' 마스크, Gemini 출력(긴 변 1344px)으로 RemovalJob을 만듭니다."""
+    image = synthetic_room(width, height, seed)
+    proc_w = min(width, 2048)
+    proc_h = int(height * proc_w / width)
+    input_image = cv2.resize(image, (proc_w, proc_h), interpolation=cv2.INTER_AREA) if proc_w != width else image.copy()
+    image_rgb = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
+    mask = np.zeros((proc_h, proc_w), dtype=np.uint8)
+    cv2.ellipse(mask, (int(proc_w * 0.85), int(proc_h * 0.7)), (40, 110), 0, 0, 360, 255, -1)
+    mask = cv2.dilate(mask, np.ones((10, 10), np.uint8), iterations=3)
+
+    gemini = cv2.resize(input_image, (1344, int(1344 * proc_h / proc_w)))
+    gemini = cv2.convertScaleAbs(gemini, alpha=1.05, beta=6)  # 약간 다른 톤 (histogram matching 대상)
+    job = RemovalJob(image=image, input_image=input_image, image_rgb=image_rgb, mask_dilated=mask)
+    return job, gemini
+
+def fake_inpaint_jpeg(jpeg_bytes, output_max_side=1344):
+    """빨간 영역을 cv2.inpaint로 채운 JPEG (Gemini처럼 긴 변을 output_max_side 이하로 줄임)"""
+    img = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+    scale = min(1.0, output_max_side / max(img.shape[:2]))
+    img = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    b, g, r = cv2.split(img)
+    red = ((r > 180) & (g < 80) & (b < 80)).astype(np.uint8) * 255
+    result = cv2.inpaint(img, cv2.dilate(red, np.ones((3, 3), np.uint8)), 5, cv2.INPAINT_TELEA)
+    return cv2.imencode(".jpg", result)[1].tobytes()
+
+def fake_consult_text(prompt):
+    """프롬프트의 Inventory에서 ID 5개를 고른 JSON 배열"""
+    ids = re.findall(r"- ID: ([^,\s]+),", prompt)[:5]
+    return json.dumps([{"selected_id": i, "reason": "테스트 추천", "position_suggestion": "창가"} for i in ids])
+
+def jpeg_pixels(jpeg_bytes):
+    shape = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_GRAYSCALE).shape
+    return shape[0] * shape[1]
+
+class FakeGeminiClient:
+    """
+    google.genai Client의 오프라인 대체 (프로세스 내부). `GEMINI.client = FakeGeminiClient()`로 교체해서 사용합니다.
+    - (aio.)models.generate_content(이미지 입력): fake_inpaint_jpeg 결과
+    - (aio.)models.generate_content(텍스트): fake_consult_text 결과
+    - aio.models.generate_content_stream(텍스트): 같은 결과를 stream_chunk_chars씩 나눈 chunk
+    - (aio.)models.embed_content: 해시 기반 결정적 벡터
+    지연 시간 모델 = base + 업로드(payload / bandwidth) + 입력 메가픽셀당 처리 시간.
+    스트리밍은 전체 지연 시간이 같고, 그중 출력 생성(글자 수 / stream_chars_per_s)이 chunk 사이에 나뉩니다.
+    sleep=False면 실제로 기다리지 않고 calls[-1]["simulated_latency_s"]에만 기록합니다.
+    """
+    def __init__(self, base_latency_s=0.8, upload_mbps=20.0, s_per_megapixel=1.5,
+                 output_max_side=1344, sleep=True, stream_chunk_chars=48, stream_chars_per_s=300.0):
+        self.base_latency_s = base_latency_s
+        self.upload_mbps = upload_mbps
+        self.s_per_megapixel = s_per_megapixel
+        self.output_max_side = output_max_side
+        self.sleep = sleep
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chars_per_s = stream_chars_per_s
+        self.calls = []
+        self.models = self  # client.models.generate_content(...)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self._generate_content_async,
+                                                          generate_content_stream=self._generate_content_stream_async,
+                                                          embed_content=self._embed_content_async))
+
+    def _record(self, record):
+        latency = (self.base_latency_s
+                   + record["payload_bytes"] * 8 / (self.upload_mbps * 1e6)
+                   + record["input_pixels"] / 1e6 * self.s_per_megapixel)
+        record["simulated_latency_s"] = round(latency, 3)
+        self.calls.append(record)
+        return latency
+
+    def _wait(self, record):
+        latency = self._record(record)
+        if self.sleep: time.sleep(latency)
+
+    def generate_content(self, model, contents, config=None):
+        images = [p.inline_data.data for p in contents if getattr(p, "inline_data", None)]
+        texts = [p for p in contents if isinstance(p, str)]
+        record = {"model": model, "payload_bytes": sum(len(b) for b in images) + sum(len(t) for t in texts), "input_pixels": 0}
+
+        if config is not None and "IMAGE" in (getattr(config, "response_modalities", None) or []):
+            record["input_pixels"] = jpeg_pixels(images[0])
+            result = fake_inpaint_jpeg(images[0], self.output_max_side)
+            self._wait(record)
+            part = SimpleNamespace(inline_data=SimpleNamespace(data=result))
+            return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))], text=None)
+
+        text = fake_consult_text("\n".join(texts))
+        self._wait(record)
+        return SimpleNamespace(candidates=[], text=text)
+
+    async def _generate_content_async(self, model, contents, config=None):
+        return await asyncio.to_thread(self.generate_content, model, contents, config)
+
+    async def _generate_content_stream_async(self, model, contents, config=None):
+        images = [p.inline_data.data for p in contents if getattr(p, "inline_data", None)]
+        texts = [p for p in contents if isinstance(p, str)]
+        text = fake_consult_text("\n".join(texts))
+        latency = self._record({"model": model, "stream": True, "input_pixels": 0,
+                                "payload_bytes": sum(len(b) for b in images) + sum(len(t) for t in texts)})
+        generation_s = min(latency, len(text) / self.stream_chars_per_s)
+        pieces = [text[i:i + self.stream_chunk_chars] for i in range(0, len(text), self.stream_chunk_chars)]
+
+        async def chunks():
+            if self.sleep: await asyncio.sleep(latency - generation_s)
+            for piece in pieces:
+                if self.sleep: await asyncio.sleep(generation_s / len(pieces))
+                yield SimpleNamespace(text=piece)
+        return chunks()
+
+    def embed_content(self, model, contents, config=None):
+        if isinstance(contents, str): contents = [contents]
+        embeddings = []
+        for text in contents:
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+            embeddings.append(SimpleNamespace(values=np.random.default_rng(seed).standard_normal(768).tolist()))
+        return SimpleNamespace(embeddings=embeddings)
+
+    async def _embed_content_async(self, model, contents, config=None):
+        return self.embed_content(model, contents, config)
+
+class FakeGeminiServer:
+    """
+    Gemini REST API(models/*:generateContent)를 흉내 내는 로컬 HTTP 서버. 429와 느린 응답을 시뮬레이션합니다.
+    genai.Client(api_key="fake", http_options=types.HttpOptions(base_url=server.url))로 연결하거나,
+    GEMINI_BASE_URL=server.url 환경 변수로 cell3.py를 실행하면 서버 전체를 오프라인으로 테스트할 수 있습니다.
+    - quota_per_s: 최근 1초 동안 허용하는 요청 수 (초과 시 429 RESOURCE_EXHAUSTED, None이면 무제한)
+    - latency_s: (min, max) 응답 지연, slow_ratio 확률로 slow_latency_s 추가
+    """
+    def __init__(self, quota_per_s=2.0, latency_s=(0.2, 0.6), slow_ratio=0.1, slow_latency_s=3.0, port=0, seed=0):
+        self.quota_per_s = quota_per_s
+        self.latency_s = latency_s
+        self.slow_ratio = slow_ratio
+        self.slow_latency_s = slow_latency_s
+        self.port = port
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = collections.deque()
+        self._active = 0
+        self.counters = {"requests": 0, "ok": 0, "throttled": 0, "max_concurrent": 0}
+        self.httpd = None
+        self.url = None
+
+    def _admit(self):
+        with self._lock:
+            self.counters["requests"] += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if self.quota_per_s is not None and len(self._recent) >= self.quota_per_s:
+                self.counters["throttled"] += 1
+                return None
+            self._recent.append(now)
+            self._active += 1
+            self.counters["max_concurrent"] = max(self.counters["max_concurrent"], self._active)
+            delay = self._rng.uniform(*self.latency_s)
+            if self._rng.random() < self.slow_ratio: delay += self.slow_latency_s
+            return delay
+
+    def handle(self, path, body):
+        delay = self._admit()
+        if delay is None:
+            return 429, {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}}
+        try:
+            if not path.split("?")[0].endswith(":generateContent"):
+                return 404, {"error": {"code": 404, "message": f"Unknown path {path}", "status": "NOT_FOUND"}}
+            time.sleep(delay)
+            images, texts = [], []
+            for content in body.get("contents", []):
+                for part in content.get("parts", []):
+                    inline = part.get("inlineData") or part.get("inline_data")
+                    if inline:  # SDK는 URL-safe base64를 보낼 수 있음
+                        data = inline["data"]
+                        images.append(base64.b64decode(data + "=" * (-len(data) % 4), altchars=b"-_"))
+                    if part.get("text"): texts.append(part["text"])
+            gen_config = body.get("generationConfig") or body.get("generation_config") or {}
+            modalities = gen_config.get("responseModalities") or gen_config.get("response_modalities") or []
+            if "IMAGE" in modalities and images:
+                data = base64.b64encode(fake_inpaint_jpeg(images[0])).decode("ascii")
+                parts = [{"inlineData": {"mimeType": "image/jpeg", "data": data}}]
+            else:
+                parts = [{"text": fake_consult_text("\n".join(texts))}]
+            with self._lock: self.counters["ok"] += 1
+            return 200, {"candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP"}]}
+        finally:
+            with self._lock: self._active -= 1
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status, payload = fake.handle(self.path, body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"🧪 Fake Gemini server: {self.url}")
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+# ==========================================
+# Stub Models (오프라인 파이프라인 벤치마크용)
+# ==========================================
+class StubBeitProcessor:
+    """BeitImageProcessor 대체: 640x640 리사이즈 + [-1, 1] 정규화"""
+    size = {"height": 640, "width": 640}
+
+    def __call__(self, images, return_tensors="pt"):
+        x = cv2.resize(images, (640, 640)).astype(np.float32) / 127.5 - 1.0
+        return {"pixel_values": torch.from_numpy(np.ascontiguousarray(x.transpose(2, 0, 1)[None]))}
+
+class StubSegModel:
+    """
+    BEiT 대체: 실제 모델과 같은 shape의 logits (150 classes, 입력의 1/4 해상도).
+    아래쪽이면서 밝기가 고른 영역을 floor(3)로, 나머지를 wall(0)로 분류합니다.
+    """
+    def __call__(self, pixel_values):
+        x = torch.nn.functional.avg_pool2d(pixel_values.float().cpu(), 4)
+        b, _, h, w = x.shape
+        logits = torch.zeros(b, 150, h, w)
+        rows = torch.linspace(0, 1, h).view(1, h, 1)
+        logits[:, 3] = (rows - 0.6) * 10 - (x.std(dim=1) * 4)
+        return SimpleNamespace(logits=logits)
+
+def stub_beit_model():
+    return BeitModel(StubBeitProcessor(), StubSegModel(), SegBatcher(StubSegModel(), BEIT_MAX_BATCH, BEIT_BATCH_WINDOW_MS))
+
+class StubSamPredictor:
+    """SamPredictor 대체: 클릭 지점에서 색 유사 영역(flood fill, 허용 오차 3단계)을 마스크 3개로 반환"""
+    # id(features) -> image (SamEmbeddingCache가 다른 predictor의 features를 복원해도 같은 이미지를 사용)
+    _images = {}
+    flood_flags = 0  # cv2.FLOODFILL_FIXED_RANGE면 이웃 대신 클릭 지점 색과 비교 (보간으로 생긴 완만한 경계를 넘지 않음)
+
+    def __init__(self):
+        self.reset_image()
+
+    def reset_image(self):
+        self.features, self.is_image_set = None, False
+        self.original_size = self.input_size = None
+
+    def set_image(self, image_rgb):
+        self.original_size = image_rgb.shape[:2]
+        self.input_size = (1024, int(1024 * image_rgb.shape[0] / image_rgb.shape[1]))
+        self.features = torch.zeros(1, 256, 64, 64)  # 실제 임베딩과 같은 크기 (캐시 메모리 계산용)
+        self._images[id(self.features)] = image_rgb
+        self.is_image_set = True
+
+    def predict(self, point_coords=None, point_labels=None, box=None, multimask_output=True, **kwargs):
+        """첫 번째 positive 점(없으면 box 중심)에서 flood fill, box가 있으면 box 안으로 자름"""
+        image = self._images[id(self.features)]
+        h, w = image.shape[:2]
+        positives = [p for p, label in zip(point_coords, point_labels) if label == 1] if point_coords is not None else []
+        x, y = (int(v) for v in positives[0]) if positives else (int((box[0] + box[2]) / 2), int((box[1] + box[3]) / 2))
+        masks = []
+        for tolerance in (6, 12, 24):
+            flood = np.zeros((h + 2, w + 2), np.uint8)
+            cv2.floodFill(image, flood, (min(x, w - 1), min(y, h - 1)), (0, 0, 0),
+                          (tolerance,) * 3, (tolerance,) * 3, cv2.FLOODFILL_MASK_ONLY | self.flood_flags | (255 << 8))
+            mask = flood[1:-1, 1:-1] > 0
+            if box is not None:
+                x0, y0, x1, y1 = (int(v) for v in box)
+                clipped = np.zeros_like(mask)
+                clipped[y0:y1, x0:x1] = mask[y0:y1, x0:x1]
+                mask = clipped
+            masks.append(mask)
+        if not multimask_output:
+            return np.stack(masks[1:2]), np.array([0.8]), np.zeros((1, 256, 256), np.float32)
+        return np.stack(masks), np.array([0.9, 0.8, 0.7]), np.zeros((3, 256, 256), np.float32)
+
+@contextlib.contextmanager
+def offline_pipeline(fake_client=None):
+    """
+    SAM / BEiT를 스텁으로, GEMINI를 FakeGeminiClient 게이트웨이(속도 제한 없음)로,
+    전역 client(인덱스 동기화용 임베딩)를 FakeGeminiClient로 잠시 교체합니다.
+    SAM 임베딩 캐시도 별도 인스턴스를 사용해 실제 캐시를 오염시키지 않습니다.
+    """
+    global GEMINI, client, sam_embedding_cache
+    saved = {name: MODELS.peek(name) for name in ("sam", "beit")}
+    saved_gateway, saved_client, saved_cache = GEMINI, client, sam_embedding_cache
+    fake_client = fake_client or FakeGeminiClient(sleep=False)
+    client = fake_client
+    MODELS.set("sam", SamPredictorPool([StubSamPredictor() for _ in range(SAM_WORKERS)]))
+    MODELS.set("beit", stub_beit_model())
+    GEMINI = GeminiGateway(fake_client, **{**GEMINI_CONFIG, "rate_per_s": 1000.0, "burst": 1000})
+    sam_embedding_cache = SamEmbeddingCache(SAM_CACHE_MAX_BYTES)
+    try:
+        yield fake_client
+    finally:
+        for name, value in saved.items(): MODELS.set(name, value)
+        GEMINI, client, sam_embedding_cache = saved_gateway, saved_client, saved_cache
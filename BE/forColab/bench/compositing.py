@@ -0,0 +1,71 @@
+# ==========================================
+# [Benchmark] process_removal Compositing: Full-Frame vs ROI
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (GPU / Gemini 호출 없음)
+# 큰 합성 파노라마에서 기존 전체 프레임 합성과 ROI 합성의
+# 지연 시간, 최대 메모리(tracemalloc), 결과 차이(PSNR)를 비교합니다.
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+BENCH_SIZES = [(4096, 2048), (8192, 4096)]  # (width, height) equirectangular
+BENCH_REPEAT = 3
+
+def composite_inpaint_fullframe(job, res_img):
+    """비교 기준: ROI 적용 이전의 전체 프레임 합성"""
+    from skimage import exposure
+    image, input_image, mask_dilated = job.image, job.input_image, job.mask_dilated
+    original_h, original_w = image.shape[:2]
+    proc_h, proc_w = input_image.shape[:2]
+    res_img_resized = cv2.resize(res_img, (proc_w, proc_h))
+    gemini_final_mid = exposure.match_histograms(res_img_resized, input_image, channel_axis=-1).astype(np.uint8)
+    if original_w != proc_w:
+        gemini_upscaled = cv2.resize(gemini_final_mid, (original_w, original_h), interpolation=cv2.INTER_LANCZOS4)
+        mask_upscaled = cv2.resize(mask_dilated, (original_w, original_h), interpolation=cv2.INTER_NEAREST)
+    else:
+        gemini_upscaled = gemini_final_mid
+        mask_upscaled = mask_dilated
+    mask_blurred = cv2.GaussianBlur(mask_upscaled.astype(np.float32) / 255.0, (21, 21), 0)
+    mask_blurred = np.dstack([mask_blurred] * 3)
+    final = gemini_upscaled.astype(np.float32) * mask_blurred + image.astype(np.float32) * (1.0 - mask_blurred)
+    return final.astype(np.uint8)
+
+def measure(fn, job, gemini):
+    timings, peaks, result = [], [], None
+    for _ in range(BENCH_REPEAT):
+        run_job = RemovalJob(image=job.image.copy(), input_image=job.input_image,
+                             image_rgb=job.image_rgb, mask_dilated=job.mask_dilated)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        result = fn(run_job, gemini)
+        timings.append(time.perf_counter() - t0)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"latency_ms": round(float(np.median(timings)) * 1000, 1), "peak_mb": round(max(peaks) / 1e6, 1)}, result
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else round(float(10 * np.log10(255.0 ** 2 / mse)), 2)
+
+def run_compositing_benchmark():
+    rows = []
+    for width, height in BENCH_SIZES:
+        job, gemini = synthetic_removal_job(width, height)
+        full_stats, full_result = measure(composite_inpaint_fullframe, job, gemini)
+        roi_stats, roi_result = measure(composite_inpaint, job, gemini)
+        row = {
+            "size": f"{width}x{height}",
+            "fullframe": full_stats,
+            "roi": roi_stats,
+            "speedup": round(full_stats["latency_ms"] / max(roi_stats["latency_ms"], 1e-3), 1),
+            "psnr_vs_fullframe": psnr(full_result, roi_result),
+        }
+        rows.append(row)
+        print(f"  {row['size']:>10}: full {full_stats}  roi {roi_stats}  x{row['speedup']}  PSNR {row['psnr_vs_fullframe']}dB")
+        del job, gemini, full_result, roi_result
+
+    save_bench_results("compositing", rows)
+    return rows
+
+run_compositing_benchmark()
@@ -0,0 +1,158 @@
+# ==========================================
+# [Benchmark] Concurrent SAM Requests: Predictor Isolation + Multi-Process Workers
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (GPU / Gemini / 모델 가중치 불필요)
+# 서로 다른 이미지 N장에 대한 segment_objects를 SAM Executor에서 동시에 실행하고, 순차 실행한 기준 마스크와 비교합니다.
+#   pool:   SamPredictorPool (요청마다 predictor를 빌림, 현재 구조)
+#   legacy: 모든 요청이 predictor 하나를 공유 (변경 전 전역 SamPredictor)
+#   fork:   SERVE_WORKERS처럼 모델을 로드한 프로세스에서 fork한 자식들이 동시에 마스크를 계산 (CPU 런타임)
+# 스텁 predictor는 set_image()와 predict() 사이에 BENCH_RACE_DELAY_S만큼 쉬어서 경쟁 구간을 넓힙니다.
+# legacy에서 ❌(다른 이미지의 임베딩으로 분할)가 나오고 pool / fork는 모두 ✅여야 합니다.
+# BENCH_USE_SAM=True면 실제 SAM(MODELS["sam"])으로 pool 검사를 한 번 더 실행합니다.
+import asyncio
+import os
+import pickle
+import time
+import cv2
+import numpy as np
+
+BENCH_SIZE = (2048, 1024)
+BENCH_IMAGES = 6
+BENCH_ROUNDS = 5
+BENCH_RACE_DELAY_S = 0.02
+BENCH_USE_SAM = True
+BENCH_FORK = True
+CONCURRENCY_MIN_IOU = 0.99  # 실제 SAM은 GPU 커널 비결정성으로 픽셀 단위까지 같지 않을 수 있음
+
+class SlowStubSamPredictor(StubSamPredictor):
+    def predict(self, *args, **kwargs):
+        time.sleep(BENCH_RACE_DELAY_S)
+        return super().predict(*args, **kwargs)
+
+def concurrency_inputs(width, height, n):
+    """이미지마다 다른 위치 / 색의 물체 하나와 그 클릭 지점 (다른 이미지의 임베딩으로 분할하면 마스크가 달라짐)"""
+    inputs = []
+    for i in range(n):
+        image = synthetic_room(width, height, seed=100 + i)
+        cx, cy = int(width * (0.15 + 0.7 * i / max(1, n - 1))), int(height * (0.7 + 0.15 * (i % 2)))
+        w, h = width // 30 + 8 * i, height // 14
+        cv2.rectangle(image, (cx - w, cy - h), (cx + w, cy + h), (20 + 35 * i, 200 - 25 * i, 90), -1)
+        jpeg = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), 95])[1].tobytes()
+        inputs.append((jpeg, [RemovalTarget(points=[(cx, cy)])]))
+    return inputs
+
+def mask_iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+def reference_masks(inputs):
+    return [segment_objects(jpeg, targets).mask_dilated > 0 for jpeg, targets in inputs]
+
+async def concurrent_round(inputs):
+    jobs = await asyncio.gather(*(INFERENCE["sam"].run(segment_objects, jpeg, targets) for jpeg, targets in inputs))
+    return [job.mask_dilated > 0 for job in jobs]
+
+async def check_isolation(name, inputs, references):
+    ious, t0 = [], time.perf_counter()
+    for _ in range(BENCH_ROUNDS):
+        masks = await concurrent_round(inputs)
+        ious += [mask_iou(m, r) for m, r in zip(masks, references)]
+    elapsed = time.perf_counter() - t0
+    row = {
+        "mode": name,
+        "requests": len(ious),
+        "wrong_masks": sum(iou < CONCURRENCY_MIN_IOU for iou in ious),
+        "min_iou": round(min(ious), 4),
+        "requests_per_s": round(len(ious) / elapsed, 2),
+    }
+    row["passed"] = row["wrong_masks"] == 0
+    print(f"  {name:>8}: {row['requests']} requests, wrong masks {row['wrong_masks']}  min IoU {row['min_iou']}  "
+          f"{row['requests_per_s']} req/s  {'✅' if row['passed'] else '❌'}")
+    return row
+
+def private_mb():
+    """이 프로세스만 쓰는 메모리 (fork 후 Copy-on-Write로 복사된 페이지 포함)"""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, value = line.split()[:2]
+            if key in ("Rss:", "Private_Clean:", "Private_Dirty:"): values[key[:-1]] = int(value) / 1024
+    return round(values["Private_Clean"] + values["Private_Dirty"], 1), round(values["Rss"], 1)
+
+def check_fork(inputs, references):
+    """입력마다 자식 프로세스를 fork해서 동시에 segment_objects를 실행하고 마스크 / 프로세스별 메모리를 받아옵니다."""
+    children = []
+    for i, (jpeg, targets) in enumerate(inputs):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(read_fd)
+                init_worker(i + 1, len(inputs))
+                mask = segment_objects(jpeg, targets).mask_dilated > 0
+                with os.fdopen(write_fd, "wb") as f: pickle.dump((np.packbits(mask), mask.shape, private_mb()), f)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    rows = []
+    for (pid, read_fd), reference in zip(children, references):
+        with os.fdopen(read_fd, "rb") as f: payload = f.read()
+        _, status = os.waitpid(pid, 0)
+        if status != 0 or not payload:
+            rows.append({"pid": pid, "iou": 0.0, "private_mb": None, "rss_mb": None})
+            continue
+        packed, shape, (private, rss) = pickle.loads(payload)
+        mask = np.unpackbits(packed)[:shape[0] * shape[1]].reshape(shape).astype(bool)
+        rows.append({"pid": pid, "iou": round(mask_iou(mask, reference), 4), "private_mb": private, "rss_mb": rss})
+    wrong = sum(r["iou"] < CONCURRENCY_MIN_IOU for r in rows)
+    private = [r["private_mb"] for r in rows if r["private_mb"] is not None]
+    print(f"  {'fork':>8}: {len(rows)} processes, wrong masks {wrong}  "
+          f"private memory per worker {max(private) if private else '-'}MB (parent RSS {current_rss_mb():.0f}MB)  "
+          f"{'✅' if wrong == 0 else '❌'}")
+    return {"mode": "fork", "workers": rows, "wrong_masks": wrong, "passed": wrong == 0}
+
+async def run_stub_checks(inputs):
+    rows = []
+    with offline_pipeline():
+        MODELS.set("sam", SamPredictorPool([SlowStubSamPredictor() for _ in range(SAM_WORKERS)]))
+        references = reference_masks(inputs)
+        rows.append(await check_isolation("pool", inputs, references))
+        shared = SlowStubSamPredictor()
+        MODELS.set("sam", SamPredictorPool([shared] * SAM_WORKERS))
+        rows.append(await check_isolation("legacy", inputs, references))
+        if BENCH_FORK and device == "cpu":
+            MODELS.set("sam", SamPredictorPool([StubSamPredictor() for _ in range(SAM_WORKERS)]))
+            rows.append(check_fork(inputs, references))
+    return rows
+
+async def run_sam_checks(inputs):
+    try:
+        MODELS.get("sam")
+    except Exception as e:
+        print(f"⚠️ SAM unavailable ({getattr(e, 'detail', e)}), skipping real-model check")
+        return []
+    references = reference_masks(inputs)
+    rows = [await check_isolation("sam", inputs, references)]
+    if BENCH_FORK and device == "cpu":
+        rows.append({**check_fork(inputs, references), "mode": "sam-fork"})
+    return rows
+
+async def run_concurrency_benchmark():
+    inputs = concurrency_inputs(*BENCH_SIZE, BENCH_IMAGES)
+    print(f"SAM_WORKERS={SAM_WORKERS}, {BENCH_IMAGES} images x {BENCH_ROUNDS} rounds")
+    rows = await run_stub_checks(inputs)
+    if BENCH_USE_SAM: rows += await run_sam_checks(inputs)
+
+    save_bench_results("concurrency", {"SAM_WORKERS": SAM_WORKERS, "device": device, "size": f"{BENCH_SIZE[0]}x{BENCH_SIZE[1]}",
+                                       "images": BENCH_IMAGES, "rounds": BENCH_ROUNDS, "min_iou": CONCURRENCY_MIN_IOU,
+                                       "rows": rows})
+    failed = [r["mode"] for r in rows if r["mode"] != "legacy" and not r["passed"]]
+    if failed: print(f"❌ Masks changed under concurrency: {failed}")
+    return rows
+
+await run_concurrency_benchmark()
@@ -0,0 +1,114 @@
+# ==========================================
+# [Benchmark] Consult: Buffered vs Streaming vs Cached
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (Cell 4 이전, Gemini 쿼터 불필요)
+# 1) Parser: ConsultPickStream에 Gemini 출력을 임의의 위치에서 잘라 넣어도 json.loads 결과와 같은지 확인 (❌면 회귀)
+# 2) Latency: BENCH_PORT에 uvicorn 서버를 띄우고 FakeGeminiClient(스트리밍 지연 모델)로
+#    /consult(전체 응답), /consult/stream(NDJSON / SSE)의 첫 추천 항목까지 시간과 전체 시간,
+#    같은 요청을 반복했을 때(ConsultCache HIT)의 시간을 비교합니다.
+import asyncio
+import json
+import random
+import time
+import cv2
+import httpx
+import uvicorn
+
+BENCH_PORT = 8002
+BENCH_REPEAT = 5
+BENCH_IMAGE_SIZE = (4096, 2048)
+BENCH_PROMPT = "모던한 거실에 어울리는 소파와 조명을 추천해줘"
+BENCH_TIMEOUT_S = 120
+
+PARSER_SAMPLES = [
+    fake_consult_text("- ID: A1, x\n- ID: B2, y\n- ID: C3, z"),
+    "```json\n" + json.dumps([{"selected_id": "A1", "reason": "따옴표 \" 와 괄호 ]} 포함", "position_suggestion": "창가 {왼쪽}"}], indent=2) + "\n```",
+    json.dumps({"selected_id": "B2", "reason": "단일 객체 \\ 백슬래시", "position_suggestion": "벽 [중앙]"}),
+    json.dumps([{"selected_id": "C3", "reason": "중첩", "position_suggestion": "x", "extra": {"a": [1, {"b": 2}]}}]),
+]
+
+def check_parser(samples=PARSER_SAMPLES, random_splits=200):
+    rng = random.Random(0)
+    failures = 0
+    for text in samples:
+        expected = json.loads(text.replace("```json", "").replace("```", "").strip())
+        expected = expected if isinstance(expected, list) else [expected]
+        splits = [[i] for i in range(len(text) + 1)] + [sorted(rng.sample(range(len(text)), 5)) for _ in range(random_splits)]
+        for cuts in splits:
+            parser, picks, last = ConsultPickStream(), [], 0
+            for cut in cuts + [len(text)]:
+                picks += parser.feed(text[last:cut])
+                last = cut
+            failures += picks != expected
+    print(f"  parser: {len(samples)} samples, {failures} mismatched chunkings {'✅' if failures == 0 else '❌'}")
+    return {"samples": len(samples), "failures": failures, "passed": failures == 0}
+
+def consult_request_fields(jpeg, prompt):
+    return {"files": {"image": ("room.jpg", jpeg, "image/jpeg")}, "data": {"user_prompt": prompt}}
+
+async def timed_consult(http, jpeg, prompt):
+    t0 = time.perf_counter()
+    response = await http.post("/consult", **consult_request_fields(jpeg, prompt))
+    elapsed = time.perf_counter() - t0
+    return {"first_item_s": elapsed, "total_s": elapsed, "items": len(response.json()),
+            "cache": response.headers.get("x-consult-cache")}
+
+async def timed_consult_stream(http, jpeg, prompt, sse=False):
+    headers = {"Accept": "text/event-stream"} if sse else {}
+    t0, first, items, cache = time.perf_counter(), None, 0, None
+    async with http.stream("POST", "/consult/stream", headers=headers, **consult_request_fields(jpeg, prompt)) as response:
+        cache = response.headers.get("x-consult-cache")
+        async for line in response.aiter_lines():
+            if sse:
+                if not line.startswith("data: "): continue
+                line = line[len("data: "):]
+            if not line: continue
+            event = json.loads(line)
+            if event["type"] == "item":
+                items += 1
+                if first is None: first = time.perf_counter() - t0
+            elif event["type"] == "error":
+                print(f"  ⚠️ stream error: {event}")
+    return {"first_item_s": first, "total_s": time.perf_counter() - t0, "items": items, "cache": cache}
+
+def summarize(name, runs):
+    first = [r["first_item_s"] for r in runs if r["first_item_s"] is not None]
+    row = {"mode": name, "first_item_ms": percentiles_ms(first), "total_ms": percentiles_ms([r["total_s"] for r in runs]),
+           "items": runs[-1]["items"], "cache": sorted({r["cache"] for r in runs if r["cache"]})}
+    print(f"  {name:>16}: first item p50 {row['first_item_ms']['p50']}ms  total p50 {row['total_ms']['p50']}ms  "
+          f"items {row['items']}  cache {row['cache']}")
+    return row
+
+async def drive_consults(base_url, jpeg):
+    modes = {
+        "buffered": lambda http, p: timed_consult(http, jpeg, p),
+        "stream-ndjson": lambda http, p: timed_consult_stream(http, jpeg, p),
+        "stream-sse": lambda http, p: timed_consult_stream(http, jpeg, p, sse=True),
+    }
+    rows = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=BENCH_TIMEOUT_S) as http:
+        for name, run in modes.items():
+            # 프롬프트를 바꿔 매번 캐시 MISS, 이어서 같은 프롬프트로 한 번 더 (HIT)
+            misses = [await run(http, f"{BENCH_PROMPT} ({name} {i})") for i in range(BENCH_REPEAT)]
+            hits = [await run(http, f"{BENCH_PROMPT}  ({name} {i})") for i in range(BENCH_REPEAT)]  # 공백만 다른 프롬프트
+            rows += [summarize(name, misses), summarize(f"{name} (cached)", hits)]
+    return rows
+
+async def run_consult_stream_benchmark():
+    parser = check_parser()
+    jpeg = cv2.imencode(".jpg", synthetic_room(*BENCH_IMAGE_SIZE), [int(cv2.IMWRITE_JPEG_QUALITY), 90])[1].tobytes()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=BENCH_PORT, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started: await asyncio.sleep(0.1)
+    try:
+        with offline_pipeline(FakeGeminiClient()):
+            rows = await drive_consults(f"http://127.0.0.1:{BENCH_PORT}", jpeg)
+    finally:
+        server.should_exit = True
+        await server_task
+
+    save_bench_results("consult_stream", {"image_size": BENCH_IMAGE_SIZE, "repeat": BENCH_REPEAT,
+                                          "parser": parser, "modes": rows, "consult_cache": consult_cache.stats()})
+    return rows
+
+await run_consult_stream_benchmark()
@@ -0,0 +1,92 @@
+# ==========================================
+# [Benchmark] CPU Backend: PyTorch vs ONNX Runtime (fp32 / int8)
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. CPU 전용 런타임에서 실행해야
+# torch 행이 CPU 기준이 됩니다. (ONNX export / 양자화는 ONNX_DIR에 한 번만 저장됨)
+# 1) Parity: 바닥 마스크(BEiT)와 SAM 마스크를 PyTorch 결과와 IoU로 비교, 임계값 미만이면 ❌
+# 2) Latency: BEiT forward(640x640)와 SAM set_image(인코더) 지연 시간 (median)
+import gc
+import time
+import cv2
+import numpy as np
+import torch
+
+BENCH_BACKENDS = ["torch", "onnx", "onnx-int8"]
+PARITY_MIN_IOU = {"onnx": 0.98, "onnx-int8": 0.90}
+BENCH_REPEAT = 5
+BENCH_MAX_IMAGES = 4
+SAM_POINTS = [(0.25, 0.7), (0.5, 0.6), (0.75, 0.7), (0.5, 0.85)]  # (x, y) 비율
+
+def mask_iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+def floor_mask(image, beit):
+    png = detect_floor_mask_png(image, beit)
+    if not png: return np.zeros(image.shape[:2], dtype=bool)
+    return cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_UNCHANGED)[..., 3] > 0
+
+def sam_masks(image, predictor):
+    """segment_object와 같은 2048px 입력 + 3개 마스크 합집합"""
+    scale = min(1.0, 2048 / image.shape[1])
+    image_rgb = cv2.cvtColor(cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+    predictor.set_image(image_rgb)
+    h, w = image_rgb.shape[:2]
+    masks = []
+    for fx, fy in SAM_POINTS:
+        m, _, _ = predictor.predict(point_coords=np.array([[int(w * fx), int(h * fy)]]), point_labels=np.array([1]), multimask_output=True)
+        masks.append(m[0] | m[1] | m[2])
+    return masks
+
+def median_ms(fn):
+    fn()  # warm-up
+    timings = []
+    for _ in range(BENCH_REPEAT):
+        t0 = time.perf_counter()
+        with torch.no_grad(): fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return round(float(np.median(timings)), 1)
+
+def run_cpu_backend_benchmark():
+    images = room_images(BENCH_MAX_IMAGES, synthetic_sizes=((2048, 1024), (2048, 1024)))
+    sam_input = cv2.cvtColor(cv2.resize(images[0], (2048, 1024)), cv2.COLOR_BGR2RGB)
+    rows, reference = [], None
+    for backend in BENCH_BACKENDS:
+        beit, predictor = load_beit(backend), load_sam(backend)
+        pixel_values = beit.processor(images=cv2.cvtColor(images[0], cv2.COLOR_BGR2RGB), return_tensors="pt")["pixel_values"]
+        pixel_values = pixel_values.to(backend_device(backend))
+        row = {
+            "backend": backend,
+            "device": backend_device(backend),
+            "threads": ONNX_THREADS if backend != "torch" else torch.get_num_threads(),
+            "beit_forward_ms": median_ms(lambda: beit.model(pixel_values=pixel_values)),
+            "sam_encoder_ms": median_ms(lambda: predictor.set_image(sam_input)),
+        }
+        floors = [floor_mask(image, beit) for image in images]
+        sams = [sam_masks(image, predictor) for image in images]
+        if reference is None:
+            reference = (floors, sams)
+        else:
+            floor_ious = [mask_iou(a, b) for a, b in zip(floors, reference[0])]
+            sam_ious = [mask_iou(a, b) for ms, refs in zip(sams, reference[1]) for a, b in zip(ms, refs)]
+            threshold = PARITY_MIN_IOU[backend]
+            row["parity"] = {
+                "floor_iou_min": round(min(floor_ious), 4),
+                "sam_iou_min": round(min(sam_ious), 4),
+                "threshold": threshold,
+                "passed": min(floor_ious) >= threshold and min(sam_ious) >= threshold,
+            }
+        rows.append(row)
+        parity = row.get("parity")
+        parity_text = (f"  floor IoU {parity['floor_iou_min']}  SAM IoU {parity['sam_iou_min']}  "
+                       f"{'✅' if parity['passed'] else '❌'} (>= {parity['threshold']})") if parity else "  (reference)"
+        print(f"  {backend:>9}: BEiT {row['beit_forward_ms']}ms  SAM encoder {row['sam_encoder_ms']}ms{parity_text}")
+        del beit, predictor
+        gc.collect()
+
+    save_bench_results("cpu_backend", {"sam_model_type": SAM_MODEL_TYPE, "images": len(images), "backends": rows})
+    failed = [r["backend"] for r in rows if r.get("parity") and not r["parity"]["passed"]]
+    if failed: print(f"❌ Parity check failed: {failed}")
+    return rows
+
+run_cpu_backend_benchmark()
@@ -0,0 +1,207 @@
+# ==========================================
+# [Benchmark] GLB Downloader + Catalog JSON Stream
+# ==========================================
+# cell2.py, cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (네트워크 / S3 불필요)
+# 임시 디렉토리에 DirectoryS3 버킷을 만들고, 모델마다 서로 다른 키 레이아웃에 GLB를 넣어 GlbDownloader를 확인합니다.
+# 1) layout: 모델별로 성공한 레이아웃이 manifest에 기록되고, 다음 실행에서 그 레이아웃부터 시도하는지
+# 2) failures: 없는 모델은 레이아웃마다 404 1회씩, 검증 실패는 그 레이아웃의 ValueError로 집계되는지
+# 3) resume: 같은 manifest로 다시 실행하면 S3 호출 없이 건너뛰고, 지워진 파일만 캐시된 레이아웃으로 받는지
+# 4) verify: 크기 / MD5가 HEAD와 다른 다운로드는 거부되고 (파일 / .part / manifest 없음), multipart ETag는 크기만 검증하는지
+# 5) json: iter_json_array가 닫는 "]" 없이 잘린 파일에서 ValueError를 내는지
+# 6) throughput: 요청당 지연을 흉내 낸 DirectoryS3로 DOWNLOAD_WORKERS 동시 다운로드 vs 1개
+# 하나라도 ❌면 마지막에 AssertionError를 냅니다.
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+import numpy as np
+
+BENCH_BUCKET = "bench-bucket"
+BENCH_MODELS = 24                # layout 확인용 모델 수 (레이아웃마다 8개)
+BENCH_MISSING = 4                # 어느 레이아웃에도 없는 모델 수
+BENCH_THROUGHPUT_MODELS = 48
+BENCH_FILE_KB = (64, 512)        # GLB 크기 범위
+BENCH_S3_LATENCY_S = 0.02        # throughput 측정용 요청당 지연 (HEAD / GET 각각)
+
+class CountingS3:
+    """DirectoryS3 호출 수를 세고, corrupt(path)가 있으면 받은 파일을 변형합니다. (전송 오류 / 손상 흉내)"""
+    def __init__(self, inner, corrupt=None, latency_s=0.0, etag=None):
+        self.inner = inner
+        self.corrupt = corrupt
+        self.latency_s = latency_s
+        self.etag = etag
+        self.calls = Counter()
+
+    def head_object(self, Bucket, Key):
+        self.calls["head"] += 1
+        if self.latency_s: time.sleep(self.latency_s)
+        head = self.inner.head_object(Bucket=Bucket, Key=Key)
+        return {**head, "ETag": self.etag} if self.etag else head
+
+    def download_file(self, bucket, key, filename):
+        self.calls["get"] += 1
+        if self.latency_s: time.sleep(self.latency_s)
+        self.inner.download_file(bucket, key, filename)
+        if self.corrupt: self.corrupt(filename)
+
+def truncate_last_byte(path):
+    with open(path, "rb+") as f:
+        f.truncate(os.path.getsize(path) - 1)
+
+def flip_first_byte(path):
+    with open(path, "rb+") as f:
+        first = f.read(1)
+        f.seek(0)
+        f.write(bytes([first[0] ^ 0xFF]))
+
+def model_ids(prefix, count):
+    # 마지막 글자(suffix)가 키 경로에 들어가므로 0-9, A-F가 고르게 섞이도록
+    return [f"{prefix}{i:06d}{'0123456789ABCDEF'[i % 16]}" for i in range(count)]
+
+def build_bucket(root, ids, rng):
+    """ids[i]를 GLB_KEY_LAYOUTS의 i번째 레이아웃(순환)에 넣고 {model_id: layout}을 반환합니다."""
+    layouts = list(GLB_KEY_LAYOUTS)
+    placed = {}
+    for i, model_id in enumerate(ids):
+        layout = layouts[i % len(layouts)]
+        key = GLB_KEY_LAYOUTS[layout].format(suffix=model_id[-1], model_id=model_id)
+        path = os.path.join(root, BENCH_BUCKET, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(rng.bytes(int(rng.integers(*BENCH_FILE_KB)) * 1024))
+        placed[model_id] = layout
+    return placed
+
+def new_downloader(s3, workdir, name, **kwargs):
+    model_dir = os.path.join(workdir, name)
+    os.makedirs(model_dir, exist_ok=True)
+    return GlbDownloader(s3, BENCH_BUCKET, model_dir, os.path.join(workdir, f"{name}.manifest.json"), **kwargs)
+
+def run_downloads(downloader, ids):
+    return dict((item["3dmodel_id"], ok) for item, ok in downloader.download_many({"3dmodel_id": i} for i in ids))
+
+def report_check(name, passed, detail):
+    print(f"  {name}: {detail} {'✅' if passed else '❌'}")
+    return {"check": name, "detail": detail, "passed": bool(passed)}
+
+def check_layouts_and_resume(root, workdir, placed, missing):
+    rows = []
+    ids = list(placed) + missing
+    s3 = CountingS3(DirectoryS3(root))
+    first = new_downloader(s3, workdir, "resume")
+    results = run_downloads(first, ids)
+
+    with open(first.manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    wrong = [i for i in placed if manifest.get(i, {}).get("layout") != placed[i]]
+    rows.append(report_check("layout", not wrong and all(results[i] for i in placed) and not any(results[i] for i in missing),
+                             f"{len(placed) - len(wrong)}/{len(placed)} layouts recorded, wins {dict(first.layout_wins)}"))
+
+    # 없는 모델만 레이아웃별로 404 (다른 모델의 시도 순서에 따른 404는 layout_wins에 따라 달라지므로 별도 인스턴스로 측정)
+    only_missing = new_downloader(DirectoryS3(root), workdir, "missing")
+    run_downloads(only_missing, missing)
+    expected = {layout: {"404": len(missing)} for layout in GLB_KEY_LAYOUTS}
+    failures = {layout: dict(codes) for layout, codes in only_missing.failures.items()}
+    rows.append(report_check("failures", failures == expected, f"{failures}"))
+
+    # 같은 manifest로 재실행: 전부 건너뛰고 S3 호출 없음
+    s3 = CountingS3(DirectoryS3(root))
+    second = new_downloader(s3, workdir, "resume")
+    run_downloads(second, list(placed))
+    rows.append(report_check("resume", second.files_skipped == len(placed) and sum(s3.calls.values()) == 0,
+                             f"skipped {second.files_skipped}/{len(placed)}, S3 calls {dict(s3.calls)}"))
+
+    # 파일 하나를 지우면 그 모델만, manifest의 레이아웃으로 한 번에 (HEAD 1 + GET 1)
+    lost = next(i for i in placed if placed[i] != max(second.layout_wins, key=second.layout_wins.get))
+    os.remove(second.local_path(lost))
+    s3 = CountingS3(DirectoryS3(root))
+    third = new_downloader(s3, workdir, "resume")
+    run_downloads(third, list(placed))
+    rows.append(report_check("cached layout", third.files_downloaded == 1 and s3.calls == Counter(head=1, get=1)
+                             and third._layouts_for(lost)[0] == placed[lost],
+                             f"re-downloaded {third.files_downloaded} ({placed[lost]}), S3 calls {dict(s3.calls)}"))
+    return rows
+
+def check_verification(root, workdir, placed):
+    rows = []
+    model_id, layout = next(iter(placed.items()))
+    for name, corrupt, etag in (("size", truncate_last_byte, None), ("md5", flip_first_byte, None),
+                                ("multipart etag", flip_first_byte, '"0123456789abcdef0123456789abcdef-2"')):
+        downloader = new_downloader(CountingS3(DirectoryS3(root), corrupt=corrupt, etag=etag), workdir, f"verify-{name}")
+        ok = downloader.download(model_id)
+        stored = os.path.exists(downloader.local_path(model_id)) or model_id in downloader.manifest
+        leftover = os.path.exists(downloader.local_path(model_id) + ".part")
+        if etag:
+            # multipart ETag는 MD5가 아니므로 크기가 맞으면 그대로 받음
+            passed, detail = ok and stored, f"accepted (size only), ok={ok}"
+        else:
+            passed = not ok and not stored and not leftover and downloader.failures[layout]["ValueError"] == 1
+            detail = f"rejected={not ok}, .part left={leftover}, failures[{layout}]={dict(downloader.failures[layout])}"
+        rows.append(report_check(f"verify {name}", passed, detail))
+    return rows
+
+def check_json_stream(workdir):
+    rows = []
+    cases = {
+        "complete": ('[{"id": "x"}, {"id": "y"}]', ["x", "y"]),
+        "truncated before ]": ('[{"id": "x"}', ValueError),
+        "truncated after ,": ('[{"id": "x"},', ValueError),
+        "truncated object": ('[{"id": "x"}, {"id"', ValueError),
+        "empty file": ("", ValueError),
+    }
+    path = os.path.join(workdir, "catalog.json")
+    for name, (text, expected) in cases.items():
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        outcomes = set()
+        for chunk_size in (1, 4, 1 << 16):
+            try:
+                outcomes.add(tuple(obj["id"] for obj in iter_json_array(path, chunk_size)))
+            except ValueError:
+                outcomes.add(ValueError)
+        passed = outcomes == ({tuple(expected)} if isinstance(expected, list) else {ValueError})
+        rows.append(report_check(f"json {name}", passed, "raises ValueError" if outcomes == {ValueError} else f"{outcomes}"))
+    return rows
+
+def throughput_rows(root, workdir, ids):
+    rows = []
+    for workers in sorted({1, DOWNLOAD_WORKERS}):
+        s3 = CountingS3(DirectoryS3(root), latency_s=BENCH_S3_LATENCY_S)
+        downloader = new_downloader(s3, workdir, f"throughput-{workers}", max_workers=workers)
+        t0 = time.perf_counter()
+        results = run_downloads(downloader, ids)
+        elapsed = time.perf_counter() - t0
+        mb = downloader.bytes_downloaded / 2**20
+        rows.append({"workers": workers, "files": sum(results.values()), "s": round(elapsed, 3),
+                     "files_per_s": round(sum(results.values()) / elapsed, 1), "mb_per_s": round(mb / elapsed, 1),
+                     "s3_calls": dict(s3.calls)})
+    for row in rows:
+        print(f"  throughput: workers={row['workers']:<3} {row['files']} files in {row['s']:.2f}s "
+              f"-> {row['files_per_s']} files/s, {row['mb_per_s']} MB/s")
+    return rows
+
+def run_downloader_benchmark():
+    rng = np.random.default_rng(0)
+    workdir = tempfile.mkdtemp(prefix="glb-bench-")
+    root = os.path.join(workdir, "s3")
+    try:
+        placed = build_bucket(root, model_ids("B0LAYOUT", BENCH_MODELS), rng)
+        missing = model_ids("B0MISSNG", BENCH_MISSING)
+        print("🔎 GlbDownloader checks (DirectoryS3)")
+        checks = check_layouts_and_resume(root, workdir, placed, missing)
+        checks += check_verification(root, workdir, placed)
+        checks += check_json_stream(workdir)
+        print(f"⏱️ Throughput ({BENCH_S3_LATENCY_S * 1000:.0f} ms per S3 request)")
+        throughput_ids = list(build_bucket(root, model_ids("B0THRUPT", BENCH_THROUGHPUT_MODELS), rng))
+        throughput = throughput_rows(root, workdir, throughput_ids)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    save_bench_results("downloader", {"models": BENCH_MODELS, "missing": BENCH_MISSING, "DOWNLOAD_WORKERS": DOWNLOAD_WORKERS,
+                                      "checks": checks, "throughput": throughput})
+    failed = [row["check"] for row in checks if not row["passed"]]
+    assert not failed, f"GlbDownloader checks failed: {failed}"
+
+run_downloader_benchmark()
@@ -0,0 +1,123 @@
+# ==========================================
+# [Benchmark] Floor Mask Post-Processing: Legacy vs Score-Map Engine
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요.
+# 같은 BEiT logits로 기존 후처리(150채널 업샘플링 + argmax + np.isin + RGBA 4회 대입)와
+# 현재 floor_mask_from_logits + floor_overlay_png를 비교합니다.
+# 1) Regression: 바닥 마스크 IoU가 FLOOR_POST_MIN_IOU 미만이면 ❌
+# 2) Latency: 후처리 / PNG 단계 (median), mask_resolution="original" 출력 비용
+# 3) mask_format별 응답 크기 (PNG Base64 / polygon JSON / RLE JSON)와 polygon을 다시 그렸을 때의 IoU
+# BENCH_USE_BEIT=True면 실제 BEiT(MODELS["beit"]), 모델을 로드할 수 없으면 스텁 모델 logits를 사용합니다.
+import base64
+import json
+import time
+import cv2
+import numpy as np
+import torch
+
+BENCH_USE_BEIT = True
+BENCH_MAX_IMAGES = 4
+BENCH_REPEAT = 10
+FLOOR_POST_MIN_IOU = 0.98
+
+def legacy_floor_mask(logits, size):
+    """변경 전 detect_floor_mask_png의 후처리 (기준 출력)"""
+    new_w, new_h = size
+    upsampled_logits = torch.nn.functional.interpolate(logits, size=(new_h, new_w), mode="bilinear", align_corners=False)
+    pred_seg = upsampled_logits.argmax(dim=1)[0].cpu().numpy()
+    floor_mask_binary = np.isin(pred_seg, [3, 9, 27, 29]).astype(np.uint8)
+    floor_mask_binary[int(new_h * 0.95):, :] = 1
+    kernel = np.ones((FLOOR_CLOSE_KSIZE, FLOOR_CLOSE_KSIZE), np.uint8)
+    floor_mask_binary = cv2.morphologyEx(floor_mask_binary, cv2.MORPH_CLOSE, kernel)
+    contours, hierarchy = cv2.findContours(floor_mask_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if contours:
+        filled_mask = np.zeros_like(floor_mask_binary)
+        cv2.drawContours(filled_mask, contours, -1, 1, thickness=cv2.FILLED)
+        floor_mask_binary = cv2.bitwise_or(floor_mask_binary, filled_mask)
+    return floor_mask_binary
+
+def legacy_overlay_png(floor_mask_binary):
+    h, w = floor_mask_binary.shape[:2]
+    rgba_image = np.zeros((h, w, 4), dtype=np.uint8)
+    mask_bool = (floor_mask_binary >= 1)
+    rgba_image[mask_bool, 0] = 0
+    rgba_image[mask_bool, 1] = 255
+    rgba_image[mask_bool, 2] = 0
+    rgba_image[mask_bool, 3] = 200
+    return cv2.imencode(".png", rgba_image)[1].tobytes()
+
+def median_ms(fn):
+    fn()
+    samples = []
+    for _ in range(BENCH_REPEAT):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return round(float(np.median(samples)), 2)
+
+def mask_iou(a, b):
+    a, b = a > 0, b > 0
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+def format_sizes(mask):
+    png, floor_mask = encode_floor_mask(mask, set(MASK_FORMATS))
+    h, w = mask.shape[:2]
+    redrawn = np.zeros_like(mask)
+    for polygon in floor_mask.polygons:
+        cv2.fillPoly(redrawn, [np.round(np.array(polygon) * (w, h) - 0.5).astype(np.int32)], 1)
+    return {
+        "png_base64_kb": round(len(base64.b64encode(png)) / 1024, 2),
+        "polygon_kb": round(len(json.dumps(floor_mask.polygons)) / 1024, 2),
+        "rle_kb": round(len(json.dumps(floor_mask.rle)) / 1024, 2),
+        "polygon_iou": round(mask_iou(mask, redrawn), 4),
+        "vector_ms": median_ms(lambda: encode_floor_mask(mask, {"polygon", "rle"})),
+    }
+
+def bench_beit():
+    if BENCH_USE_BEIT:
+        try:
+            return MODELS.get("beit"), "beit"
+        except Exception as e:
+            print(f"⚠️ BEiT unavailable ({e}), using stub logits")
+    return stub_beit_model(), "stub"
+
+def run_floor_post_benchmark():
+    beit, source = bench_beit()
+    rows = []
+    for i, image in enumerate(room_images(BENCH_MAX_IMAGES, synthetic_sizes=((4096, 2048), (8192, 4096)))):
+        h, w = image.shape[:2]
+        scale = FLOOR_TARGET_SIZE / max(h, w)
+        size = (int(w * scale), int(h * scale))
+        image_rgb = cv2.cvtColor(cv2.resize(image, size), cv2.COLOR_BGR2RGB)
+        with torch.no_grad():
+            logits = beit.batcher.infer(beit.processor(images=image_rgb, return_tensors="pt")["pixel_values"])
+
+        legacy, current = legacy_floor_mask(logits, size), floor_mask_from_logits(logits, size)
+        row = {
+            "image": f"{w}x{h}#{i}",
+            "iou": round(mask_iou(legacy, current), 4),
+            "floor_ratio": round(float(legacy.mean()), 3),
+            "legacy_post_ms": median_ms(lambda: legacy_floor_mask(logits, size)),
+            "post_ms": median_ms(lambda: floor_mask_from_logits(logits, size)),
+            "legacy_png_ms": median_ms(lambda: legacy_overlay_png(legacy)),
+            "png_ms": median_ms(lambda: floor_overlay_png(current)),
+            "original_png_ms": median_ms(lambda: floor_overlay_png(current, (w, h))),
+            "formats": format_sizes(current),
+        }
+        row["passed"] = row["iou"] >= FLOOR_POST_MIN_IOU
+        rows.append(row)
+        print(f"  {row['image']:>14}: IoU {row['iou']} {'✅' if row['passed'] else '❌'}  "
+              f"post {row['legacy_post_ms']} -> {row['post_ms']}ms  png {row['legacy_png_ms']} -> {row['png_ms']}ms  "
+              f"original-size png {row['original_png_ms']}ms")
+        f = row["formats"]
+        print(f"  {'':>14}  png(base64) {f['png_base64_kb']}KB  polygon {f['polygon_kb']}KB (IoU {f['polygon_iou']})  "
+              f"rle {f['rle_kb']}KB  vector encode {f['vector_ms']}ms")
+
+    save_bench_results("floor_post", {"logits": source, "device": device, "FLOOR_TARGET_SIZE": FLOOR_TARGET_SIZE,
+                                      "min_iou": FLOOR_POST_MIN_IOU, "images": rows})
+    failed = [r["image"] for r in rows if not r["passed"]]
+    if failed: print(f"❌ Floor mask regression (IoU < {FLOOR_POST_MIN_IOU}): {failed}")
+    return rows
+
+run_floor_post_benchmark()
@@ -0,0 +1,114 @@
+# ==========================================
+# [Benchmark] Gemini Gateway vs Per-Request Retries
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (Gemini 쿼터 사용 없음)
+# FakeGeminiServer(429 / 느린 응답 시뮬레이션)에 동시 요청을 보내서
+# 1) naive: 요청마다 고정 대기로 재시도 (게이트웨이 도입 이전 방식)
+# 2) gateway: GeminiGateway (Token Bucket + Backoff/Jitter + Circuit Breaker + Dedup)
+# 3) outage: 서버가 모든 요청에 429를 반환할 때 Circuit Breaker가 요청을 차단하는지
+# 4) recovery: 서버가 회복된 뒤 cooldown이 지나면 다음 호출이 서버에 도달하고 Circuit이 닫히는지 (❌면 회귀)
+# 성공률, 서버가 받은 429 수, 지연 시간(p50/p95)을 비교합니다.
+import time
+import cv2
+import numpy as np
+from google import genai
+from google.genai import types
+
+BENCH_REQUESTS = 24
+BENCH_DUPLICATE_RATIO = 0.25  # 같은 이미지를 다시 보내는 요청 비율 (더블 클릭, 재전송)
+NAIVE_MAX_RETRIES = 3
+NAIVE_RETRY_WAIT_S = 1.0
+SERVER_QUOTA_PER_S = 2.0
+GATEWAY_BENCH_CONFIG = {**GEMINI_CONFIG, "rate_per_s": SERVER_QUOTA_PER_S, "burst": 2, "max_queue": 64,
+                        "backoff_base_s": 0.5, "backoff_max_s": 8.0, "breaker_cooldown_s": 5.0, "timeout_s": 15.0}
+
+def bench_payloads(n, duplicate_ratio, seed=0):
+    """작은 합성 방 이미지 + 빨간 마스크 JPEG 목록 (일부는 중복)"""
+    rng = np.random.default_rng(seed)
+    room = synthetic_room(1024, 512, seed)
+    unique = max(1, int(round(n * (1 - duplicate_ratio))))
+    payloads = []
+    for i in range(unique):
+        img = room.copy()
+        x = int(rng.integers(50, 950))
+        cv2.circle(img, (x, 350), 30, (0, 0, 255), -1)
+        payloads.append(cv2.imencode(".jpg", img)[1].tobytes())
+    return [payloads[i] if i < unique else payloads[int(rng.integers(0, unique))] for i in range(n)]
+
+def inpaint_request(payload):
+    return dict(
+        model="gemini-2.5-flash-image",
+        contents=[types.Part.from_bytes(data=payload, mime_type="image/jpeg"), "Remove the RED object."],
+        config=types.GenerateContentConfig(response_modalities=["IMAGE"], candidate_count=1),
+    )
+
+async def naive_call(fake_client, payload):
+    """게이트웨이 도입 이전: 요청마다 독립적으로 고정 대기 후 재시도"""
+    for attempt in range(NAIVE_MAX_RETRIES):
+        try:
+            return await fake_client.aio.models.generate_content(**inpaint_request(payload))
+        except Exception:
+            if attempt == NAIVE_MAX_RETRIES - 1: raise
+            await asyncio.sleep(NAIVE_RETRY_WAIT_S)
+
+async def run_scenario(name, call, payloads, server):
+    before = dict(server.counters)
+    latencies, errors = [], {}
+
+    async def one(payload):
+        t0 = time.perf_counter()
+        try:
+            await call(payload)
+            latencies.append(time.perf_counter() - t0)
+        except HTTPException as e:
+            errors[e.status_code] = errors.get(e.status_code, 0) + 1
+        except Exception as e:
+            key = getattr(e, "code", type(e).__name__)
+            errors[key] = errors.get(key, 0) + 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in payloads))
+    row = {
+        "scenario": name,
+        "requests": len(payloads),
+        "succeeded": len(latencies),
+        "errors": {str(k): v for k, v in errors.items()},
+        "wall_s": round(time.perf_counter() - t0, 2),
+        "latency_ms": latency_summary(latencies),
+        "server": {k: server.counters[k] - before.get(k, 0) for k in ("requests", "ok", "throttled")},
+    }
+    print(f"  {name:>8}: ok {row['succeeded']}/{row['requests']}  server 429s {row['server']['throttled']}  "
+          f"p50 {row['latency_ms']['p50']}ms  p95 {row['latency_ms']['p95']}ms  wall {row['wall_s']}s")
+    return row
+
+async def run_gateway_benchmark():
+    server = FakeGeminiServer(quota_per_s=SERVER_QUOTA_PER_S).start()
+    fake_client = genai.Client(api_key="fake", http_options=types.HttpOptions(base_url=server.url))
+    payloads = bench_payloads(BENCH_REQUESTS, BENCH_DUPLICATE_RATIO)
+    rows = []
+    try:
+        rows.append(await run_scenario("naive", lambda p: naive_call(fake_client, p), payloads, server))
+        await asyncio.sleep(1.5)  # 서버 quota window 초기화
+
+        gateway = GeminiGateway(fake_client, **GATEWAY_BENCH_CONFIG)
+        rows.append(await run_scenario("gateway", lambda p: gateway.generate_content(**inpaint_request(p)), payloads, server))
+        rows[-1]["gateway"] = gateway.stats()
+
+        server.quota_per_s = 0  # 전면 429 (할당량 소진)
+        outage = GeminiGateway(fake_client, **{**GATEWAY_BENCH_CONFIG, "breaker_threshold": 3})
+        rows.append(await run_scenario("outage", lambda p: outage.generate_content(**inpaint_request(p)), payloads[:12], server))
+        rows[-1]["gateway"] = outage.stats()
+
+        server.quota_per_s = SERVER_QUOTA_PER_S
+        await asyncio.sleep(GATEWAY_BENCH_CONFIG["breaker_cooldown_s"] + 1.0)
+        rows.append(await run_scenario("recovery", lambda p: outage.generate_content(**inpaint_request(p)), payloads[12:13], server))
+        rows[-1]["gateway"] = outage.stats()
+        rows[-1]["passed"] = (rows[-1]["server"]["requests"] > 0 and rows[-1]["succeeded"] == 1
+                              and rows[-1]["gateway"]["breaker"] == "closed")
+        print(f"  recovery: breaker {rows[-1]['gateway']['breaker']} after cooldown  {'✅' if rows[-1]['passed'] else '❌'}")
+    finally:
+        server.stop()
+    save_bench_results("gemini_gateway", rows)
+    return rows
+
+await run_gateway_benchmark()
@@ -0,0 +1,52 @@
+# ==========================================
+# [Benchmark] Inpainting Payload: Full Frame vs Crop
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (GPU / Gemini 쿼터 사용 없음)
+# 전역 GEMINI 게이트웨이를 FakeGeminiClient용으로 잠시 교체해서 request_inpaint + composite_inpaint를
+# INPAINT_MODE별로 실행하고, Gemini로 보내는 payload 크기와 예상 end-to-end 지연 시간을 비교합니다.
+# (Gemini 지연 = FakeGeminiClient 지연 모델, 로컬 처리 = 실제 측정값, fake의 cv2.inpaint 시간 포함)
+import dataclasses
+import time
+
+BENCH_SIZES = [(4096, 2048), (8192, 4096)]
+BENCH_REPEAT = 3
+
+async def run_inpaint_mode_benchmark():
+    global GEMINI
+    real_gateway, fake = GEMINI, FakeGeminiClient(sleep=False)
+    # cell3의 request_inpaint는 전역 GEMINI를 사용 (속도 제한이 측정에 섞이지 않도록 rate를 높임)
+    GEMINI = GeminiGateway(fake, **{**GEMINI_CONFIG, "rate_per_s": 1000.0, "burst": 1000})
+    rows = []
+    try:
+        for width, height in BENCH_SIZES:
+            base_job, _ = synthetic_removal_job(width, height)
+            for mode in ("full", "crop"):
+                local_ms = []
+                for _ in range(BENCH_REPEAT):
+                    job = dataclasses.replace(base_job, image=base_job.image.copy())
+                    if mode == "crop":
+                        job.crop = inpaint_crop_window(job.mask_dilated)
+                    t0 = time.perf_counter()
+                    res_img = await request_inpaint(job)
+                    composite_inpaint(job, res_img)
+                    local_ms.append((time.perf_counter() - t0) * 1000)
+                call = fake.calls[-1]
+                local = sorted(local_ms)[len(local_ms) // 2]
+                rows.append({
+                    "size": f"{width}x{height}", "mode": mode,
+                    "crop": list(job.crop) if job.crop else None,
+                    "payload_kb": round(call["payload_bytes"] / 1024, 1),
+                    "gemini_input_px": call["input_pixels"],
+                    "gemini_simulated_s": call["simulated_latency_s"],
+                    "local_ms": round(local, 1),
+                    "end_to_end_s": round(call["simulated_latency_s"] + local / 1000, 3),
+                })
+                r = rows[-1]
+                print(f"  {r['size']:>10} {mode:>4}: payload {r['payload_kb']}KB  local {r['local_ms']}ms  e2e ~{r['end_to_end_s']}s")
+            del base_job
+    finally:
+        GEMINI = real_gateway
+    save_bench_results("inpaint_modes", rows)
+    return rows
+
+await run_inpaint_mode_benchmark()
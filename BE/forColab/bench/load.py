@@ -0,0 +1,111 @@
+# ==========================================
+# [Benchmark] HTTP Load Driver
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (Cell 4 이전)
+# BENCH_BASE_URL이 None이면 이 셀이 uvicorn 서버를 BENCH_PORT에 백그라운드로 띄우고,
+# /analyze-image, /remove-object, /consult를 BENCH_MIX 비율로 동시에 호출합니다.
+# 엔드포인트별 p50/p95/p99 지연 시간, 처리량, 상태 코드 분포, 서버 프로세스 RSS 최대값을 JSON으로 저장합니다.
+# BENCH_OFFLINE=True면 SAM / BEiT 스텁 + FakeGeminiClient로 실행합니다. (모델 / 쿼터 없이 서버 계층만 측정)
+import asyncio
+import contextlib
+import random
+import time
+import cv2
+import httpx
+import uvicorn
+
+BENCH_BASE_URL = None  # 예: "https://api.y-minion.link" (외부 서버를 측정할 때)
+BENCH_PORT = 8001
+BENCH_OFFLINE = True
+BENCH_CONCURRENCY = 8
+BENCH_DURATION_S = 30
+BENCH_MIX = {"/analyze-image": 0.4, "/remove-object": 0.3, "/consult": 0.3}
+BENCH_IMAGE_SIZE = (4096, 2048)
+BENCH_TIMEOUT_S = 300
+
+def bench_request(endpoint, jpeg, image_size):
+    """엔드포인트별 multipart 요청 (프론트엔드와 같은 필드)"""
+    w, h = image_size
+    if endpoint == "/analyze-image":
+        return {"files": {"file": ("room.jpg", jpeg, "image/jpeg")}, "data": {"response_format": "url"}}
+    if endpoint == "/remove-object":
+        x, y = int(w * (0.1 + random.choice([0, 0.22, 0.44, 0.66])) + w / 28), int(h * 0.6)
+        return {"files": {"file": ("room.jpg", jpeg, "image/jpeg")},
+                "data": {"x": str(x), "y": str(y), "response_format": "url"}}
+    return {"files": {"image": ("room.jpg", jpeg, "image/jpeg")},
+            "data": {"user_prompt": random.choice(["모던한 소파 추천", "북유럽 스타일 조명", "원목 식탁"])}}
+
+async def drive_load(base_url, jpeg, image_size):
+    records = []  # (endpoint, status, latency_s)
+    endpoints, weights = zip(*BENCH_MIX.items())
+    deadline = time.perf_counter() + BENCH_DURATION_S
+
+    async def worker(http):
+        while time.perf_counter() < deadline:
+            endpoint = random.choices(endpoints, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                response = await http.post(endpoint, **bench_request(endpoint, jpeg, image_size))
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            records.append((endpoint, status, time.perf_counter() - t0))
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=BENCH_TIMEOUT_S) as http:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(http) for _ in range(BENCH_CONCURRENCY)))
+        wall = time.perf_counter() - t0
+    return records, wall
+
+def summarize(records, wall):
+    summary = {}
+    for endpoint in BENCH_MIX:
+        rows = [r for r in records if r[0] == endpoint]
+        ok = [lat for _, status, lat in rows if status == 200]
+        statuses = {}
+        for _, status, _ in rows: statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary[endpoint] = {"requests": len(rows), "ok": len(ok), "status": statuses,
+                             "throughput_rps": round(len(ok) / wall, 3), "latency_ms": percentiles_ms(ok)}
+        lat = summary[endpoint]["latency_ms"]
+        print(f"  {endpoint:>15}: {len(ok)}/{len(rows)} ok  {summary[endpoint]['throughput_rps']} req/s  "
+              f"p50 {lat['p50']}ms  p95 {lat['p95']}ms  p99 {lat['p99']}ms  {statuses}")
+    return summary
+
+async def run_load_benchmark():
+    image = synthetic_room(*BENCH_IMAGE_SIZE)
+    jpeg = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), 90])[1].tobytes()
+    server, server_task = None, None
+    base_url = BENCH_BASE_URL
+    if base_url is None:
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=BENCH_PORT, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started: await asyncio.sleep(0.1)
+        base_url = f"http://127.0.0.1:{BENCH_PORT}"
+    print(f"🚚 Load: {BENCH_CONCURRENCY} concurrent clients x {BENCH_DURATION_S}s -> {base_url} (offline={BENCH_OFFLINE})")
+
+    offline = offline_pipeline(FakeGeminiClient()) if BENCH_OFFLINE and BENCH_BASE_URL is None else contextlib.nullcontext()
+    try:
+        with offline, RssSampler() as rss:
+            records, wall = await drive_load(base_url, jpeg, BENCH_IMAGE_SIZE)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await server_task
+
+    summary = summarize(records, wall)
+    ok_total = sum(s["ok"] for s in summary.values())
+    memory = rss.result() if BENCH_BASE_URL is None else None  # 같은 프로세스의 서버만 측정 가능
+    print(f"📊 {ok_total} ok in {wall:.1f}s ({ok_total / wall:.2f} req/s), server RSS {memory}")
+    metrics = {f"{endpoint}.{p}_ms": s["latency_ms"][p] for endpoint, s in summary.items() for p in ("p50", "p95", "p99")}
+    if memory: metrics["peak_rss_mb"] = memory["peak_mb"]
+    data = {
+        "config": {"base_url": base_url, "offline": BENCH_OFFLINE, "concurrency": BENCH_CONCURRENCY,
+                   "duration_s": BENCH_DURATION_S, "mix": BENCH_MIX, "image_size": BENCH_IMAGE_SIZE},
+        "wall_s": round(wall, 2), "throughput_rps": round(ok_total / wall, 3),
+        "endpoints": summary, "memory": memory, "metrics": metrics,
+    }
+    data["regressions"] = compare_with_baseline("load", metrics)
+    save_bench_results("load", data)
+    return data
+
+await run_load_benchmark()
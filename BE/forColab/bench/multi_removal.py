@@ -0,0 +1,86 @@
+# ==========================================
+# [Benchmark] Multi-Object Removal: Sequential Requests vs One Request
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (GPU / Gemini / 모델 가중치 불필요)
+# offline_pipeline()에서 가구 N개를 지우는 두 가지 방법을 비교합니다.
+#   sequential: 물체마다 /remove-object 한 번 (결과 JPEG를 다음 요청 입력으로 사용, 기존 클라이언트 방식)
+#   multi:      objects에 N개를 담아 /remove-object 한 번 (SAM 인코딩 / Gemini / 합성 / 바닥 분석 각 1회)
+# Gemini 호출 수, payload 크기, 예상 end-to-end 지연(로컬 측정 + FakeGeminiClient 지연 모델),
+# 지우지 않은 영역의 원본 대비 PSNR(재압축 누적 손실)을 비교합니다.
+import time
+import cv2
+import numpy as np
+
+BENCH_SIZE = (4096, 2048)
+BENCH_OBJECTS = [1, 2, 3, 5]
+
+def furniture_targets(width, height, n):
+    """synthetic_room 가구 사각형과 겹치지 않게 바닥 위에 단색 물체 n개를 그리고 클릭 지점을 반환"""
+    image = synthetic_room(width, height, seed=7)
+    targets = []
+    for i in range(n):
+        cx, cy = int(width * (0.2 + 0.6 * (i + 0.5) / n)), int(height * 0.8)
+        w, h = width // 40, height // 16
+        cv2.rectangle(image, (cx - w, cy - h), (cx + w, cy + h), (30 + 40 * i, 50, 160 - 20 * i), -1)
+        targets.append(RemovalTarget(points=[(cx, cy)]))
+    return image, targets
+
+def psnr_outside(result, original, masks):
+    keep = ~np.logical_or.reduce(masks)
+    diff = (result.astype(np.float32) - original.astype(np.float32))[keep]
+    mse = float(np.mean(diff ** 2))
+    return round(10 * np.log10(255 ** 2 / mse), 2) if mse else float("inf")
+
+async def removal_request(fake, image_bytes, targets):
+    """/remove-object 한 번과 같은 작업 (SAM -> Gemini -> 합성 -> 바닥 분석 -> JPEG q95)"""
+    calls_before = len(fake.calls)
+    t0 = time.perf_counter()
+    res, job = await process_removal(image_bytes, targets, INPAINT_MODE)
+    detect_floor_mask_png(res)
+    result_jpeg = cv2.imencode(".jpg", res, [int(cv2.IMWRITE_JPEG_QUALITY), 95])[1].tobytes()
+    calls = fake.calls[calls_before:]
+    return result_jpeg, job, {
+        "local_s": time.perf_counter() - t0,
+        "gemini_calls": len(calls),
+        "gemini_s": sum(c["simulated_latency_s"] for c in calls),
+        "payload_bytes": sum(c["payload_bytes"] for c in calls),
+    }
+
+def summarize(name, n, runs, result_jpeg, original, masks):
+    result = cv2.imdecode(np.frombuffer(result_jpeg, np.uint8), cv2.IMREAD_COLOR)
+    local_s, gemini_s = sum(r["local_s"] for r in runs), sum(r["gemini_s"] for r in runs)
+    row = {
+        "mode": name, "objects": n, "requests": len(runs),
+        "gemini_calls": sum(r["gemini_calls"] for r in runs),
+        "payload_kb": round(sum(r["payload_bytes"] for r in runs) / 1024, 1),
+        "local_s": round(local_s, 2), "gemini_simulated_s": round(gemini_s, 2),
+        "estimated_total_s": round(local_s + gemini_s, 2),
+        "psnr_outside_masks_db": psnr_outside(result, original, masks),
+    }
+    print(f"  {n} objects {name:>10}: requests {row['requests']}  Gemini calls {row['gemini_calls']}  "
+          f"payload {row['payload_kb']}KB  est. {row['estimated_total_s']}s  PSNR(outside) {row['psnr_outside_masks_db']}dB")
+    return row
+
+async def run_multi_removal_benchmark():
+    width, height = BENCH_SIZE
+    rows = []
+    with offline_pipeline() as fake:
+        for n in BENCH_OBJECTS:
+            image, targets = furniture_targets(width, height, n)
+            jpeg = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), 95])[1].tobytes()
+            original = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+            current, runs, masks = jpeg, [], []
+            for target in targets:
+                current, job, run = await removal_request(fake, current, [target])
+                runs.append(run)
+                masks.append(cv2.resize(job.mask_dilated, (width, height), interpolation=cv2.INTER_NEAREST) > 0)
+            rows.append(summarize("sequential", n, runs, current, original, masks))
+
+            result_jpeg, job, run = await removal_request(fake, jpeg, targets)
+            mask = cv2.resize(job.mask_dilated, (width, height), interpolation=cv2.INTER_NEAREST) > 0
+            rows.append(summarize("multi", n, [run], result_jpeg, original, masks + [mask]))
+    save_bench_results("multi_removal", {"size": f"{width}x{height}", "inpaint_mode": INPAINT_MODE, "rows": rows})
+    return rows
+
+await run_multi_removal_benchmark()
@@ -0,0 +1,204 @@
+# ==========================================
+# [Benchmark] Panorama: Whole-Frame vs Cubemap Tiling
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (Gemini 쿼터 불필요)
+# 직육면체 방을 ray casting한 합성 equirect 파노라마(정답 바닥 / 물체 마스크 포함)로
+# panorama_mode="off"(전체 프레임)와 "cubemap"의 SAM 물체 마스크 / BEiT 바닥 마스크를 비교합니다.
+# 1) Projection: 방향 벡터를 면으로 잘랐다가 equirect로 되돌린 각도 오차 (❌면 remap 테이블 회귀)
+# 2) SAM: 물체별 정답 IoU, 첫 클릭(cold: 인코딩 + remap 테이블 생성) / 같은 면 재클릭(warm) 지연, RSS 증가
+# 3) Floor: 정답 IoU, 지연 (cold / warm median), RSS 증가
+# 스텁 모델(offline_pipeline) 결과는 투영 / 재투영 경로 검증용이고, 해상도 이득은
+# BENCH_USE_MODELS=True일 때 실제 SAM / BEiT(MODELS) 결과에서 확인합니다.
+import time
+import cv2
+import numpy as np
+
+BENCH_SIZE = (4096, 2048)
+BENCH_REPEAT = 3
+BENCH_USE_MODELS = True
+PROJECTION_MAX_ERROR_DEG = 0.25  # 2048px equirect 1픽셀 ≈ 0.18°
+
+CAMERA_HEIGHT = 1.5
+ROOM_BOUNDS = {"x": (-3.0, 3.5), "z": (-4.0, 3.0), "ceiling": 1.2}  # 카메라 기준 벽 / 천장 위치 (m)
+ROOM_COLORS = {"ceiling": (235, 235, 235), "x0": (200, 210, 220), "x1": (190, 205, 215),
+               "z0": (215, 200, 190), "z1": (205, 215, 205)}  # BGR
+# (이름, 면, 가로 범위, 세로 범위, BGR) - 벽 위의 가구는 벽 평면의 (가로, 높이), 바닥 위의 러그는 (x, z) 범위
+ROOM_OBJECTS = [
+    ("cabinet", "z1", (-0.8, 0.6), (-1.5, -0.6), (30, 30, 120)),   # 정면 (경도 0°)
+    ("shelf", "z0", (-0.5, 0.7), (-1.5, 0.2), (150, 80, 40)),      # 뒤 (경도 ±180° 경계)
+    ("sofa", "x1", (-1.0, 1.2), (-1.5, -0.9), (60, 140, 60)),      # 오른쪽 (경도 90°)
+    ("rug", "floor", (-1.2, 0.2), (0.3, 1.4), (60, 190, 230)),     # 카메라 앞 바닥 (위도 약 -55°)
+]
+
+def pixel_rays(width, height):
+    """equirect 픽셀 중심의 단위 방향 (x = 경도 90°, y = 위, z = 경도 0°). cell3 투영 코드와 독립적으로 계산"""
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    lon = (xx + 0.5) / width * 2 * np.pi - np.pi
+    lat = np.pi / 2 - (yy + 0.5) / height * np.pi
+    return np.cos(lat) * np.sin(lon), np.sin(lat), np.cos(lat) * np.cos(lon)
+
+def ray_to_pixel(point, width, height):
+    x, y, z = point
+    lon, lat = np.arctan2(x, z), np.arctan2(y, np.hypot(x, z))
+    return int((lon + np.pi) / (2 * np.pi) * width), int((np.pi / 2 - lat) / np.pi * height)
+
+def render_box_room(width, height, seed=0):
+    """
+    카메라(바닥에서 CAMERA_HEIGHT)에서 본 직육면체 방 equirect 파노라마 (BGR)와 정답 마스크.
+    반환: (image, floor_gt, objects), objects = [(이름, 정답 마스크, 클릭 좌표)]
+    """
+    rng = np.random.default_rng(seed)
+    dx, dy, dz = pixel_rays(width, height)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hits = {
+            "floor": np.where(dy < 0, -CAMERA_HEIGHT / dy, np.inf),
+            "ceiling": np.where(dy > 0, ROOM_BOUNDS["ceiling"] / dy, np.inf),
+            "x0": np.where(dx < 0, ROOM_BOUNDS["x"][0] / dx, np.inf), "x1": np.where(dx > 0, ROOM_BOUNDS["x"][1] / dx, np.inf),
+            "z0": np.where(dz < 0, ROOM_BOUNDS["z"][0] / dz, np.inf), "z1": np.where(dz > 0, ROOM_BOUNDS["z"][1] / dz, np.inf),
+        }
+    names = list(hits)
+    surface = np.argmin(np.stack([hits[n] for n in names]), axis=0)
+    t = np.min(np.stack([hits[n] for n in names]), axis=0)
+    px, py, pz = dx * t, dy * t, dz * t
+    del hits, dx, dy, dz, t
+
+    image = np.zeros((height, width, 3), np.uint8)
+    for i, name in enumerate(names[1:], 1):
+        image[surface == i] = ROOM_COLORS[name]
+    floor_gt = surface == 0
+    # 바닥: x 방향 20cm 마루 판자마다 다른 나무색
+    planks = np.floor(px[floor_gt] / 0.2).astype(int) % 7
+    image[floor_gt] = (np.array([60, 100, 150]) + rng.integers(-18, 18, (7, 3))[planks]).clip(0, 255)
+
+    objects = []
+    for name, wall, (a0, a1), (b0, b1), color in ROOM_OBJECTS:
+        on = surface == names.index(wall)
+        a, b = (px, pz) if wall == "floor" else ((pz, py) if wall.startswith("x") else (px, py))
+        mask = on & (a >= a0) & (a <= a1) & (b >= b0) & (b <= b1)
+        image[mask] = color
+        center = {"floor": ((a0 + a1) / 2, -CAMERA_HEIGHT, (b0 + b1) / 2)}.get(wall)
+        if center is None:
+            plane = ROOM_BOUNDS[wall[0]][int(wall[1])]
+            center = (plane, (b0 + b1) / 2, (a0 + a1) / 2) if wall.startswith("x") else ((a0 + a1) / 2, (b0 + b1) / 2, plane)
+        objects.append((name, mask, ray_to_pixel(center, width, height)))
+    image = np.clip(image.astype(np.int16) + rng.integers(-3, 4, image.shape), 0, 255).astype(np.uint8)
+    return image, floor_gt, objects
+
+class FixedRangeStubSamPredictor(StubSamPredictor):
+    """면으로 remap하면 경계가 bilinear로 완만해지므로 클릭 지점 색 기준 flood fill 사용 (두 모드에 같은 스텁)"""
+    flood_flags = cv2.FLOODFILL_FIXED_RANGE
+
+def mask_iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+def resize_mask(mask, size):
+    return cv2.resize(mask.astype(np.uint8), tuple(size), interpolation=cv2.INTER_NEAREST) > 0
+
+def check_projection(size=(2048, 1024)):
+    """방향 벡터 이미지를 면으로 잘랐다가 되돌렸을 때의 각도 오차 (SAM 면 + 바닥 cubemap 면)"""
+    w, h = size
+    rays = np.ascontiguousarray(np.stack(pixel_rays(w, h), axis=-1).astype(np.float32))
+    errors = []
+    views = [(view, FLOOR_FACE_SIZE) for view in FLOOR_CUBE_VIEWS] + [((30, -15), SAM_FACE_SIZE), ((345, 45), SAM_FACE_SIZE)]
+    for view, face_size in views:
+        rows, warped, visible = face_to_equirect(face_from_equirect(rays, view, face_size), size, view)
+        cos = (warped * rays[rows]).sum(axis=-1) / np.maximum(np.linalg.norm(warped, axis=-1), 1e-6)
+        errors.append(np.degrees(np.arccos(np.clip(cos[visible], -1, 1))))
+    errors = np.concatenate(errors)
+    row = {"p99_error_deg": round(float(np.percentile(errors, 99)), 4), "max_error_deg": round(float(errors.max()), 4)}
+    row["passed"] = row["p99_error_deg"] <= PROJECTION_MAX_ERROR_DEG
+    print(f"  projection: round-trip error p99 {row['p99_error_deg']}°  max {row['max_error_deg']}°  "
+          f"{'✅' if row['passed'] else '❌'}")
+    return row
+
+def clear_panorama_caches():
+    """cold 측정용: SAM 임베딩 캐시 / remap 테이블 비우기 (임베딩 캐시는 run_panorama_benchmark가 끝나면 복원)"""
+    global sam_embedding_cache
+    sam_embedding_cache = SamEmbeddingCache(SAM_CACHE_MAX_BYTES)
+    gnomonic_maps.cache_clear()
+    equirect_maps.cache_clear()
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+def sam_rows(data, objects, source):
+    rows = []
+    for mode in PANORAMA_MODES:
+        clear_panorama_caches()
+        cold, warm, ious = [], [], {}
+        with RssSampler() as rss:
+            for name, gt, (x, y) in objects:
+                pyramid = ImagePyramid(data)
+                targets = [RemovalTarget(points=[(x, y)])]
+                job, elapsed = timed(lambda: segment_objects(pyramid, targets, mode))
+                cold.append(elapsed)
+                for _ in range(BENCH_REPEAT):  # 같은 면 / 같은 이미지 재클릭 (임베딩 캐시 HIT)
+                    warm.append(timed(lambda: segment_objects(pyramid, targets, mode))[1])
+                mask = job.object_masks[0]
+                ious[name] = round(mask_iou(mask, resize_mask(gt, (mask.shape[1], mask.shape[0]))), 4)
+        row = {"model": source, "mode": mode, "iou": ious, "mean_iou": round(float(np.mean(list(ious.values()))), 4),
+               "cold_ms": percentiles_ms(cold), "warm_ms": percentiles_ms(warm), "rss": rss.result()}
+        rows.append(row)
+        print(f"  sam[{source}] {mode:>7}: mean IoU {row['mean_iou']} {ious}  cold p50 {row['cold_ms']['p50']}ms  "
+              f"warm p50 {row['warm_ms']['p50']}ms  RSS +{row['rss']['growth_mb']}MB")
+    return rows
+
+def floor_rows(data, floor_gt, beit, source):
+    rows = []
+    for mode in PANORAMA_MODES:
+        clear_panorama_caches()
+
+        def analyze(pyramid):
+            image = pyramid.level(floor_input_size(pyramid, mode))
+            png, _ = detect_floor_outputs(image, {"png"}, None, beit, mode)
+            return cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_UNCHANGED)[..., 3] > 0
+
+        with RssSampler() as rss:
+            mask, cold = timed(lambda: analyze(ImagePyramid(data)))
+            pyramid = ImagePyramid(data)
+            warm = [timed(lambda: analyze(pyramid))[1] for _ in range(BENCH_REPEAT)]
+        row = {"model": source, "mode": mode, "iou": round(mask_iou(mask, resize_mask(floor_gt, (mask.shape[1], mask.shape[0]))), 4),
+               "mask_size": f"{mask.shape[1]}x{mask.shape[0]}", "cold_ms": round(cold * 1000, 1),
+               "warm_ms": percentiles_ms(warm), "rss": rss.result()}
+        rows.append(row)
+        print(f"  floor[{source}] {mode:>7}: IoU {row['iou']}  cold {row['cold_ms']}ms  warm p50 {row['warm_ms']['p50']}ms  "
+              f"RSS +{row['rss']['growth_mb']}MB")
+    return rows
+
+def bench_models():
+    try:
+        return MODELS.get("sam"), MODELS.get("beit")
+    except Exception as e:
+        print(f"⚠️ Models unavailable ({getattr(e, 'detail', e)}), skipping real-model comparison")
+        return None
+
+def run_panorama_benchmark():
+    width, height = BENCH_SIZE
+    image, floor_gt, objects = render_box_room(width, height)
+    # 무손실 PNG: JPEG 색 번짐 없이 두 모드의 마스크 차이만 비교
+    data = cv2.imencode(".png", image)[1].tobytes()
+    print(f"{width}x{height} box room, objects {[name for name, _, _ in objects]}, "
+          f"SAM_FACE_SIZE={SAM_FACE_SIZE}, FLOOR_FACE_SIZE={FLOOR_FACE_SIZE}")
+
+    global sam_embedding_cache
+    projection = check_projection()
+    saved_cache = sam_embedding_cache
+    try:
+        with offline_pipeline():
+            MODELS.set("sam", SamPredictorPool([FixedRangeStubSamPredictor() for _ in range(SAM_WORKERS)]))
+            rows = sam_rows(data, objects, "stub") + floor_rows(data, floor_gt, MODELS.get("beit"), "stub")
+        models = bench_models() if BENCH_USE_MODELS else None
+        if models is not None:
+            rows += sam_rows(data, objects, "sam") + floor_rows(data, floor_gt, models[1], "beit")
+    finally:
+        sam_embedding_cache = saved_cache
+
+    save_bench_results("panorama", {"size": f"{width}x{height}", "device": device, "SAM_FACE_SIZE": SAM_FACE_SIZE,
+                                    "FLOOR_FACE_SIZE": FLOOR_FACE_SIZE, "PANORAMA_VIEW_STEP_DEG": PANORAMA_VIEW_STEP_DEG,
+                                    "projection": projection, "rows": rows, "map_cache": panorama_map_stats()})
+    return rows
+
+run_panorama_benchmark()
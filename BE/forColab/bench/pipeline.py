@@ -0,0 +1,124 @@
+# ==========================================
+# [Benchmark] Image Pipeline Stages (Offline)
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (GPU / Gemini / 모델 가중치 불필요)
+# offline_pipeline()으로 SAM / BEiT를 스텁, Gemini를 FakeGeminiClient로 바꾼 뒤
+# 합성 이미지(여러 해상도) + 업로드된 샘플 사진에서 단계별 지연 시간을 측정합니다.
+#   segment: segment_object (디코딩, SAM_PROCESS_WIDTH 리사이즈, 마스크 후처리)
+#   floor:   detect_floor_boundary (FLOOR_TARGET_SIZE 리사이즈, 후처리, PNG)
+#   inpaint: request_inpaint + composite_inpaint (INPAINT_MODE)
+#   encode:  결과 JPEG 인코딩 (q95)
+#   consult: build_consult_prompt (Top-K 후보)
+# 튜닝 값(FLOOR_TARGET_SIZE, FLOOR_CLOSE_KSIZE, SAM_PROCESS_WIDTH) 후보별 결과도 함께 저장합니다.
+# 기준 실행과 비교하려면 한 번 save_bench_baseline("pipeline")을 실행해 두세요.
+import time
+import cv2
+import numpy as np
+
+BENCH_SIZES = [(2048, 1024), (4096, 2048), (8192, 4096)]
+BENCH_REPEAT = 5
+BENCH_SWEEP_SIZE = (4096, 2048)
+BENCH_SWEEPS = {
+    "FLOOR_TARGET_SIZE": [512, 800, 1024],
+    "FLOOR_CLOSE_KSIZE": [25, 50, 75],
+    "SAM_PROCESS_WIDTH": [1024, 2048],
+}
+BENCH_CONSULT_PROMPT = "모던한 거실에 어울리는 소파와 조명을 추천해줘"
+
+def timed(fn, repeat=BENCH_REPEAT):
+    samples, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+    return percentiles_ms(samples), result
+
+def click_point(image):
+    """마스크가 바닥 위 물체에 잡히도록 합성 이미지의 가구 사각형 중심 부근을 클릭"""
+    h, w = image.shape[:2]
+    return int(w * 0.1 + w / 28), int(h * 0.6)
+
+def floor_alpha(png):
+    return cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_UNCHANGED)[..., 3] > 0 if png else None
+
+def mask_iou(a, b):
+    if a is None or b is None: return None
+    if a.shape != b.shape: b = cv2.resize(b.astype(np.uint8), (a.shape[1], a.shape[0]), interpolation=cv2.INTER_NEAREST) > 0
+    union = np.logical_or(a, b).sum()
+    return round(float(np.logical_and(a, b).sum() / union), 4) if union else 1.0
+
+async def bench_image(label, image):
+    jpeg = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), 95])[1].tobytes()
+    x, y = click_point(image)
+    stages = {}
+    stages["segment"], job = timed(lambda: segment_object(jpeg, x, y))
+    stages["floor"], _ = timed(lambda: detect_floor_boundary(image))
+
+    async def inpaint():
+        fresh = segment_object(jpeg, x, y)
+        if INPAINT_MODE == "crop": fresh.crop = inpaint_crop_window(fresh.mask_dilated)
+        t0 = time.perf_counter()
+        result = composite_inpaint(fresh, await request_inpaint(fresh))
+        return result, time.perf_counter() - t0
+    samples = []
+    for _ in range(BENCH_REPEAT):
+        result, elapsed = await inpaint()
+        samples.append(elapsed)
+    stages["inpaint"] = percentiles_ms(samples)
+    stages["encode"], _ = timed(lambda: cv2.imencode(".jpg", result, [int(cv2.IMWRITE_JPEG_QUALITY), 95]))
+    total = sum(s["p50"] for s in stages.values())
+    print(f"  {label:>14}: " + "  ".join(f"{k} {v['p50']}ms" for k, v in stages.items()) + f"  (sum p50 {total:.0f}ms)")
+    return {"image": label, "input_kb": round(len(jpeg) / 1024, 1), "stages": stages}
+
+def bench_consult():
+    items = list(CATALOG.find(has_glb=True, limit=CONSULT_TOP_K))
+    stats, prompt = timed(lambda: build_consult_prompt(BENCH_CONSULT_PROMPT, items), repeat=50)
+    print(f"  consult prompt: {len(items)} items, {len(prompt)} chars, p50 {stats['p50']}ms")
+    return {"items": len(items), "prompt_chars": len(prompt), "latency_ms": stats}
+
+def bench_sweeps():
+    """튜닝 값별 지연 시간과 기본값 대비 마스크 IoU"""
+    image = synthetic_room(*BENCH_SWEEP_SIZE)
+    jpeg = cv2.imencode(".jpg", image)[1].tobytes()
+    x, y = click_point(image)
+    defaults = {name: globals()[name] for name in BENCH_SWEEPS}
+    reference = {"floor": floor_alpha(detect_floor_mask_png(image)),
+                 "segment": segment_object(jpeg, x, y).mask_dilated > 0}
+    rows = []
+    try:
+        for name, values in BENCH_SWEEPS.items():
+            for value in values:
+                globals()[name] = value
+                if name == "SAM_PROCESS_WIDTH":
+                    stats, job = timed(lambda: segment_object(jpeg, x, y))
+                    iou = mask_iou(reference["segment"], job.mask_dilated > 0)
+                else:
+                    stats, png = timed(lambda: detect_floor_mask_png(image))
+                    iou = mask_iou(reference["floor"], floor_alpha(png))
+                rows.append({"param": name, "value": value, "default": value == defaults[name],
+                             "latency_ms": stats, "iou_vs_default": iou})
+                print(f"  {name}={value:<5} p50 {stats['p50']}ms  IoU vs default {iou}")
+                globals()[name] = defaults[name]
+    finally:
+        globals().update(defaults)
+    return rows
+
+async def run_pipeline_benchmark():
+    images = [(f"{w}x{h}", synthetic_room(w, h, seed)) for seed, (w, h) in enumerate(BENCH_SIZES)]
+    images += [(f"sample{i}", image) for i, image in enumerate(room_images(synthetic_sizes=()))]
+    with offline_pipeline(), RssSampler() as rss:
+        rows = [await bench_image(label, image) for label, image in images]
+        consult = bench_consult()
+        sweeps = bench_sweeps()
+
+    metrics = {f"{r['image']}.{stage}.p50_ms": v["p50"] for r in rows for stage, v in r["stages"].items()}
+    metrics["consult_prompt.p50_ms"] = consult["latency_ms"]["p50"]
+    metrics["peak_rss_mb"] = round(rss.peak_mb, 1)
+    print(f"📊 RSS {rss.result()}")
+    data = {"config": {"INPAINT_MODE": INPAINT_MODE, **{name: globals()[name] for name in BENCH_SWEEPS}},
+            "images": rows, "consult": consult, "sweeps": sweeps, "memory": rss.result(), "metrics": metrics}
+    data["regressions"] = compare_with_baseline("pipeline", metrics)
+    save_bench_results("pipeline", data)
+    return data
+
+await run_pipeline_benchmark()
@@ -0,0 +1,76 @@
+# ==========================================
+# [Benchmark] Image Preprocessing: Per-Endpoint Decode vs Shared Pyramid
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (GPU / Gemini / 모델 가중치 불필요)
+# 같은 업로드로 /analyze-image -> /remove-object -> /consult를 호출할 때 필요한 전처리만 측정합니다.
+#   legacy:  엔드포인트마다 원본 디코딩 + 리사이즈, /consult는 업로드 원본을 그대로 전송
+#   pyramid: ImagePyramid (JPEG 축소 디코딩 + level 재사용), cold(첫 요청) / warm(캐시 HIT)
+# 바닥 분석 입력(FLOOR_TARGET_SIZE)의 축소 디코딩 오차(원본 디코딩 + INTER_AREA 대비)도 함께 기록합니다.
+import time
+import cv2
+import numpy as np
+
+BENCH_SIZES = [(4096, 2048), (8192, 4096)]
+BENCH_REPEAT = 3
+
+def best_ms(fn):
+    samples = []
+    for _ in range(BENCH_REPEAT):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return round(min(samples), 1)
+
+def legacy_preprocess(data):
+    """기존 cell3: analyze(디코딩 + 800px), remove(디코딩 + 2048px + RGB), consult(원본 bytes)"""
+    decode = lambda: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    image = decode()
+    h, w = image.shape[:2]
+    scale = FLOOR_TARGET_SIZE / max(h, w)
+    cv2.resize(image, (int(w * scale), int(h * scale)))
+    image = decode()
+    small = cv2.resize(image, (SAM_PROCESS_WIDTH, int(h * SAM_PROCESS_WIDTH / w)), interpolation=cv2.INTER_AREA)
+    cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    return data
+
+def pyramid_preprocess(pyramid):
+    pyramid.level(pyramid.long_side_size(FLOOR_TARGET_SIZE))
+    pyramid.level().copy()  # segment_objects: 합성용 원본 복사
+    process_size = pyramid.width_size(SAM_PROCESS_WIDTH)
+    pyramid.rgb(process_size)
+    return pyramid.consult_image()[0]
+
+def floor_input_error(data, pyramid):
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    size = pyramid.long_side_size(FLOOR_TARGET_SIZE)
+    reference = cv2.resize(image, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+    diff = np.abs(pyramid.level(size).astype(np.int16) - reference)
+    return {"mean_abs": round(float(diff.mean()), 2), "p99_abs": float(np.percentile(diff, 99))}
+
+def run_preprocess_benchmark():
+    images = [(f"{w}x{h}", synthetic_room(w, h, seed)) for seed, (w, h) in enumerate(BENCH_SIZES)]
+    images += [(f"sample{i}", image) for i, image in enumerate(room_images(synthetic_sizes=()))]
+    rows = []
+    for label, image in images:
+        data = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), 95])[1].tobytes()
+        cold = ImagePyramid(data)
+        row = {
+            "image": label,
+            "upload_kb": round(len(data) / 1024, 1),
+            "legacy_ms": best_ms(lambda: legacy_preprocess(data)),
+            "pyramid_cold_ms": best_ms(lambda: pyramid_preprocess(ImagePyramid(data))),
+            "pyramid_warm_ms": best_ms(lambda: pyramid_preprocess(cold)),
+            "decodes_per_upload": {"legacy": 2, "pyramid": cold.decodes},
+            "consult_kb": {"legacy": round(len(data) / 1024, 1), "pyramid": round(len(cold.consult_image()[0]) / 1024, 1)},
+            "pyramid_mb": round(cold.nbytes / 2**20, 1),
+            "floor_input_error": floor_input_error(data, ImagePyramid(data)),
+        }
+        rows.append(row)
+        print(f"  {label:>10}: legacy {row['legacy_ms']}ms  pyramid cold {row['pyramid_cold_ms']}ms  "
+              f"warm {row['pyramid_warm_ms']}ms  consult {row['consult_kb']['legacy']}KB -> {row['consult_kb']['pyramid']}KB  "
+              f"floor input diff {row['floor_input_error']['mean_abs']}")
+    save_bench_results("preprocess", {"FLOOR_TARGET_SIZE": FLOOR_TARGET_SIZE, "SAM_PROCESS_WIDTH": SAM_PROCESS_WIDTH,
+                                      "CONSULT_IMAGE_MAX_SIDE": CONSULT_IMAGE_MAX_SIDE, "images": rows})
+    return rows
+
+run_preprocess_benchmark()
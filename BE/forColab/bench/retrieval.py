@@ -0,0 +1,104 @@
+# ==========================================
+# [Benchmark] Retrieval Index vs Full-List Prompt
+# ==========================================
+# cell3.py 실행 후 같은 노트북에서 실행하세요.
+# - Recall@K: 정답 아이템이 Top-K 후보 안에 포함되는 비율
+#   정답은 기본적으로 키워드 매칭(오프라인), USE_GEMINI_GROUND_TRUTH=True 이면
+#   "현재 방식(전체 목록 프롬프트)"으로 Gemini가 고른 아이템을 정답으로 사용합니다.
+# - Latency: 검색 시간, 프롬프트 크기, (Gemini 모드) 전체 목록 vs Top-K 응답 시간
+import json
+import os
+import time
+import numpy as np
+from google.genai import types
+
+BENCH_K = CONSULT_TOP_K
+BENCH_QUERIES = [
+    "modern grey sofa for the living room",
+    "wooden dining table",
+    "minimal desk lamp",
+    "bookshelf with natural wood finish",
+    "comfortable office chair",
+    "Scandinavian style bedroom",
+    "북유럽 스타일로 꾸며줘",
+    "아늑한 거실 소파 추천해줘",
+]
+USE_GEMINI_GROUND_TRUTH = False
+BENCH_IMAGE_PATH = "room.jpg"  # Gemini 모드에서 사용할 방 사진
+BENCH_OUTPUT = "bench_results/retrieval.json"
+SERVING_ITEMS = list(CATALOG.find(has_glb=True))
+
+def keyword_ground_truth(query):
+    tokens = [t for t in query.lower().split() if len(t) >= 3]
+    return {
+        item["id"] for item in SERVING_ITEMS
+        if any(t in item_search_text(item).lower() for t in tokens)
+    }
+
+def gemini_ground_truth(query, image_bytes, items):
+    t0 = time.perf_counter()
+    response = client.models.generate_content(
+        model='gemini-2.5-flash-lite',
+        contents=[types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"), build_consult_prompt(query, items)],
+    )
+    elapsed = time.perf_counter() - t0
+    try:
+        data = json.loads(response.text.replace("```json", "").replace("```", "").strip())
+        if isinstance(data, dict): data = [data]
+        return {d.get("selected_id") for d in data}, elapsed
+    except Exception:
+        return set(), elapsed
+
+def run_retrieval_benchmark():
+    image_bytes = None
+    if USE_GEMINI_GROUND_TRUTH:
+        with open(BENCH_IMAGE_PATH, "rb") as f:
+            image_bytes = f.read()
+
+    full_prompt_chars = len(build_consult_prompt("", SERVING_ITEMS))
+    rows = []
+    for query in BENCH_QUERIES:
+        t0 = time.perf_counter()
+        top_ids = set(furniture_index.search(query, BENCH_K))
+        search_ms = (time.perf_counter() - t0) * 1000
+        candidates = [item for item in SERVING_ITEMS if item["id"] in top_ids]
+
+        row = {
+            "query": query,
+            "search_ms": round(search_ms, 2),
+            "prompt_chars_full": full_prompt_chars,
+            "prompt_chars_topk": len(build_consult_prompt(query, candidates)),
+        }
+        if USE_GEMINI_GROUND_TRUTH:
+            truth, row["gemini_full_s"] = gemini_ground_truth(query, image_bytes, SERVING_ITEMS)
+            _, row["gemini_topk_s"] = gemini_ground_truth(query, image_bytes, candidates)
+        else:
+            truth = keyword_ground_truth(query)
+        row["truth_size"] = len(truth)
+        row["recall"] = round(len(truth & top_ids) / len(truth), 3) if truth else None
+        rows.append(row)
+        print(f"  {query[:40]:<40} recall={row['recall']}  search={row['search_ms']:.1f}ms  "
+              f"prompt={row['prompt_chars_topk']}/{row['prompt_chars_full']} chars")
+
+    recalls = [r["recall"] for r in rows if r["recall"] is not None]
+    search_ms = [r["search_ms"] for r in rows]
+    summary = {
+        "catalog_size": len(SERVING_ITEMS),
+        "k": BENCH_K,
+        "embedder": furniture_index.embedder.name,
+        "ground_truth": "gemini_full_list" if USE_GEMINI_GROUND_TRUTH else "keyword",
+        "mean_recall": round(float(np.mean(recalls)), 3) if recalls else None,
+        "search_ms_p50": round(float(np.percentile(search_ms, 50)), 2),
+        "search_ms_p95": round(float(np.percentile(search_ms, 95)), 2),
+    }
+    if USE_GEMINI_GROUND_TRUTH:
+        summary["gemini_full_s_mean"] = round(float(np.mean([r["gemini_full_s"] for r in rows])), 3)
+        summary["gemini_topk_s_mean"] = round(float(np.mean([r["gemini_topk_s"] for r in rows])), 3)
+
+    os.makedirs(os.path.dirname(BENCH_OUTPUT), exist_ok=True)
+    with open(BENCH_OUTPUT, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "queries": rows}, f, indent=2, ensure_ascii=False)
+    print(f"📊 Retrieval benchmark: {summary}")
+    return summary
+
+run_retrieval_benchmark()
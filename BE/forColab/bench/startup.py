@@ -0,0 +1,93 @@
+# ==========================================
+# [Benchmark] Model Startup: SAM Variants & BEiT
+# ==========================================
+# cell3.py, bench/common.py 실행 후 같은 노트북에서 실행하세요. (없는 SAM 체크포인트는 다운로드됨)
+# 설정마다 새 Python 프로세스에서 모델을 로드하고 첫 추론까지 실행해서
+# 로드 시간, 첫 요청까지의 시간(프로세스 시작 -> 첫 추론 완료), 최대 RSS / GPU 메모리를 측정합니다.
+# (프로세스를 분리해야 설정별 peak RSS가 서로 섞이지 않습니다)
+import json
+import subprocess
+import sys
+
+BENCH_CONFIGS = [
+    {"model": "vit_b"},
+    {"model": "vit_l"},
+    {"model": "vit_h"},
+    {"model": "beit"},
+    {"model": "vit_b", "cpu": True},
+]
+
+STARTUP_PROBE = r'''
+import json, resource, sys, time
+t_start = time.perf_counter()
+cfg = json.loads(sys.argv[1])
+import numpy as np
+import torch
+device = "cuda" if torch.cuda.is_available() and not cfg.get("cpu") else "cpu"
+result = {"device": device, "imports_s": round(time.perf_counter() - t_start, 2)}
+
+def timed(fn):
+    t0 = time.perf_counter()
+    with torch.no_grad(): fn()
+    if device == "cuda": torch.cuda.synchronize()
+    return round(time.perf_counter() - t0, 2)
+
+if cfg["model"] == "beit":
+    from transformers import BeitImageProcessor, BeitForSemanticSegmentation
+    t0 = time.perf_counter()
+    processor = BeitImageProcessor.from_pretrained(cfg["checkpoint"])
+    model = BeitForSemanticSegmentation.from_pretrained(cfg["checkpoint"]).to(device).eval()
+    result["load_s"] = round(time.perf_counter() - t0, 2)
+    pixel_values = processor(images=np.zeros((400, 800, 3), dtype=np.uint8), return_tensors="pt")["pixel_values"].to(device)
+    result["first_inference_s"] = timed(lambda: model(pixel_values=pixel_values))
+    result["warm_inference_s"] = timed(lambda: model(pixel_values=pixel_values))
+else:
+    from segment_anything import sam_model_registry, SamPredictor
+    t0 = time.perf_counter()
+    predictor = SamPredictor(sam_model_registry[cfg["model"]](checkpoint=cfg["checkpoint"]).to(device))
+    result["load_s"] = round(time.perf_counter() - t0, 2)
+    image = np.random.default_rng(0).integers(0, 255, (1024, 2048, 3), dtype=np.uint8)
+    def run():
+        predictor.set_image(image)
+        predictor.predict(point_coords=np.array([[1024, 512]]), point_labels=np.array([1]), multimask_output=True)
+    result["first_inference_s"] = timed(run)
+    result["warm_inference_s"] = timed(run)
+
+result["time_to_first_request_s"] = round(time.perf_counter() - t_start, 2)
+result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+if device == "cuda": result["peak_gpu_mb"] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+print(json.dumps(result))
+'''
+
+def run_startup_probe(cfg):
+    cfg = dict(cfg)
+    cfg["checkpoint"] = BEIT_CHECKPOINT if cfg["model"] == "beit" else sam_checkpoint_path(cfg["model"])
+    proc = subprocess.run([sys.executable, "-c", STARTUP_PROBE, json.dumps(cfg)], capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def run_startup_benchmark():
+    rows = []
+    for cfg in BENCH_CONFIGS:
+        name = cfg["model"] + (" (cpu)" if cfg.get("cpu") else "")
+        row = {"config": name, **run_startup_probe(cfg)}
+        rows.append(row)
+        if "error" in row:
+            print(f"  {name:>12}: ❌ {row['error']}")
+            continue
+        print(f"  {name:>12}: load {row['load_s']}s  first request {row['time_to_first_request_s']}s  "
+              f"warm {row['warm_inference_s']}s  peak RSS {row['peak_rss_mb']}MB  GPU {row.get('peak_gpu_mb', '-')}MB")
+
+    by_name = {r["config"]: r for r in rows if "error" not in r}
+    summary = {
+        # 기존 cell3: 모든 요청이 ViT-H + BEiT 로드를 기다림 / Lazy: 모델이 필요 없는 요청은 즉시 처리
+        "eager_model_wait_s": round(sum(by_name[n]["load_s"] for n in ("vit_h", "beit") if n in by_name), 2),
+        "lazy_model_wait_s": 0.0,
+        "current_server": {"startup": {**STARTUP, "peak_rss_mb": peak_rss_mb()}, "models": MODELS.stats()},
+    }
+    print(f"📊 Model wait before serving: eager {summary['eager_model_wait_s']}s -> lazy 0s")
+    save_bench_results("startup", {"summary": summary, "configs": rows})
+    return rows
+
+run_startup_benchmark()
@@ -1,10 +1,20 @@
 # 1. Install Dependencies
-!pip install -q fastapi uvicorn pyngrok python-multipart opencv-python-headless pillow boto3 google-genai google-generativeai segment-anything transformers accelerate nest_asyncio pydantic numpy scikit-image
+!pip install -q fastapi uvicorn pyngrok python-multipart opencv-python-headless pillow boto3 google-genai google-generativeai segment-anything transformers accelerate nest_asyncio pydantic numpy scikit-image brotli onnx onnxruntime
+# GLB LOD 빌드용 (meshoptimizer gltfpack)
+!npm install -g --silent gltfpack
 
-# 2. Download SAM Weights (ViT-H)
+# 2. Download SAM Weights
+# SAM_MODEL_TYPE: vit_h(2.5GB, 기본) / vit_l(1.2GB) / vit_b(375MB)
+# CPU 전용이거나 작은 GPU에서는 vit_b로 시작 시간과 메모리를 크게 줄일 수 있습니다. (정확도는 다소 낮아짐)
 import os
-SAM_CHECKPOINT = "sam_vit_h_4b8939.pth" 
+SAM_MODEL_TYPE = os.getenv("SAM_MODEL_TYPE", "vit_h")
+SAM_CHECKPOINTS = {
+    "vit_b": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth",
+    "vit_l": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_l_0b3195.pth",
+    "vit_h": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth",
+}
+SAM_CHECKPOINT = os.path.basename(SAM_CHECKPOINTS[SAM_MODEL_TYPE])
 if not os.path.exists(SAM_CHECKPOINT):
-    print("Downloading SAM weights...")
-    !wget -q https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth
+    print(f"Downloading SAM weights ({SAM_MODEL_TYPE})...")
+    !wget -q {SAM_CHECKPOINTS[SAM_MODEL_TYPE]}
     print("Download complete!")
\ No newline at end of file
@@ -1,16 +1,242 @@
 import json
 import os
-import random
+import time
+import gzip
+import shutil
+import hashlib
+import subprocess
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 import boto3
 from botocore import UNSIGNED
 from botocore.config import Config
+from botocore.exceptions import ClientError
 
 # ==========================================
 # [TODO] 여기에 본인의 GitHub Raw URL을 붙여넣으세요!
 # 예: "https://raw.githubusercontent.com/YourName/Repo/main/BE/furniture_3d_only.json"
-GITHUB_RAW_URL = "https://raw.githubusercontent.com/MyShowRoomAI/MyShowRoomAI/refs/heads/main/BE/furniture_3d_only.json" 
+GITHUB_RAW_URL = "https://raw.githubusercontent.com/MyShowRoomAI/MyShowRoomAI/refs/heads/main/BE/furniture_3d_only.json"
 # ==========================================
 
+# ==========================================
+# Furniture Catalog (SQLite + FTS5)
+# ==========================================
+# JSON 리스트(FURNITURE_DB) 대신 디스크 기반 카탈로그를 사용합니다.
+# - id 조회: PRIMARY KEY 인덱스 (카탈로그 크기와 무관)
+# - 카테고리/스타일 필터, FTS5 전문 검색 (name, keywords, style)
+# - 원본 JSON은 스트리밍으로 읽어 전체를 메모리에 올리지 않음
+# - content hash가 바뀐 아이템만 갱신 (incremental sync), 변경마다 seq 증가
+CATALOG_PATH = "furniture_catalog.db"
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16) -> Iterator[Dict[str, Any]]:
+    """`[ {...}, {...} ]` 형태의 JSON 파일을 객체 단위로 스트리밍 파싱합니다. 잘린 파일은 ValueError."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        started = False
+        eof = False
+        while True:
+            buf = buf.lstrip().lstrip(",").lstrip()
+            if not started:
+                if buf.startswith("["):
+                    buf = buf[1:]
+                    started = True
+                    continue
+            elif buf.startswith("]"):
+                return
+            elif buf:
+                try:
+                    obj, end = decoder.raw_decode(buf)
+                    buf = buf[end:]
+                    yield obj
+                    continue
+                except json.JSONDecodeError:
+                    if eof: raise
+            elif eof:
+                # 닫는 "]" 전에 파일이 끝남 (다운로드 중단 등): 일부만 동기화하지 않도록 실패 처리
+                raise ValueError(f"Unexpected end of JSON array: {path}")
+
+            chunk = f.read(chunk_size)
+            if not chunk:
+                if eof: raise ValueError(f"Unexpected end of JSON array: {path}")
+                eof = True
+            buf += chunk
+
+class FurnitureCatalog:
+    """
+    SQLite 기반 가구 카탈로그.
+    스레드마다 별도의 connection을 사용하므로 Inference Executor 스레드에서도 안전합니다.
+    fork된 worker 프로세스(SERVE_WORKERS)는 부모의 connection을 쓰지 않고 새로 엽니다.
+    """
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS items (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                category TEXT,
+                keywords TEXT,
+                style TEXT,
+                model_id TEXT,
+                glb_url TEXT,
+                data TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                seq INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_items_seq ON items(seq);
+            CREATE INDEX IF NOT EXISTS idx_items_glb ON items(glb_url);
+            CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(id UNINDEXED, name, keywords, style);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(items)")}
+        if "assets" not in columns:
+            conn.execute("ALTER TABLE items ADD COLUMN assets TEXT")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @property
+    def version(self) -> int:
+        """변경이 있을 때마다 증가하는 카탈로그 버전 (= 마지막 seq)"""
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        return int(row["value"]) if row else 0
+
+    @staticmethod
+    def _text(value) -> str:
+        if isinstance(value, (list, tuple)): return ", ".join(str(v) for v in value)
+        return str(value or "")
+
+    def ingest(self, objs: Iterable[Dict[str, Any]], batch_size: int = 500) -> Dict[str, int]:
+        """아이템을 스트리밍으로 upsert 합니다. 내용이 같은 아이템은 건너뜁니다."""
+        stats = {"seen": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+        batch = []
+        for obj in objs:
+            if not obj.get("id"): continue
+            stats["seen"] += 1
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                self._upsert(batch, stats)
+                batch = []
+        if batch: self._upsert(batch, stats)
+        return stats
+
+    def _upsert(self, objs: List[Dict[str, Any]], stats: Dict[str, int]):
+        conn = self._conn()
+        with self._write_lock, conn:
+            seq = self.version
+            for obj in objs:
+                data = json.dumps(obj, ensure_ascii=False, sort_keys=True)
+                source_hash = hashlib.sha1(data.encode("utf-8")).hexdigest()
+                row = conn.execute("SELECT source_hash, glb_url, assets FROM items WHERE id = ?", (obj["id"],)).fetchone()
+                if row and row["source_hash"] == source_hash:
+                    stats["unchanged"] += 1
+                    continue
+
+                seq += 1
+                name = self._text(obj.get("name"))
+                keywords = self._text(obj.get("keywords"))
+                style = self._text(obj.get("style_tags"))
+                conn.execute(
+                    "INSERT OR REPLACE INTO items (id, name, category, keywords, style, model_id, glb_url, assets, data, source_hash, seq) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (obj["id"], name, self._text(obj.get("category")), keywords, style, obj.get("3dmodel_id"),
+                     row["glb_url"] if row else obj.get("glb_url"), row["assets"] if row else None, data, source_hash, seq),
+                )
+                conn.execute("DELETE FROM items_fts WHERE id = ?", (obj["id"],))
+                conn.execute("INSERT INTO items_fts (id, name, keywords, style) VALUES (?, ?, ?, ?)",
+                             (obj["id"], name, keywords, style))
+                stats["updated" if row else "inserted"] += 1
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seq', ?)", (str(seq),))
+
+    def set_glb_url(self, item_id: str, glb_url: Optional[str]):
+        conn = self._conn()
+        with self._write_lock, conn:
+            seq = self.version + 1
+            conn.execute("UPDATE items SET glb_url = ?, seq = ? WHERE id = ?", (glb_url, seq, item_id))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seq', ?)", (str(seq),))
+
+    def set_assets(self, item_id: str, assets: Optional[Dict[str, Any]]):
+        """빌드된 GLB 파생 파일(LOD, 압축본) 정보를 저장합니다."""
+        conn = self._conn()
+        with self._write_lock, conn:
+            seq = self.version + 1
+            conn.execute("UPDATE items SET assets = ?, seq = ? WHERE id = ?",
+                         (json.dumps(assets) if assets else None, seq, item_id))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seq', ?)", (str(seq),))
+
+    def _row_to_item(self, row: sqlite3.Row) -> Dict[str, Any]:
+        item = json.loads(row["data"])
+        if row["glb_url"]: item["glb_url"] = row["glb_url"]
+        if row["assets"]: item["assets"] = json.loads(row["assets"])
+        return item
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data, glb_url, assets FROM items WHERE id = ?", (item_id,)).fetchone()
+        return self._row_to_item(row) if row else None
+
+    def get_many(self, item_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        item_ids = list(item_ids)
+        if not item_ids: return []
+        placeholders = ",".join("?" * len(item_ids))
+        rows = self._conn().execute(f"SELECT id, data, glb_url, assets FROM items WHERE id IN ({placeholders})", item_ids).fetchall()
+        by_id = {row["id"]: self._row_to_item(row) for row in rows}
+        return [by_id[i] for i in item_ids if i in by_id]
+
+    def _where(self, categories=None, style=None, has_glb=None, min_seq=None):
+        clauses, params = [], []
+        if categories:
+            clauses.append("(" + " OR ".join(["upper(category) LIKE ? OR upper(keywords) LIKE ?"] * len(categories)) + ")")
+            for c in categories: params += [f"%{c.upper()}%", f"%{c.upper()}%"]
+        if style:
+            clauses.append("lower(style) LIKE ?")
+            params.append(f"%{style.lower()}%")
+        if has_glb is not None:
+            clauses.append("glb_url IS NOT NULL" if has_glb else "glb_url IS NULL")
+        if min_seq is not None:
+            clauses.append("seq > ?")
+            params.append(min_seq)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def find(self, categories: Optional[List[str]] = None, style: Optional[str] = None,
+             has_glb: Optional[bool] = None, min_seq: Optional[int] = None,
+             limit: Optional[int] = None, shuffle: bool = False) -> Iterator[Dict[str, Any]]:
+        """카테고리(category/keywords 부분 일치), 스타일, 3D 보유 여부로 필터링합니다."""
+        where, params = self._where(categories, style, has_glb, min_seq)
+        sql = f"SELECT data, glb_url, assets FROM items{where} ORDER BY {'RANDOM()' if shuffle else 'seq'}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        for row in self._conn().execute(sql, params):
+            yield self._row_to_item(row)
+
+    def count(self, **filters) -> int:
+        where, params = self._where(**filters)
+        return self._conn().execute(f"SELECT COUNT(*) FROM items{where}", params).fetchone()[0]
+
+    def search(self, text: str, limit: int = 20, has_glb: Optional[bool] = True) -> List[Dict[str, Any]]:
+        """FTS5 전문 검색 (bm25 순위). 검색어는 단어 단위 OR 매칭."""
+        terms = [t.replace('"', '') for t in text.split() if t.strip('"')]
+        if not terms: return []
+        query = " OR ".join(f'"{t}"' for t in terms)
+        sql = ("SELECT items.data, items.glb_url, items.assets FROM items_fts JOIN items ON items.id = items_fts.id "
+               "WHERE items_fts MATCH ?")
+        if has_glb is not None:
+            sql += " AND items.glb_url IS NOT NULL" if has_glb else " AND items.glb_url IS NULL"
+        sql += " ORDER BY bm25(items_fts) LIMIT ?"
+        return [self._row_to_item(row) for row in self._conn().execute(sql, (query, limit))]
+
 # 1. Download Metadata from GitHub
 print(f"📥 Downloading metadata from {GITHUB_RAW_URL}...")
 !wget -q {GITHUB_RAW_URL} -O furniture_3d_only.json
@@ -29,51 +255,296 @@ TARGET_CATEGORIES = ['SOFA', 'CHAIR', 'TABLE', 'LAMP', 'DESK', 'SHELF', 'BED']
 s3 = boto3.client('s3', region_name='us-east-1', config=Config(signature_version=UNSIGNED))
 BUCKET_NAME = "amazon-berkeley-objects"
 
-def download_s3_glb(s3_client, model_id, local_path):
-    if os.path.exists(local_path): return True
-    suffix = model_id[-1]
-    keys = [
-        f"3dmodels/original/{suffix}/{model_id}.glb",
-        f"3dmodels/glb/{suffix}/{model_id}.glb",
-        f"3dmodels/original/{model_id}.glb" 
-    ]
-    for key in keys:
-        try:
-            s3_client.download_file(BUCKET_NAME, key, local_path)
+# ==========================================
+# GLB Download Pipeline (Concurrent, Resumable)
+# ==========================================
+# - ThreadPool로 동시에 여러 모델을 다운로드 (DOWNLOAD_WORKERS)
+# - 모델별로 성공한 S3 키 레이아웃을 manifest에 저장하고, 자주 성공하는 레이아웃부터 시도
+# - manifest에 기록된 완료 파일은 크기 검증 후 건너뜀 (중단된 실행 재개)
+# - HEAD의 ContentLength / ETag(MD5)로 다운로드 결과 검증
+# - 처리량(MB/s)과 레이아웃별 실패 원인(404, 403 ...)을 집계
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 16))
+GLB_MANIFEST_PATH = "glb_manifest.json"
+GLB_KEY_LAYOUTS = {
+    "original/suffix": "3dmodels/original/{suffix}/{model_id}.glb",
+    "glb/suffix": "3dmodels/glb/{suffix}/{model_id}.glb",
+    "original/flat": "3dmodels/original/{model_id}.glb",
+}
+
+class DirectoryS3:
+    """
+    로컬 디렉토리 기반 S3 대체 (테스트/오프라인용).
+    root/<bucket>/<key> 파일을 boto3 client와 같은 인터페이스로 제공합니다.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def head_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        with open(path, "rb") as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        return {"ContentLength": os.path.getsize(path), "ETag": f'"{etag}"'}
+
+    def download_file(self, bucket: str, key: str, filename: str):
+        path = self._path(bucket, key)
+        if not os.path.exists(path):
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "GetObject")
+        shutil.copyfile(path, filename)
+
+class GlbDownloader:
+    def __init__(self, s3_client, bucket: str, model_dir: str, manifest_path: str,
+                 max_workers: int = DOWNLOAD_WORKERS, verify_md5: bool = True):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.model_dir = model_dir
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+        self.verify_md5 = verify_md5
+        self._lock = threading.Lock()
+        self.manifest = self._load_manifest()
+        self.layout_wins = Counter(entry["layout"] for entry in self.manifest.values())
+        self.failures = defaultdict(Counter)  # layout -> {error code: count}
+        self.bytes_downloaded = 0
+        self.files_downloaded = 0
+        self.files_skipped = 0
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.manifest_path): return {}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        with self._lock:
+            data = json.dumps(self.manifest, indent=2)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.manifest_path)
+
+    def local_path(self, model_id: str) -> str:
+        return os.path.join(self.model_dir, f"{model_id}.glb")
+
+    def _layouts_for(self, model_id: str) -> List[str]:
+        cached = self.manifest.get(model_id, {}).get("layout")
+        with self._lock:
+            ranked = sorted(GLB_KEY_LAYOUTS, key=lambda name: -self.layout_wins[name])
+        if cached in ranked:
+            ranked.remove(cached)
+            ranked.insert(0, cached)
+        return ranked
+
+    @staticmethod
+    def _file_md5(path: str) -> str:
+        h = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def download(self, model_id: str) -> bool:
+        local_path = self.local_path(model_id)
+        entry = self.manifest.get(model_id)
+        if entry and os.path.exists(local_path) and os.path.getsize(local_path) == entry["size"]:
+            with self._lock: self.files_skipped += 1
+            return True
+
+        part_path = local_path + ".part"
+        for layout in self._layouts_for(model_id):
+            key = GLB_KEY_LAYOUTS[layout].format(suffix=model_id[-1], model_id=model_id)
+            try:
+                head = self.s3.head_object(Bucket=self.bucket, Key=key)
+                self.s3.download_file(self.bucket, key, part_path)
+
+                size = os.path.getsize(part_path)
+                if size != head["ContentLength"]:
+                    raise ValueError(f"size mismatch ({size} != {head['ContentLength']})")
+                etag = head.get("ETag", "").strip('"')
+                # multipart 업로드의 ETag("...-N")는 MD5가 아니므로 크기만 검증
+                if self.verify_md5 and etag and "-" not in etag and self._file_md5(part_path) != etag:
+                    raise ValueError("md5 mismatch")
+                os.replace(part_path, local_path)
+            except Exception as e:
+                code = e.response["Error"]["Code"] if isinstance(e, ClientError) else type(e).__name__
+                with self._lock: self.failures[layout][code] += 1
+                # 받다 만 / 검증 실패한 파일은 남기지 않음
+                if os.path.exists(part_path): os.remove(part_path)
+                continue
+
+            with self._lock:
+                self.manifest[model_id] = {"layout": layout, "key": key, "size": size, "etag": etag}
+                self.layout_wins[layout] += 1
+                self.bytes_downloaded += size
+                self.files_downloaded += 1
             return True
-        except: continue
-    return False
+        return False
+
+    def download_many(self, items: Iterable[Dict[str, Any]], target: Optional[int] = None) -> Iterator[Tuple[Dict[str, Any], bool]]:
+        """
+        items를 동시에 다운로드하고 (item, 성공 여부)를 완료 순서대로 반환합니다.
+        target개가 성공하면 새 작업 제출을 멈춥니다. (None이면 전부)
+        """
+        items = iter(items)
+        succeeded = 0
+        completed = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="glb") as pool:
+            pending = {}
+            while True:
+                while len(pending) < self.max_workers and (target is None or succeeded + len(pending) < target):
+                    item = next(items, None)
+                    if item is None: break
+                    model_id = item.get("3dmodel_id")
+                    if not model_id: continue
+                    pending[pool.submit(self.download, model_id)] = item
+                if not pending: break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    ok = future.result()
+                    succeeded += ok
+                    yield item, ok
+                completed += len(done)
+                if completed % 20 < len(done): self._save_manifest()
+
+        self._save_manifest()
+        self.report(time.perf_counter() - started)
+
+    def report(self, elapsed: float):
+        mb = self.bytes_downloaded / (1024 * 1024)
+        print(f"\n📦 Downloaded {self.files_downloaded} files ({mb:.1f} MB) in {elapsed:.1f}s "
+              f"-> {mb / max(elapsed, 1e-9):.2f} MB/s, {self.files_downloaded / max(elapsed, 1e-9):.2f} files/s "
+              f"(resumed/skipped: {self.files_skipped})")
+        print(f"   Layout wins: {dict(self.layout_wins)}")
+        for layout, codes in self.failures.items():
+            print(f"   ❌ {layout}: {dict(codes)}")
 
-# Load & Download Top 50 Items
-FURNITURE_DB = []
+# ==========================================
+# GLB Asset Build (LOD + Precompression)
+# ==========================================
+# 원본 ABO GLB는 수 MB인 경우가 많아, 모델마다 아래 파생 파일을 미리 만들어 둡니다.
+# - {model_id}.lod{N}.glb : gltfpack으로 단순화(-si) + 양자화/meshopt 압축(-cc)
+#   (프론트엔드 useGLTF는 meshopt 디코더를 기본 사용)
+# - *.glb.br / *.glb.gz   : Brotli / Gzip 사전 압축본 (Accept-Encoding에 따라 서빙)
+# gltfpack이 없으면 LOD 없이 원본만 사전 압축합니다.
+GLTFPACK = shutil.which("gltfpack")
+GLB_LODS = [(0, 1.0), (1, 0.25), (2, 0.05)]  # (level, simplify ratio)
+ASSET_BUILD_WORKERS = int(os.getenv("ASSET_BUILD_WORKERS", 4))
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def file_etag(path: str) -> str:
+    """파일 내용 기반 Strong ETag (서빙 레이어와 동일한 규칙)"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:20]
+
+def _is_fresh(out_path: str, src_path: str) -> bool:
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(src_path)
+
+def precompress(path: str) -> Dict[str, int]:
+    """.br / .gz 사전 압축본을 만들고 크기를 반환합니다. (5% 이상 줄지 않으면 생략)"""
+    sizes = {}
+    raw = None
+    for encoding, ext, compress in (("br", ".br", brotli and (lambda b: brotli.compress(b, quality=11))),
+                                    ("gzip", ".gz", lambda b: gzip.compress(b, compresslevel=9, mtime=0))):
+        if compress is None: continue
+        out_path = path + ext
+        if not _is_fresh(out_path, path):
+            if raw is None:
+                with open(path, "rb") as f: raw = f.read()
+            data = compress(raw)
+            if len(data) > len(raw) * 0.95:
+                if os.path.exists(out_path): os.remove(out_path)
+                continue
+            with open(out_path + ".tmp", "wb") as f: f.write(data)
+            os.replace(out_path + ".tmp", out_path)
+        if os.path.exists(out_path):
+            sizes[encoding] = os.path.getsize(out_path)
+    return sizes
+
+def build_glb_assets(model_path: str) -> Dict[str, Any]:
+    """원본 GLB 하나에 대해 LOD/압축본을 빌드하고 메타데이터를 반환합니다. (이미 최신이면 재사용)"""
+    base = model_path[:-len(".glb")]
+    files = []
+    if GLTFPACK:
+        for level, ratio in GLB_LODS:
+            out_path = f"{base}.lod{level}.glb"
+            if not _is_fresh(out_path, model_path):
+                cmd = [GLTFPACK, "-i", model_path, "-o", out_path + ".tmp.glb", "-cc"]
+                if ratio < 1.0: cmd += ["-si", str(ratio)]
+                result = subprocess.run(cmd, capture_output=True, text=True)
+                if result.returncode != 0:
+                    print(f"⚠️ gltfpack failed ({os.path.basename(out_path)}): {result.stderr.strip()[:200]}")
+                    continue
+                os.replace(out_path + ".tmp.glb", out_path)
+            files.append((level, ratio, out_path))
+    files.append(("original", 1.0, model_path))
+
+    lods = []
+    for level, ratio, path in files:
+        lods.append({
+            "level": level,
+            "simplify_ratio": ratio,
+            "file": os.path.basename(path),
+            "bytes": os.path.getsize(path),
+            "encoded_bytes": precompress(path),
+            "etag": file_etag(path),
+        })
+    return {"lods": lods}
+
+# Sync Catalog & Download 30 Items
+CATALOG = FurnitureCatalog(CATALOG_PATH)
 if os.path.exists("furniture_3d_only.json"):
-    with open("furniture_3d_only.json", 'r', encoding='utf-8') as f:
-        all_items = json.load(f)
-    
-    random.shuffle(all_items)
+    # 변경된 아이템만 갱신 (전체 JSON을 메모리에 올리지 않음)
+    sync_stats = CATALOG.ingest(iter_json_array("furniture_3d_only.json"))
+    print(f"✅ Catalog synced: {sync_stats} (version={CATALOG.version})")
+
+    # 런타임 재시작 등으로 GLB 파일이 사라진 아이템은 다시 다운로드 대상으로 되돌림
+    for obj in list(CATALOG.find(has_glb=True)):
+        if not os.path.exists(os.path.join(MODEL_DIR, os.path.basename(obj['glb_url']))):
+            CATALOG.set_glb_url(obj['id'], None)
+
     print("🚀 Downloading 3D Models from S3...")
-    
-    count = 0
-    for obj in all_items:
-        if count >= 30: break # 데모용으로 30개만 다운로드 (속도 최적화)
-        
-        cat_str = str(obj.get('category', '')).upper() + " " + str(obj.get('keywords', '')).upper()
-        if not any(c in cat_str for c in TARGET_CATEGORIES): continue
-        
-        model_id = obj.get('3dmodel_id')
-        if not model_id: continue
-        
-        filename = f"{model_id}.glb"
-        local_path = os.path.join(MODEL_DIR, filename)
-        
-        if download_s3_glb(s3, model_id, local_path):
-            obj['glb_url'] = f"/3d_models/{filename}"
-            FURNITURE_DB.append(obj)
-            count += 1
+
+    DEMO_ITEM_COUNT = 30 # 데모용으로 30개만 다운로드 (속도 최적화), None이면 전체
+    downloader = GlbDownloader(s3, BUCKET_NAME, MODEL_DIR, GLB_MANIFEST_PATH)
+    remaining = None if DEMO_ITEM_COUNT is None else max(0, DEMO_ITEM_COUNT - CATALOG.count(has_glb=True))
+    if remaining != 0:
+        candidates = CATALOG.find(categories=TARGET_CATEGORIES, has_glb=False, shuffle=True)
+        for obj, ok in downloader.download_many(candidates, target=remaining):
+            if not ok: continue
+            CATALOG.set_glb_url(obj['id'], f"/3d_models/{obj['3dmodel_id']}.glb")
             print(".", end="")
-            
-    print(f"\n✅ Ready: {len(FURNITURE_DB)} items loaded.")
-    
-    # Save prepared DB
-    with open("furniture_db.json", "w", encoding='utf-8') as f:
-        json.dump(FURNITURE_DB, f, indent=2, ensure_ascii=False)
\ No newline at end of file
+
+    print(f"\n✅ Ready: {CATALOG.count(has_glb=True)} items with 3D models.")
+
+    # LOD / 사전 압축본 빌드 (원본보다 오래된 파일만 다시 생성)
+    print(f"🛠️ Building GLB assets (gltfpack: {'yes' if GLTFPACK else 'no'}, brotli: {'yes' if brotli else 'no'})...")
+    items_with_glb = list(CATALOG.find(has_glb=True))
+    total_original, total_smallest = 0, 0
+    with ThreadPoolExecutor(max_workers=ASSET_BUILD_WORKERS, thread_name_prefix="asset") as pool:
+        futures = {
+            pool.submit(build_glb_assets, os.path.join(MODEL_DIR, os.path.basename(obj['glb_url']))): obj
+            for obj in items_with_glb
+        }
+        for future, obj in futures.items():
+            try:
+                assets = future.result()
+            except Exception as e:
+                print(f"⚠️ Asset build failed for {obj['id']}: {e}")
+                continue
+            if assets != obj.get('assets'):
+                CATALOG.set_assets(obj['id'], assets)
+            total_original += assets["lods"][-1]["bytes"]
+            total_smallest += min(min([lod["bytes"], *lod["encoded_bytes"].values()]) for lod in assets["lods"])
+    print(f"✅ Assets ready: original {total_original / 1e6:.1f} MB -> smallest variant {total_smallest / 1e6:.1f} MB")
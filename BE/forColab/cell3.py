@@ -1,14 +1,35 @@
 import os
 import io
+import re
+import gc
+import sys
 import json
+import time
+import base64
 import asyncio
-from typing import List, Dict, Optional, Any
+import random
+import signal
+import hashlib
+import resource
+import unicodedata
+import threading
+import contextvars
+import urllib.request
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue, Empty
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import List, Dict, Optional, Any, Tuple
 from google import genai
 from google.genai import types
 import google.generativeai as genai_legacy
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from PIL import Image
 import cv2
 import numpy as np
@@ -17,6 +38,7 @@ import torch
 from transformers import BeitImageProcessor, BeitForSemanticSegmentation
 from segment_anything import sam_model_registry, SamPredictor
 from pydantic import BaseModel
+import uvicorn
 from google.colab import userdata
 
 # ==========================================
@@ -30,393 +52,3019 @@ try:
 except:
     pass 
 
-client = genai.Client(api_key=GOOGLE_API_KEY)
+# GEMINI_BASE_URL: 로컬 Fake 서버로 연결할 때만 설정 (bench/gemini_gateway.py)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+def make_genai_client() -> genai.Client:
+    return genai.Client(
+        api_key=GOOGLE_API_KEY,
+        http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None,
+    )
+
+client = make_genai_client()
 genai_legacy.configure(api_key=GOOGLE_API_KEY)
 
-# Init Models
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# Init Models
+device = "cuda" if torch.cuda.is_available() else "cpu"
+CELL_STARTED = time.perf_counter()
+
+# ==========================================
+# [Perf] CPU Inference Backend (ONNX Runtime)
+# ==========================================
+# INFERENCE_BACKEND: torch | onnx | onnx-int8 | auto (GPU -> torch, CPU -> onnx)
+# onnx 계열은 BEiT 전체와 SAM 이미지 인코더를 ONNX로 한 번 export(ONNX_DIR에 캐시)한 뒤
+# ONNX Runtime(CPU)으로 실행합니다. onnx-int8은 가중치를 int8로 동적 양자화합니다.
+# SAM Prompt Encoder / Mask Decoder는 가벼우므로 PyTorch 그대로 사용합니다.
+# 실제 가중치로 bench/cpu_backend.py 마스크 IoU를 확인하기 전까지 기본값은 torch (onnx 계열 / auto는 명시적으로 선택)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+if INFERENCE_BACKEND == "auto":
+    INFERENCE_BACKEND = "torch" if device == "cuda" else "onnx"
+if INFERENCE_BACKEND not in ("torch", "onnx", "onnx-int8"):
+    raise ValueError(f"Unknown INFERENCE_BACKEND: {INFERENCE_BACKEND}")
+ONNX_DIR = os.getenv("ONNX_DIR", "/content/onnx")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", os.cpu_count() or 1))
+ONNX_OPSET = 17
+# 멀티 프로세스 서빙(SERVE_WORKERS > 1, 아래 [Perf] Multi-Process Serving)이면 fork 전에 부모가 가중치만 올려 두고
+# 세션은 각 worker가 그 메모리를 공유해서 엽니다.
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", 1))
+
+def backend_device(backend: str) -> str:
+    """ONNX 백엔드는 CPU에서만 실행합니다."""
+    return device if backend == "torch" else "cpu"
+
+def export_onnx(module: torch.nn.Module, example: torch.Tensor, path: str,
+                input_name: str, output_name: str, dynamic_batch: bool = False):
+    module = module.cpu().eval()
+    dynamic_axes = {input_name: {0: "batch"}, output_name: {0: "batch"}} if dynamic_batch else None
+    try:
+        with torch.no_grad():
+            torch.onnx.export(module, (example,), path, input_names=[input_name], output_names=[output_name],
+                              dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, do_constant_folding=True)
+    except Exception:
+        if os.path.exists(path): os.remove(path)
+        raise
+
+class OnnxSession:
+    """
+    onnxruntime.InferenceSession 대체 (run()만 사용). ORT 스레드 풀은 fork된 프로세스에서 쓸 수 없으므로
+    세션을 연 프로세스가 아니면 다시 엽니다.
+    share_weights=True: 가중치(initializer)를 numpy로 한 번 읽어 두고, 그래프에서는 initializer를 입력으로 바꿔
+    run()마다 그 버퍼를 그대로 넘깁니다. fork 전에 만들면 worker들이 Copy-on-Write로 같은 메모리를 공유합니다.
+    (add_initializer는 세션이 .onnx 파일의 가중치를 다시 읽어 worker마다 복사본이 생김)
+    """
+    def __init__(self, path: str, share_weights: bool = False):
+        self.path = path
+        self.graph, self.weights = self._split_weights(path) if share_weights else (path, None)
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if not share_weights: self._open()
+
+    @staticmethod
+    def _split_weights(path: str) -> Tuple[bytes, Dict[str, np.ndarray]]:
+        """(가중치를 뺀 그래프 bytes, {이름: 가중치}) - 가중치는 그래프 입력이 됩니다."""
+        import onnx
+        from onnx import helper, numpy_helper
+        model = onnx.load(path)  # 외부 데이터(.data)도 함께 로드
+        weights = {t.name: numpy_helper.to_array(t) for t in model.graph.initializer}
+        inputs = {i.name for i in model.graph.input}
+        for t in model.graph.initializer:
+            if t.name not in inputs:
+                model.graph.input.append(helper.make_tensor_value_info(t.name, t.data_type, list(t.dims)))
+        del model.graph.initializer[:]
+        return model.SerializeToString(), weights
+
+    def _open(self):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = ONNX_THREADS
+        self._session = ort.InferenceSession(self.graph, options, providers=["CPUExecutionProvider"])
+        self._pid = os.getpid()
+
+    def run(self, output_names, feed):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid(): self._open()
+        if self.weights is not None: feed = {**self.weights, **feed}  # CPU 입력은 복사 없이 numpy 버퍼를 그대로 사용
+        return self._session.run(output_names, feed)
+
+def onnx_session(name: str, backend: str, export_fn) -> OnnxSession:
+    """
+    ONNX_DIR/<name>.onnx (fp32)와 <name>.int8.onnx를 처음 필요할 때 한 번만 만들고 CPU 세션을 엽니다.
+    export_fn(path)는 fp32 그래프를 path에 저장해야 합니다.
+    """
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    path = os.path.join(ONNX_DIR, f"{name}.onnx")
+    if not os.path.exists(path):
+        print(f"⏳ Exporting {name} to ONNX (one-time)...")
+        export_fn(path)
+    if backend == "onnx-int8":
+        fp32_path, path = path, os.path.join(ONNX_DIR, f"{name}.int8.onnx")
+        if not os.path.exists(path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            print(f"⏳ Quantizing {name} to int8 (one-time)...")
+            # ViT-H 인코더는 2GB를 넘으므로 가중치를 외부 파일로 저장
+            quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8, use_external_data_format=True)
+    return OnnxSession(path, share_weights=SERVE_WORKERS > 1)
+
+class SegLogits(torch.nn.Module):
+    """ONNX export용: BeitForSemanticSegmentation 출력에서 logits만 반환"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+class OnnxSegModel:
+    """seg_model 대체 (ONNX Runtime). model(pixel_values=...).logits 인터페이스를 유지합니다."""
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, pixel_values: torch.Tensor):
+        logits = self.session.run(None, {"pixel_values": pixel_values.cpu().numpy()})[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+class OnnxImageEncoder(torch.nn.Module):
+    """SAM image_encoder 대체 (ONNX Runtime). SamPredictor가 사용하는 img_size 속성을 유지합니다."""
+    def __init__(self, session, img_size: int):
+        super().__init__()
+        self.session = session
+        self.img_size = img_size
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.from_numpy(self.session.run(None, {"image": x.cpu().numpy()})[0])
+
+print(f"🧮 Inference backend: {INFERENCE_BACKEND} (device={device})")
+
+# ==========================================
+# [Perf] Lazy Model Registry
+# ==========================================
+# SAM / BEiT는 cell 실행 시점이 아니라 처음 필요할 때 로드합니다. (/consult는 모델 없이 바로 동작)
+# MODEL_WARMUP=1 이면 서버 시작 직후 백그라운드에서 로드 + 더미 추론(warm-up)을 실행합니다.
+# 모델별 상태(not_loaded / loading / ready / failed)는 헬스체크(/)의 "models"에서 확인할 수 있습니다.
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+MODEL_WARMUP_TIMEOUT = float(os.getenv("MODEL_WARMUP_TIMEOUT", 900))
+
+def peak_rss_mb() -> float:
+    """프로세스 최대 RSS (Linux ru_maxrss 단위는 KB)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+class ModelSlot:
+    """레지스트리 항목 하나: 로더, warm-up 함수, 로드 상태와 시간"""
+    def __init__(self, name: str, loader, warmup=None):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.value = None
+        self.status = "not_loaded"
+        self.error = None
+        self.load_s = None
+        self.warmup_s = None
+        self.ready_at_s = None  # cell 실행 시작부터 사용 가능해질 때까지
+        self.peak_rss_mb = None
+        self.lock = threading.Lock()
+
+class ModelRegistry:
+    """
+    이름 -> 모델 지연 로딩. get()은 처음 호출될 때 한 번만 로드하고(스레드 안전),
+    로드에 실패하면 503을 반환하며 다음 호출에서 다시 시도합니다.
+    """
+    def __init__(self):
+        self._slots: Dict[str, ModelSlot] = {}
+
+    def register(self, name: str, loader, warmup=None):
+        self._slots[name] = ModelSlot(name, loader, warmup)
+
+    def get(self, name: str):
+        slot = self._slots[name]
+        if slot.value is not None: return slot.value
+        with slot.lock:
+            if slot.value is None:
+                slot.status = "loading"
+                print(f"⏳ Loading model '{name}'...")
+                t0 = time.perf_counter()
+                try:
+                    value = slot.loader()
+                except Exception as e:
+                    slot.status, slot.error = "failed", str(e)
+                    print(f"❌ Model '{name}' failed to load: {e}")
+                    raise HTTPException(status_code=503, detail=f"{name} model is unavailable: {e}")
+                slot.load_s = round(time.perf_counter() - t0, 2)
+                slot.ready_at_s = round(time.perf_counter() - CELL_STARTED, 2)
+                slot.peak_rss_mb = peak_rss_mb()
+                slot.status, slot.error, slot.value = "ready", None, value
+                print(f"✅ Model '{name}' loaded in {slot.load_s}s (peak RSS {slot.peak_rss_mb} MB)")
+        return slot.value
+
+    def set(self, name: str, value):
+        """로더 대신 주어진 객체를 사용합니다. (벤치마크용 스텁 모델, None이면 다시 지연 로딩)"""
+        slot = self._slots[name]
+        with slot.lock:
+            slot.value = value
+            slot.status = "ready" if value is not None else "not_loaded"
+
+    def peek(self, name: str):
+        """로드하지 않고 현재 값만 반환 (없으면 None)"""
+        return self._slots[name].value
+
+    def warm_up(self, name: str):
+        """로드 후 더미 추론을 한 번 실행합니다. (CUDA 커널 / cuDNN 초기화를 첫 요청 전에 끝냄)"""
+        value = self.get(name)
+        slot = self._slots[name]
+        if slot.warmup is not None and slot.warmup_s is None:
+            t0 = time.perf_counter()
+            slot.warmup(value)
+            slot.warmup_s = round(time.perf_counter() - t0, 2)
+            print(f"🔥 Model '{name}' warmed up in {slot.warmup_s}s")
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "status": slot.status,
+                "load_s": slot.load_s,
+                "warmup_s": slot.warmup_s,
+                "ready_at_s": slot.ready_at_s,
+                "peak_rss_mb": slot.peak_rss_mb,
+                "error": slot.error,
+            }
+            for name, slot in self._slots.items()
+        }
+
+MODELS = ModelRegistry()
+
+# 1. SAM (Segment Anything Model) - Apache 2.0 (OSI Approved)
+# SAM_MODEL_TYPE / SAM_CHECKPOINTS는 cell1.py에서 설정합니다. (vit_b / vit_l / vit_h)
+def sam_checkpoint_path(model_type: str) -> str:
+    url = SAM_CHECKPOINTS[model_type]
+    path = os.path.basename(url)
+    if not os.path.exists(path):
+        print(f"Downloading SAM weights ({model_type})...")
+        urllib.request.urlretrieve(url, path + ".part")
+        os.replace(path + ".part", path)
+    return path
+
+def load_sam(backend: str = INFERENCE_BACKEND) -> SamPredictor:
+    sam = sam_model_registry[SAM_MODEL_TYPE](checkpoint=sam_checkpoint_path(SAM_MODEL_TYPE))
+    if backend != "torch":
+        encoder = sam.image_encoder
+        example = torch.zeros(1, 3, encoder.img_size, encoder.img_size)
+        session = onnx_session(f"sam_{SAM_MODEL_TYPE}_encoder", backend,
+                               lambda path: export_onnx(encoder, example, path, "image", "embeddings"))
+        sam.image_encoder = OnnxImageEncoder(session, encoder.img_size)  # PyTorch 인코더 가중치 해제
+        del encoder
+    sam.to(device=backend_device(backend))
+    return SamPredictor(sam)
+
+# [Predictor Pool] SamPredictor는 set_image()한 이미지 상태(features)를 인스턴스에 저장하므로
+# 동시 요청이 하나의 predictor를 공유하면 서로의 임베딩을 덮어씁니다.
+# 가중치(sam 모델)는 하나만 두고, 이미지 상태만 갖는 가벼운 SamPredictor를 SAM_WORKERS개 만들어
+# 요청마다 하나씩 빌려 씁니다. (SAM Executor worker 수와 같으므로 대기 없이 항상 하나를 받음)
+SAM_WORKERS = int(os.getenv("SAM_WORKERS", 2))
+
+class SamPredictorPool:
+    def __init__(self, predictors: List[Any]):
+        self.size = len(predictors)
+        self._free = Queue()
+        for predictor in predictors: self._free.put(predictor)
+
+    @classmethod
+    def sharing(cls, predictor: SamPredictor, size: int) -> "SamPredictorPool":
+        """predictor.model(가중치)을 공유하는 SamPredictor size개"""
+        return cls([predictor] + [SamPredictor(predictor.model) for _ in range(size - 1)])
+
+    @contextmanager
+    def acquire(self):
+        predictor = self._free.get()
+        try:
+            yield predictor
+        finally:
+            self._free.put(predictor)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": self.size, "free": self._free.qsize()}
+
+def load_sam_pool(backend: str = INFERENCE_BACKEND) -> SamPredictorPool:
+    return SamPredictorPool.sharing(load_sam(backend), SAM_WORKERS)
+
+def warmup_sam(pool: SamPredictorPool):
+    # 임베딩 캐시를 거치지 않고 인코더 + 디코더를 한 번 실행
+    with pool.acquire() as sam_predictor:
+        sam_predictor.set_image(np.zeros((512, 1024, 3), dtype=np.uint8))
+        sam_predictor.predict(point_coords=np.array([[512, 256]]), point_labels=np.array([1]), multimask_output=True)
+        sam_predictor.reset_image()
+
+MODELS.register("sam", load_sam_pool, warmup_sam)
+
+# ==========================================
+# [Perf] SAM Image Embedding Cache
+# ==========================================
+# 같은 파노라마를 다시 클릭하면 SAM 이미지 인코더(set_image)를 건너뛰고
+# 가벼운 Mask Decoder(predict)만 실행합니다.
+SAM_CACHE_MAX_BYTES = int(os.getenv("SAM_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 임베딩 1개 ≈ 4MB
+
+class SamEmbeddingCache:
+    """
+    이미지 내용(Content Hash)을 키로 SamPredictor의 임베딩을 저장하는 LRU 캐시.
+    메모리 상한(max_bytes)을 넘으면 가장 오래 사용되지 않은 항목부터 제거합니다.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (features, original_size, input_size, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def image_key(image_rgb: np.ndarray) -> str:
+        h = hashlib.sha1(str(image_rgb.shape).encode())
+        h.update(np.ascontiguousarray(image_rgb).data)
+        return h.hexdigest()
+
+    def set_image(self, sam_predictor: SamPredictor, image_rgb: np.ndarray,
+                  key: Optional[str] = None, encoder_input=None) -> str:
+        """
+        predictor.set_image() 대체: 캐시 HIT이면 임베딩만 복원합니다.
+        key: 이미 아는 Content Hash (없으면 픽셀 해시), encoder_input: (w, h) -> 그 크기의 RGB를 주는 함수
+        (ImagePyramid.rgb). 주면 SamPredictor 내부 PIL 리사이즈 대신 미리 줄인 인코더 입력을 사용합니다.
+        """
+        key = key or self.image_key(image_rgb)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            features, original_size, input_size, _ = entry
+            sam_predictor.reset_image()
+            sam_predictor.features = features
+            sam_predictor.original_size = original_size
+            sam_predictor.input_size = input_size
+            sam_predictor.is_image_set = True
+            print(f"🧠 SAM Cache HIT ({self._summary()})")
+            return key
+
+        if encoder_input is not None and hasattr(sam_predictor, "set_torch_image"):
+            h, w = image_rgb.shape[:2]
+            new_h, new_w = sam_predictor.transform.get_preprocess_shape(h, w, sam_predictor.transform.target_length)
+            input_torch = torch.as_tensor(encoder_input((new_w, new_h)), device=sam_predictor.device)
+            sam_predictor.set_torch_image(input_torch.permute(2, 0, 1).contiguous()[None, :, :, :], (h, w))
+        else:
+            sam_predictor.set_image(image_rgb)
+        self._put(key, sam_predictor)
+        print(f"🧠 SAM Cache MISS ({self._summary()})")
+        return key
+
+    def _put(self, key: str, sam_predictor: SamPredictor):
+        features = sam_predictor.features
+        nbytes = features.element_size() * features.nelement()
+        if nbytes > self.max_bytes: return
+
+        with self._lock:
+            if key in self._entries: return
+            self._entries[key] = (features, sam_predictor.original_size, sam_predictor.input_size, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.evictions += 1
+
+    def _summary(self) -> str:
+        return f"hits={self.hits}, misses={self.misses}, evictions={self.evictions}"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+sam_embedding_cache = SamEmbeddingCache(SAM_CACHE_MAX_BYTES)
+
+# 2. [교체 완료] Semantic Segmentation Model
+# Model: Microsoft BEiT (Base)
+# License: MIT License (OSI Approved, Commercial Use OK)
+# Dataset: ADE20K (Contains Floor, Rug, Carpet classes)
+# (로드는 아래 load_beit에서 MODELS 레지스트리가 처음 필요할 때 수행)
+BEIT_CHECKPOINT = "microsoft/beit-base-finetuned-ade-640-640"
+
+# ==========================================
+# [Perf] BEiT Dynamic Micro-Batching
+# ==========================================
+# 짧은 시간(window) 안에 들어온 바닥 분석 요청들을 모아 한 번의 forward pass로 처리합니다.
+# BEIT_MAX_BATCH=1 이면 기존처럼 요청마다 단독 실행됩니다. (CPU 환경에서도 동작)
+BEIT_BATCH_WINDOW_MS = float(os.getenv("BEIT_BATCH_WINDOW_MS", 15))
+BEIT_MAX_BATCH = int(os.getenv("BEIT_MAX_BATCH", 4))
+
+class SegBatcher:
+    """
+    seg_model 앞단의 배칭 레이어.
+    호출 스레드는 infer()에서 자기 결과(logits)만 받아갑니다.
+    입력 텐서 shape별로 그룹을 나누어 같은 shape끼리만 torch.cat 합니다.
+    """
+    def __init__(self, model, max_batch: int, window_ms: float):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.window_s = window_ms / 1000.0
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self.batch_histogram = {}  # batch size -> count
+        self.images = 0
+        self.batches = 0
+        self.forward_s = 0.0
+        self._started = time.perf_counter()
+        self._thread = None
+
+    def _ensure_thread(self):
+        # 배칭 스레드는 처음 infer()에서 시작 (fork된 worker 프로세스에는 부모의 스레드가 없으므로 다시 시작)
+        if self._thread is not None and self._thread.is_alive(): return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="beit-batcher", daemon=True)
+                self._thread.start()
+
+    def infer(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((pixel_values, future))
+        return future.result()
+
+    def infer_many(self, pixel_values_list: List[torch.Tensor]) -> List[torch.Tensor]:
+        """한 요청의 여러 이미지(cubemap 면 등)를 한꺼번에 큐에 넣고 이미지별 logits를 순서대로 받습니다."""
+        self._ensure_thread()
+        futures = [Future() for _ in pixel_values_list]
+        for pixel_values, future in zip(pixel_values_list, futures):
+            self._queue.put((pixel_values, future))
+        return [future.result() for future in futures]
+
+    def _loop(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.perf_counter() + self.window_s
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0: break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+
+            groups = {}
+            for pixel_values, future in pending:
+                groups.setdefault(tuple(pixel_values.shape[1:]), []).append((pixel_values, future))
+            for group in groups.values():
+                self._run(group)
+
+    def _run(self, group):
+        try:
+            batch = torch.cat([pixel_values for pixel_values, _ in group]).to(device)
+            t0 = time.perf_counter()
+            with torch.no_grad():
+                logits = self.model(pixel_values=batch).logits
+            elapsed = time.perf_counter() - t0
+        except Exception as e:
+            for _, future in group: future.set_exception(e)
+            return
+
+        with self._lock:
+            size = len(group)
+            self.batch_histogram[size] = self.batch_histogram.get(size, 0) + 1
+            self.images += size
+            self.batches += 1
+            self.forward_s += elapsed
+        for i, (_, future) in enumerate(group):
+            future.set_result(logits[i:i + 1])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            uptime = time.perf_counter() - self._started
+            return {
+                "max_batch": self.max_batch,
+                "window_ms": self.window_s * 1000.0,
+                "images": self.images,
+                "batches": self.batches,
+                "batch_size_histogram": dict(sorted(self.batch_histogram.items())),
+                "avg_batch_size": round(self.images / self.batches, 2) if self.batches else 0.0,
+                "images_per_s": round(self.images / uptime, 3) if uptime else 0.0,
+                "forward_images_per_s": round(self.images / self.forward_s, 3) if self.forward_s else 0.0,
+            }
+
+@dataclass
+class BeitModel:
+    processor: BeitImageProcessor
+    model: Any  # BeitForSemanticSegmentation 또는 OnnxSegModel
+    batcher: SegBatcher
+
+def load_beit(backend: str = INFERENCE_BACKEND) -> BeitModel:
+    print(f"⏳ Loading Microsoft BEiT Model (MIT License, backend={backend})...")
+    processor = BeitImageProcessor.from_pretrained(BEIT_CHECKPOINT)
+    seg_model = BeitForSemanticSegmentation.from_pretrained(BEIT_CHECKPOINT)
+    seg_model.eval()
+    if backend != "torch":
+        example = torch.zeros(1, 3, processor.size["height"], processor.size["width"])
+        session = onnx_session("beit-base-ade-640", backend,
+                               lambda path: export_onnx(SegLogits(seg_model), example, path, "pixel_values", "logits", dynamic_batch=True))
+        seg_model = OnnxSegModel(session)
+    else:
+        seg_model.to(device)
+    return BeitModel(processor, seg_model, SegBatcher(seg_model, BEIT_MAX_BATCH, BEIT_BATCH_WINDOW_MS))
+
+def warmup_beit(beit: BeitModel):
+    inputs = beit.processor(images=np.zeros((400, 800, 3), dtype=np.uint8), return_tensors="pt")
+    beit.batcher.infer(inputs["pixel_values"])
+
+MODELS.register("beit", load_beit, warmup_beit)
+
+# App Setup
+app = FastAPI()
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+
+# ==========================================
+# [Perf] Stage Timing, /metrics, Server-Timing
+# ==========================================
+# with stage("name"): 블록의 실행 시간을
+# - Prometheus 히스토그램(/metrics, showroom_stage_seconds{stage=...})에 누적하고
+# - 현재 요청의 Server-Timing 응답 헤더(브라우저 개발자 도구 Network > Timing)에 추가합니다.
+# 요청별 기록은 contextvars로 전달되므로 Inference Executor / asyncio.to_thread 스레드 안에서도 동작합니다.
+# PROFILING_ENABLED=1 이면 헤더 X-Profile: 1 (또는 ?profile=1) 요청에 샘플링 프로파일러를 붙입니다.
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = "/content/profiles"
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+class Histograms:
+    """라벨 조합별 누적 히스토그램 (Prometheus text exposition format)"""
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels: Tuple[str, ...], seconds: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound: series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for labels, series in items:
+            label_text = ",".join(f'{k}="{v}"' for k, v in zip(self.label_names, labels))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-1]}")
+        return lines
+
+STAGE_SECONDS = Histograms("showroom_stage_seconds", "Time spent in each pipeline stage", ("stage",))
+REQUEST_SECONDS = Histograms("showroom_request_seconds", "HTTP request latency", ("method", "route", "status"))
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe((name,), elapsed)
+        timings = _request_timings.get()
+        if timings is not None: timings.append((name, elapsed))
+
+class SamplingProfiler:
+    """
+    interval마다 sys._current_frames()로 모든 스레드의 스택을 샘플링합니다. (외부 의존성 없음)
+    결과는 folded stack 형식 ("a;b;c 12") 이라 speedscope / flamegraph.pl로 바로 열 수 있습니다.
+    동시에 처리 중인 다른 요청의 스택도 섞일 수 있으므로 부하가 없을 때 사용하세요.
+    """
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval_s = interval_ms / 1000.0
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="sampling-profiler", daemon=True)
+
+    def _loop(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me: continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+def route_label(request: Request) -> str:
+    """라우트 템플릿 (/blobs/{handle}) 단위로 집계해 라벨 수가 늘어나지 않게 합니다."""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+@app.middleware("http")
+async def stage_timing_middleware(request: Request, call_next):
+    timings = []
+    _request_timings.set(timings)
+    profiler = None
+    if PROFILING_ENABLED and (request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1"):
+        profiler = SamplingProfiler().start()
+
+    t0 = time.perf_counter()
+    response = None
+    try:
+        response = await call_next(request)
+    finally:
+        # call_next가 예외를 던져도 500으로 집계하고, 프로파일러 스레드를 멈춘 뒤 예외를 그대로 전달
+        total = time.perf_counter() - t0
+        status = str(response.status_code) if response is not None else "500"
+        REQUEST_SECONDS.observe((request.method, route_label(request), status), total)
+        if response is None and profiler is not None: profiler.stop()  # join은 최대 샘플링 간격 1회
+
+    # 같은 이름의 단계(재시도 등)는 합산, 기록 순서 유지
+    merged = {}
+    for name, elapsed in timings: merged[name] = merged.get(name, 0.0) + elapsed
+    entries = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in merged.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(entries)
+    response.headers["Timing-Allow-Origin"] = "*"
+
+    if profiler is not None:
+        folded = await asyncio.to_thread(profiler.stop)
+        profile_id = f"{int(time.time() * 1000)}-{route_label(request).strip('/').replace('/', '_') or 'root'}"
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded"), "w", encoding="utf-8") as f:
+            f.write(folded)
+        response.headers["X-Profile"] = f"/profiles/{profile_id}"
+    return response
+
+@app.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str):
+    path = os.path.join(PROFILE_DIR, f"{os.path.basename(profile_id)}.folded")
+    if not PROFILING_ENABLED or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+# ==========================================
+# [Perf] GLB Asset Serving (/3d_models)
+# ==========================================
+# StaticFiles 대신 캐시 친화적인 서빙 레이어를 사용합니다.
+# - Strong ETag (파일 내용 해시) + If-None-Match -> 304
+# - URL의 ?v=<etag>가 현재 파일과 같으면 immutable 캐시 (1년)
+# - Accept-Encoding에 따라 사전 압축된 .br / .gz 파일 서빙 (Vary: Accept-Encoding)
+# - Range 요청 (206 Partial Content, If-Range)
+MODEL_DIR = "/content/3d_models"
+ASSET_CHUNK_SIZE = 256 * 1024
+ASSET_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+ASSET_REVALIDATE_CACHE = "public, max-age=0, must-revalidate"
+_asset_etags = {}
+
+def cached_file_etag(path: str) -> str:
+    """file_etag(cell2)를 (경로, 크기, 수정시각) 단위로 캐시합니다."""
+    st = os.stat(path)
+    cache_key = (path, st.st_size, st.st_mtime_ns)
+    etag = _asset_etags.get(cache_key)
+    if etag is None:
+        etag = _asset_etags[cache_key] = file_etag(path)
+    return etag
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0: continue
+            except ValueError:
+                continue
+        if name: accepted.add(name.strip().lower())
+    return accepted
+
+def _parse_range(header: str, size: int):
+    """단일 'bytes=' 범위만 지원. 형식이 다르면 None (전체 응답), 범위 밖이면 ValueError."""
+    if not header.startswith("bytes=") or "," in header: return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_s == "":
+            start, end = max(0, size - int(end_s)), size - 1
+        else:
+            start = int(start_s)
+            end = min(int(end_s), size - 1) if end_s else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size: raise ValueError("unsatisfiable range")
+    return start, end
+
+def _iter_file(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(ASSET_CHUNK_SIZE, remaining))
+            if not chunk: break
+            remaining -= len(chunk)
+            yield chunk
+
+def send_file(request: Request, path: str, etag: str, media_type: str, cache_control: str) -> Response:
+    """ETag/304, 사전 압축본(.br/.gz) 선택, Range(206/416)를 처리하는 공통 파일 응답"""
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() != f'"{etag}"':
+        range_header = None
+
+    # Range 요청은 원본(identity) 바이트 기준으로만 처리
+    encoding, serve_path = None, path
+    if not range_header:
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        for name, ext in (("br", ".br"), ("gzip", ".gz")):
+            if name in accepted and os.path.isfile(path + ext):
+                encoding, serve_path = name, path + ext
+                break
+
+    variant_etag = f'"{etag}-{encoding}"' if encoding else f'"{etag}"'
+    headers = {
+        "ETag": variant_etag,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+        "Cache-Control": cache_control,
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or variant_etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    size = os.path.getsize(serve_path)
+    start, end, status_code = 0, size - 1, 200
+    if range_header:
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+    if encoding: headers["Content-Encoding"] = encoding
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(_iter_file(serve_path, start, end), status_code=status_code,
+                             headers=headers, media_type=media_type)
+
+@app.api_route("/3d_models/{filename}", methods=["GET", "HEAD"])
+async def serve_model_asset(filename: str, request: Request, v: Optional[str] = None):
+    path = os.path.join(MODEL_DIR, os.path.basename(filename))
+    if not filename.endswith(".glb") or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    etag = await asyncio.to_thread(cached_file_etag, path)
+    cache_control = ASSET_IMMUTABLE_CACHE if v == etag else ASSET_REVALIDATE_CACHE
+    return send_file(request, path, etag, "model/gltf-binary", cache_control)
+
+def asset_lod_urls(assets: Dict[str, Any], base_url: str) -> List[Dict[str, Any]]:
+    """item_details에 넣을 LOD 목록 (작은 것부터, 캐시 가능한 ?v= URL 포함)"""
+    return [
+        {
+            "level": lod["level"],
+            "simplify_ratio": lod["simplify_ratio"],
+            "url": f"{base_url}/3d_models/{lod['file']}?v={lod['etag']}",
+            "bytes": lod["bytes"],
+            "encoded_bytes": lod["encoded_bytes"],
+        }
+        for lod in sorted(assets.get("lods", []), key=lambda lod: lod["bytes"])
+    ]
+
+# ==========================================
+# [Perf] Content-Addressed Blob Store (/upload, /blobs)
+# ==========================================
+# 방 사진을 한 번만 업로드하고 받은 image_handle(SHA-256)을 모든 엔드포인트에서 재사용합니다.
+# 결과 이미지/마스크도 Blob으로 저장하여 Base64 대신 URL로 반환합니다. (response_format=base64로 기존 방식 사용 가능)
+# 디스크 사용량이 BLOB_STORE_MAX_BYTES를 넘으면 가장 오래 사용되지 않은 Blob부터 삭제합니다.
+BLOB_DIR = "/content/blobs"
+BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+BLOB_HANDLE_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def detect_image_mime(data: bytes) -> str:
+    """매직 바이트로 이미지 MIME 타입을 판별합니다."""
+    if data[:3] == b"\xff\xd8\xff": return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n": return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP": return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"): return "image/gif"
+    if data[:2] == b"BM": return "image/bmp"
+    return "application/octet-stream"
+
+class BlobStore:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # handle -> size (오래된 것부터)
+        self._bytes = 0
+        self.evictions = 0
+        paths = [os.path.join(root, name) for name in os.listdir(root) if BLOB_HANDLE_RE.match(name)]
+        for path in sorted(paths, key=os.path.getmtime):
+            size = os.path.getsize(path)
+            self._entries[os.path.basename(path)] = size
+            self._bytes += size
+
+    def path(self, handle: str) -> str:
+        if not BLOB_HANDLE_RE.match(handle or ""):
+            raise HTTPException(status_code=400, detail="Invalid image_handle")
+        return os.path.join(self.root, handle)
+
+    def put(self, data: bytes) -> str:
+        handle = hashlib.sha256(data).hexdigest()
+        path = self.path(handle)
+        with self._lock:
+            if handle in self._entries:
+                self._entries.move_to_end(handle)
+                os.utime(path)
+                return handle
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f: f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if handle not in self._entries:
+                self._entries[handle] = len(data)
+                self._bytes += len(data)
+            self._evict()
+        return handle
+
+    def touch(self, handle: str) -> Optional[str]:
+        """존재하면 LRU 순서를 갱신하고 파일 경로를 반환합니다."""
+        path = self.path(handle)
+        with self._lock:
+            if handle not in self._entries: return None
+            self._entries.move_to_end(handle)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, handle: str) -> Optional[bytes]:
+        path = self.touch(handle)
+        if path is None: return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            handle, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.root, handle))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"blobs": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+blob_store = BlobStore(BLOB_DIR, BLOB_STORE_MAX_BYTES)
+
+@app.api_route("/blobs/{handle}", methods=["GET", "HEAD"])
+async def serve_blob(handle: str, request: Request):
+    path = blob_store.touch(handle)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Blob not found (expired or never uploaded)")
+    with open(path, "rb") as f:
+        head = f.read(16)
+    # 내용 주소 기반이므로 항상 immutable
+    return send_file(request, path, handle, detect_image_mime(head), ASSET_IMMUTABLE_CACHE)
+
+async def read_image_input(file: Optional[UploadFile], image_handle: Optional[str]) -> bytes:
+    """업로드 파일 또는 /upload로 받은 image_handle 중 하나로 이미지 바이트를 가져옵니다."""
+    if image_handle:
+        with stage("read_blob"):
+            data = await asyncio.to_thread(blob_store.get, image_handle)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Unknown image_handle. Please upload the image again.")
+        return data
+    if file is not None:
+        with stage("read_upload"):
+            return await file.read()
+    raise HTTPException(status_code=400, detail="Either an image file or image_handle is required")
+
+def check_response_format(response_format: str) -> str:
+    if response_format not in ("url", "base64"):
+        raise HTTPException(status_code=400, detail="response_format must be 'url' or 'base64'")
+    return response_format
+
+def encode_result(data: bytes, mime_type: str, response_format: str, request: Request) -> str:
+    """결과 이미지를 URL(Blob) 또는 Base64 Data URI로 변환합니다."""
+    if not data: return ""
+    if response_format == "base64":
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+    handle = blob_store.put(data)
+    return f"{str(request.base_url).rstrip('/')}/blobs/{handle}"
+
+# ==========================================
+# [Perf] Image Preprocessing Pyramid
+# ==========================================
+# 업로드 이미지 한 장을 한 번만 디코딩하고, 소비자별 해상도를 필요할 때 만들어 재사용합니다.
+#   원본(합성) / SAM_PROCESS_WIDTH(SAM, Gemini Inpaint) / SAM 인코더 입력(긴 변 1024) /
+#   FLOOR_TARGET_SIZE(BEiT) / CONSULT_IMAGE_MAX_SIDE(/consult Gemini 입력)
+# JPEG는 필요한 크기 이상인 가장 작은 1/2, 1/4, 1/8 축소 디코딩(IMREAD_REDUCED_*)을 사용하므로
+# 바닥 분석 / consult만 하는 요청은 8K 원본 해상도 디코딩을 하지 않습니다.
+# Content Hash(= Blob handle) 단위 LRU 캐시, 메모리 상한은 PYRAMID_CACHE_MAX_BYTES.
+PYRAMID_CACHE_MAX_BYTES = int(os.getenv("PYRAMID_CACHE_MAX_BYTES", 768 * 1024 * 1024))
+CONSULT_IMAGE_MAX_SIDE = int(os.getenv("CONSULT_IMAGE_MAX_SIDE", 1536))  # /consult 이미지 긴 변 (px)
+GEMINI_IMAGE_MIMES = ("image/jpeg", "image/png", "image/webp")  # 그대로 보낼 수 있는 형식
+JPEG_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def oriented_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """헤더만 읽어서 (w, h)를 구합니다. cv2.imdecode처럼 EXIF 회전(orientation 5~8)을 반영합니다."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            w, h = img.size
+            orientation = img.getexif().get(0x0112, 1)
+    except Exception:
+        return None
+    return (h, w) if orientation in (5, 6, 7, 8) else (w, h)
+
+class ImagePyramid:
+    """
+    이미지 한 장의 해상도별 BGR / RGB 결과. 반환되는 배열은 요청 사이에 공유되므로
+    수정하려면 copy()해서 사용하세요.
+    """
+    def __init__(self, data: bytes, key: Optional[str] = None, on_grow=None):
+        self.data = data
+        self.key = key or hashlib.sha256(data).hexdigest()
+        self.mime_type = detect_image_mime(data)
+        self.size = oriented_image_size(data)  # (w, h), 헤더를 못 읽으면 디코딩 후 채움
+        self.nbytes = len(data)
+        self.decodes = 0
+        self._levels = {}  # (w, h) -> BGR
+        self._rgb = {}     # (w, h) -> RGB
+        self._consult = None
+        self._lock = threading.RLock()
+        self._on_grow = on_grow
+
+    def _grow(self, nbytes: int):
+        self.nbytes += nbytes
+        if self._on_grow: self._on_grow(self, nbytes)
+
+    def _decode(self, size: Optional[Tuple[int, int]]) -> np.ndarray:
+        """size 이상인 가장 작은 JPEG 축소 디코딩 (size가 None이거나 JPEG가 아니면 원본 디코딩)"""
+        flag = cv2.IMREAD_COLOR
+        if size and self.size and self.mime_type == "image/jpeg":
+            for factor, reduced in JPEG_REDUCED_FLAGS:
+                if -(-self.size[0] // factor) >= size[0] and -(-self.size[1] // factor) >= size[1]:
+                    flag = reduced
+                    break
+        with stage("decode"):
+            image = cv2.imdecode(np.frombuffer(self.data, np.uint8), flag)
+        if image is None: raise ValueError("Invalid image")
+        self.decodes += 1
+        if flag == cv2.IMREAD_COLOR: self.size = (image.shape[1], image.shape[0])
+        self._levels[(image.shape[1], image.shape[0])] = image  # 축소 디코딩 결과도 다음 level의 원본으로 사용
+        self._grow(image.nbytes)
+        return image
+
+    def level(self, size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """(w, h) 크기의 BGR 이미지 (None이면 원본 해상도). 이미 만든 더 큰 level이 있으면 거기서 줄입니다."""
+        with self._lock:
+            if size is None or self.size is None:
+                if self.size not in self._levels: self._decode(None)
+                if size is None: return self._levels[self.size]
+            size = tuple(size)
+            if size in self._levels: return self._levels[size]
+            larger = [s for s in self._levels if s[0] >= size[0] and s[1] >= size[1]]
+            source = self._levels[min(larger)] if larger else self._decode(size)
+            if (source.shape[1], source.shape[0]) == size: return source
+            with stage("resize"):
+                image = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+            self._levels[size] = image
+            self._grow(image.nbytes)
+            return image
+
+    def rgb(self, size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        with self._lock:
+            bgr = self.level(size)
+            size = (bgr.shape[1], bgr.shape[0])
+            if size not in self._rgb:
+                self._rgb[size] = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+                self._grow(bgr.nbytes)
+            return self._rgb[size]
+
+    def original_size(self) -> Tuple[int, int]:
+        with self._lock:
+            if self.size is None: self._decode(None)
+            return self.size
+
+    def width_size(self, width: int) -> Tuple[int, int]:
+        """너비가 width보다 크면 width로 줄인 크기 (SAM_PROCESS_WIDTH, segment_object와 같은 반올림)"""
+        w, h = self.original_size()
+        if w <= width: return (w, h)
+        return (width, int(h * width / w))
+
+    def long_side_size(self, side: int) -> Tuple[int, int]:
+        """긴 변을 side로 맞춘 크기 (FLOOR_TARGET_SIZE, detect_floor_mask_png와 같은 반올림)"""
+        w, h = self.original_size()
+        scale = side / max(w, h)
+        return (int(w * scale), int(h * scale))
+
+    def consult_image(self) -> Tuple[bytes, str]:
+        """/consult용 (bytes, MIME). 작고 Gemini가 읽을 수 있는 형식이면 원본 그대로, 아니면 JPEG로 줄여서 보냅니다."""
+        with self._lock:
+            if self._consult is None:
+                w, h = self.original_size()
+                if max(w, h) <= CONSULT_IMAGE_MAX_SIDE and self.mime_type in GEMINI_IMAGE_MIMES:
+                    self._consult = (self.data, self.mime_type)
+                else:
+                    image = self.level(self.long_side_size(min(CONSULT_IMAGE_MAX_SIDE, max(w, h))))
+                    with stage("consult_jpeg"):
+                        jpeg = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), 90])[1].tobytes()
+                    self._consult = (jpeg, "image/jpeg")
+            return self._consult
+
+class ImagePyramidCache:
+    """Content Hash -> ImagePyramid LRU. level이 추가될 때마다 메모리 사용량을 갱신합니다."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> ImagePyramid
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[ImagePyramid]:
+        with self._lock:
+            pyramid = self._entries.get(key)
+            if pyramid is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return pyramid
+
+    def put(self, data: bytes, key: Optional[str] = None) -> ImagePyramid:
+        key = key or hashlib.sha256(data).hexdigest()
+        with self._lock:
+            pyramid = self._entries.get(key)
+            if pyramid is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return pyramid
+            self.misses += 1
+            pyramid = self._entries[key] = ImagePyramid(data, key, on_grow=self._grow)
+            self._bytes += pyramid.nbytes
+            self._evict()
+            return pyramid
+
+    def _grow(self, pyramid: ImagePyramid, nbytes: int):
+        with self._lock:
+            if self._entries.get(pyramid.key) is not pyramid: return  # 이미 제거된 항목
+            self._bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, pyramid = self._entries.popitem(last=False)
+            self._bytes -= pyramid.nbytes
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+image_pyramids = ImagePyramidCache(PYRAMID_CACHE_MAX_BYTES)
+
+async def load_image(file: Optional[UploadFile], image_handle: Optional[str]) -> ImagePyramid:
+    """read_image_input과 같지만 ImagePyramid를 반환합니다. (같은 image_handle이면 Blob도 다시 읽지 않음)"""
+    if image_handle:
+        blob_store.path(image_handle)  # handle 형식 검사
+        pyramid = image_pyramids.get(image_handle)
+        if pyramid is not None and blob_store.touch(image_handle): return pyramid
+        return image_pyramids.put(await read_image_input(None, image_handle), image_handle)
+    data = await read_image_input(file, None)
+    with stage("content_hash"):
+        return await asyncio.to_thread(image_pyramids.put, data)
+
+# ==========================================
+# [Perf] Inference Executor
+# ==========================================
+# SAM / BEiT / Gemini 작업을 이벤트 루프 밖의 전용 스레드 풀에서 실행합니다.
+# 느린 Inpainting 요청이 있어도 헬스체크(/)와 GLB 다운로드(/3d_models)는 막히지 않습니다.
+# 모델별 동시 실행 수(workers) + 대기열(queue)이 가득 차면 503을 반환합니다.
+INFERENCE_CONFIG = {
+    # name: (workers, queue, timeout_s)
+    # SAM: worker마다 SamPredictorPool에서 predictor를 하나씩 빌리므로 동시 요청의 이미지 상태가 섞이지 않습니다.
+    # BEiT는 SegBatcher가 GPU 접근을 직렬화하므로 배치 크기만큼 worker를 둡니다.
+    "sam":    (SAM_WORKERS,    int(os.getenv("SAM_QUEUE", 4)),    float(os.getenv("SAM_TIMEOUT", 120))),
+    "beit":   (int(os.getenv("BEIT_WORKERS", BEIT_MAX_BATCH)),   int(os.getenv("BEIT_QUEUE", 8)),   float(os.getenv("BEIT_TIMEOUT", 60))),
+    # retrieval: 임베딩 검색 (Gemini 생성 호출은 아래 GEMINI 게이트웨이가 담당)
+    "retrieval": (int(os.getenv("RETRIEVAL_WORKERS", 4)), int(os.getenv("RETRIEVAL_QUEUE", 16)), float(os.getenv("RETRIEVAL_TIMEOUT", 60))),
+}
+
+class InferenceExecutor:
+    """
+    모델 하나를 위한 제한된(bounded) 스레드 풀.
+    - workers: 동시에 실행되는 작업 수 (GPU 모델은 보통 1)
+    - queue: 실행 대기 가능한 작업 수 (초과 시 503 + Retry-After)
+    - timeout_s: 요청별 대기 시간 한도 (초과 시 504)
+    """
+    def __init__(self, name: str, workers: int, queue: int, timeout_s: float):
+        self.name = name
+        self.workers = workers
+        self.queue = queue
+        self.timeout_s = timeout_s
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"infer-{name}")
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _release(self, _future):
+        with self._lock:
+            self._inflight -= 1
+
+    async def run(self, fn, *args, timeout_s: Optional[float] = None, **kwargs):
+        with self._lock:
+            if self._inflight >= self.workers + self.queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"{self.name} inference queue is full. Please retry later.",
+                    headers={"Retry-After": "5"},
+                )
+            self._inflight += 1
+
+        # 실행 중인 작업은 타임아웃 후에도 끝날 때까지 worker 슬롯을 점유하므로
+        # 동시 실행 수 제한이 깨지지 않습니다. (대기 중이던 작업은 취소됨)
+        # 요청 contextvars(stage 타이머)를 worker 스레드로 전달
+        future = self._pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout_s or self.timeout_s)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HTTPException(status_code=504, detail=f"{self.name} inference timed out")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue": self.queue,
+                "inflight": self._inflight,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+INFERENCE = {name: InferenceExecutor(name, *cfg) for name, cfg in INFERENCE_CONFIG.items()}
+
+STARTUP = {"sam_model_type": SAM_MODEL_TYPE, "backend": INFERENCE_BACKEND, "device": device, "app_ready_s": None}
+_warmup_tasks = []
+
+async def warm_up_model(name: str):
+    # 같은 Executor에서 실행하므로 warm-up이 요청 처리 중인 predictor 상태와 겹치지 않습니다.
+    try:
+        await INFERENCE[name].run(MODELS.warm_up, name, timeout_s=MODEL_WARMUP_TIMEOUT)
+    except Exception as e:
+        print(f"⚠️ Model '{name}' warm-up failed: {getattr(e, 'detail', e)}")
+
+@app.on_event("startup")
+async def start_model_warmup():
+    STARTUP["app_ready_s"] = round(time.perf_counter() - CELL_STARTED, 2)
+    print(f"🚀 Accepting requests {STARTUP['app_ready_s']}s after cell3 start (models: {'warming up' if MODEL_WARMUP else 'lazy'})")
+    if MODEL_WARMUP:
+        _warmup_tasks.extend(asyncio.create_task(warm_up_model(name)) for name in ("beit", "sam"))
+
+# ==========================================
+# [Perf] Gemini Gateway
+# ==========================================
+# 모든 엔드포인트의 Gemini 생성 / 질의 임베딩 호출이 공유하는 비동기 게이트웨이 (client.aio 사용, 스레드 점유 없음).
+# - Token Bucket: 초당 요청 수 제한. 429를 받으면 버킷 전체를 멈춰서 다른 요청도 함께 물러납니다.
+# - Concurrency Cap + 대기열: 동시 호출 수 제한, 대기열이 가득 차면 503
+# - Exponential Backoff + Jitter: 429 / 5xx / 타임아웃 / 네트워크 오류만 재시도
+# - Circuit Breaker: 연속 실패 시 cooldown 동안 즉시 503 (소진된 할당량에 요청을 쌓지 않음)
+# - Dedup: 같은 요청(모델 + 입력 + 설정)이 진행 중이면 결과를 공유
+GEMINI_CONFIG = dict(
+    rate_per_s=float(os.getenv("GEMINI_RATE", 2.0)),
+    burst=int(os.getenv("GEMINI_BURST", 4)),
+    max_concurrency=int(os.getenv("GEMINI_CONCURRENCY", 4)),
+    max_queue=int(os.getenv("GEMINI_QUEUE", 16)),
+    max_retries=int(os.getenv("GEMINI_MAX_RETRIES", 4)),
+    backoff_base_s=float(os.getenv("GEMINI_BACKOFF_BASE", 2.0)),
+    backoff_max_s=float(os.getenv("GEMINI_BACKOFF_MAX", 40.0)),
+    breaker_threshold=int(os.getenv("GEMINI_BREAKER_THRESHOLD", 5)),
+    breaker_cooldown_s=float(os.getenv("GEMINI_BREAKER_COOLDOWN", 30.0)),
+    timeout_s=float(os.getenv("GEMINI_TIMEOUT", 120)),
+)
+GEMINI_RETRYABLE = {None, 429, 500, 502, 503, 504}  # None = 네트워크 오류 등 상태 코드 없음
+
+def gemini_error_status(e: Exception) -> Optional[int]:
+    """google.genai APIError의 HTTP 상태 코드. 타임아웃은 504, 알 수 없으면 None."""
+    if isinstance(e, asyncio.TimeoutError): return 504
+    code = getattr(e, "code", None)
+    if isinstance(code, int): return code
+    if "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e): return 429
+    return None
+
+def latency_summary(samples) -> Dict[str, Any]:
+    if not samples: return {"p50": None, "p95": None, "count": 0}
+    p50, p95 = np.percentile(np.asarray(samples) * 1000, [50, 95])
+    return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "count": len(samples)}
+
+class TokenBucket:
+    """asyncio용 Token Bucket. 대기자는 Lock 순서(FIFO)대로 토큰을 받습니다."""
+    def __init__(self, rate_per_s: float, burst: int):
+        self.rate = rate_per_s
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """seconds 동안 토큰 지급을 멈추고 버킷을 비웁니다. (429 응답 시)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+class GeminiGateway:
+    """
+    client.aio.models.generate_content / embed_content를 감싸는 공유 게이트웨이.
+    실패는 HTTPException으로 변환됩니다: 429(할당량), 503(대기열 초과 / Circuit Open), 504(타임아웃), 502(기타)
+    """
+    def __init__(self, client, rate_per_s: float, burst: int, max_concurrency: int, max_queue: int,
+                 max_retries: int, backoff_base_s: float, backoff_max_s: float,
+                 breaker_threshold: int, breaker_cooldown_s: float, timeout_s: float):
+        self.client = client
+        self.bucket = TokenBucket(rate_per_s, burst)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown_s = breaker_cooldown_s
+        self.timeout_s = timeout_s
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._waiting = 0
+        self._active = 0
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_task: Optional[asyncio.Task] = None  # Half-open 상태에서 통과시킨 호출
+        self._latency = deque(maxlen=500)   # 게이트웨이 전체 (대기 + 재시도 포함)
+        self._upstream = deque(maxlen=500)  # 성공한 Gemini 호출 1회
+        self.counters = {"requests": 0, "dedup_hits": 0, "attempts": 0, "retries": 0, "throttled": 0,
+                         "failures": 0, "rejected": 0, "short_circuited": 0, "breaker_trips": 0}
+
+    @staticmethod
+    def request_key(model: str, contents, config) -> str:
+        h = hashlib.sha1(model.encode())
+        for part in contents:
+            if isinstance(part, str):
+                h.update(part.encode("utf-8"))
+            elif getattr(part, "inline_data", None) is not None:
+                h.update(part.inline_data.data)
+            else:
+                h.update(repr(part).encode("utf-8"))
+        if config is not None:
+            h.update((config.model_dump_json() if hasattr(config, "model_dump_json") else repr(config)).encode("utf-8"))
+        return h.hexdigest()
+
+    async def generate_content(self, model: str, contents, config=None):
+        return await self._dedup(
+            self.request_key(model, contents, config),
+            lambda: self.client.aio.models.generate_content(model=model, contents=contents, config=config),
+        )
+
+    async def embed_content(self, model: str, contents, config=None):
+        """임베딩 호출도 생성 호출과 같은 Rate Limit / 대기열 / 재시도 / Circuit Breaker를 거칩니다."""
+        return await self._dedup(
+            self.request_key(f"embed:{model}", contents, config),
+            lambda: self.client.aio.models.embed_content(model=model, contents=contents, config=config),
+        )
+
+    async def _dedup(self, key: str, request):
+        self.counters["requests"] += 1
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call(request))
+            self._pending[key] = task
+            task.add_done_callback(lambda _t: self._pending.pop(key, None))
+        else:
+            self.counters["dedup_hits"] += 1
+        # 한 요청자가 취소되어도 같은 결과를 기다리는 다른 요청자에게는 영향 없음
+        return await asyncio.shield(task)
+
+    def _check_breaker(self):
+        """
+        Circuit이 열려 있으면 503. cooldown이 지나면 한 호출(task)만 프로브로 통과시킵니다. (Half-open)
+        프로브 호출의 다음 시도는 다시 막지 않고, 프로브가 실패하면 _record_failure가 Circuit을 다시 엽니다.
+        """
+        if self._opened_at is None: return
+        task = asyncio.current_task()
+        if self._probe_task is not None and self._probe_task is task: return
+        remaining = self._opened_at + self.breaker_cooldown_s - time.monotonic()
+        if remaining > 0 or self._probe_task is not None:
+            self.counters["short_circuited"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Gemini is temporarily unavailable (circuit open). Please retry later.",
+                headers={"Retry-After": str(max(1, int(remaining)))},
+            )
+        self._probe_task = task
+
+    def _record_success(self, elapsed: float):
+        self._upstream.append(elapsed)
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_task = None
+
+    def _record_failure(self):
+        self.counters["failures"] += 1
+        self._consecutive_failures += 1
+        if self._probe_task is not None or (self._opened_at is None and self._consecutive_failures >= self.breaker_threshold):
+            self.counters["breaker_trips"] += 1
+            print(f"⚠️ Gemini circuit open for {self.breaker_cooldown_s:.0f}s ({self._consecutive_failures} consecutive failures)")
+            self._opened_at = time.monotonic()
+            self._probe_task = None
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential Backoff + Equal Jitter: [cap/2, cap]"""
+        cap = min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt))
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    @asynccontextmanager
+    async def _slot(self):
+        """
+        Circuit 확인 -> 대기열 -> 동시 호출 슬롯. 호출 시작 시각(대기 포함)을 반환합니다.
+        이 호출이 프로브였다면 결과를 기록하지 못하고 끝나도(취소, 대기열 초과, 502) 프로브 자리를 비웁니다.
+        """
+        task = asyncio.current_task()
+        self._check_breaker()
+        try:
+            if self._waiting >= self.max_queue:
+                self.counters["rejected"] += 1
+                raise HTTPException(status_code=503, detail="Gemini queue is full. Please retry later.",
+                                    headers={"Retry-After": "5"})
+            started = time.monotonic()
+            self._waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            try:
+                yield started
+            finally:
+                self._active -= 1
+                self._semaphore.release()
+        finally:
+            if self._probe_task is not None and self._probe_task is task:
+                self._probe_task = None
+
+    async def _start_attempt(self):
+        self._check_breaker()
+        await self.bucket.acquire()
+        self.counters["attempts"] += 1
+
+    async def _retry_or_raise(self, e: Exception, attempt: int):
+        """재시도할 수 있는 실패면 Backoff만큼 기다리고, 아니면 HTTPException을 던집니다."""
+        status = gemini_error_status(e)
+        if status not in GEMINI_RETRYABLE:
+            raise HTTPException(status_code=502, detail=f"Gemini request failed: {e}")
+        self._record_failure()
+        if status == 429: self.counters["throttled"] += 1
+        if attempt == self.max_retries:
+            raise HTTPException(
+                status_code=status if status in (429, 504) else 502,
+                detail=f"Gemini request failed after {attempt + 1} attempts: {e}",
+                headers={"Retry-After": str(int(self.backoff_max_s))} if status == 429 else None,
+            )
+        delay = self._backoff(attempt)
+        if status == 429:
+            self.bucket.pause(delay)  # 할당량 소진: 모든 요청이 함께 대기
+        print(f"⏳ Gemini attempt {attempt + 1} failed ({status or type(e).__name__}). Retrying in {delay:.1f}s")
+        self.counters["retries"] += 1
+        await asyncio.sleep(delay)
+
+    async def _call(self, request):
+        """request: 호출할 때마다 새 awaitable을 만드는 함수 (재시도마다 다시 호출)"""
+        async with self._slot() as started:
+            for attempt in range(self.max_retries + 1):
+                await self._start_attempt()
+                t0 = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(request(), self.timeout_s)
+                except Exception as e:
+                    await self._retry_or_raise(e, attempt)
+                    continue
+                self._record_success(time.monotonic() - t0)
+                self._latency.append(time.monotonic() - started)
+                return response
+
+    async def generate_content_stream(self, model: str, contents, config=None):
+        """
+        스트리밍 호출: chunk.text를 받는 대로 yield합니다. (Dedup 없음)
+        첫 chunk를 받기 전의 실패만 재시도하고, 이미 일부를 보낸 뒤의 실패는 그대로 HTTPException으로 던집니다.
+        timeout_s는 chunk 사이 간격에 적용됩니다.
+        """
+        self.counters["requests"] += 1
+        async with self._slot() as started:
+            for attempt in range(self.max_retries + 1):
+                await self._start_attempt()
+                t0, received = time.monotonic(), False
+                try:
+                    stream = await asyncio.wait_for(
+                        self.client.aio.models.generate_content_stream(model=model, contents=contents, config=config),
+                        self.timeout_s,
+                    )
+                    chunks = stream.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout_s)
+                        except StopAsyncIteration:
+                            break
+                        received = True
+                        if chunk.text: yield chunk.text
+                except Exception as e:
+                    if received:
+                        self._record_failure()
+                        raise HTTPException(status_code=502, detail=f"Gemini stream interrupted: {e}")
+                    await self._retry_or_raise(e, attempt)
+                    continue
+                self._record_success(time.monotonic() - t0)
+                self._latency.append(time.monotonic() - started)
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        if self._opened_at is None: breaker = "closed"
+        elif self._probe_task is not None or time.monotonic() >= self._opened_at + self.breaker_cooldown_s: breaker = "half-open"
+        else: breaker = "open"
+        return {
+            **self.counters,
+            "rate_per_s": self.bucket.rate,
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "queue_depth": self._waiting,
+            "breaker": breaker,
+            "latency_ms": latency_summary(self._latency),
+            "upstream_ms": latency_summary(self._upstream),
+        }
+
+GEMINI = GeminiGateway(client, **GEMINI_CONFIG)
+
+# DB Load (cell2.py에서 준비한 SQLite 카탈로그, 3D 모델이 있는 아이템만 추천 대상)
+CATALOG = FurnitureCatalog(CATALOG_PATH)
+
+# ==========================================
+# [Perf] Furniture Retrieval Index
+# ==========================================
+# 카탈로그 전체를 프롬프트에 넣는 대신, user_prompt와 가까운 Top-K 후보만 Gemini에 보냅니다.
+# 임베딩 행렬은 .npy (mmap) + id 테이블(.json)로 저장되고, 새 아이템만 추가 임베딩합니다.
+FURNITURE_INDEX_PATH = "furniture_index.npy"
+FURNITURE_INDEX_META_PATH = "furniture_index_ids.json"
+CONSULT_TOP_K = int(os.getenv("CONSULT_TOP_K", 40))  # 카탈로그가 이보다 작으면 전체 목록 사용
+
+def item_search_text(item: Dict[str, Any]) -> str:
+    return (
+        f"{item.get('name', '')}. "
+        f"Category: {item.get('category', '')}. "
+        f"Keywords: {item.get('keywords', '')}. "
+        f"Style: {item.get('style_tags', [])}"
+    )
+
+class GeminiTextEmbedder:
+    """
+    Gemini 임베딩 (다국어 지원: 한국어 요청 ↔ 영어 카탈로그 매칭 가능)
+    - embed: 카탈로그 인덱스 동기화용 동기 호출. cell 실행 시(서버 시작 전) 한 번만 실행되므로 게이트웨이를 거치지 않습니다.
+    - embed_query: /consult 요청 경로. GEMINI 게이트웨이를 거쳐 Rate Limit / 재시도 / Circuit Breaker를 공유합니다.
+    """
+    name = "gemini/text-embedding-004"
+    model = "text-embedding-004"
+    batch_size = 100
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        result = await GEMINI.embed_content(
+            model=self.model, contents=[query],
+            config=types.EmbedContentConfig(task_type="RETRIEVAL_QUERY"),
+        )
+        return np.asarray(result.embeddings[0].values, dtype=np.float32)
+
+    def embed(self, texts: List[str], is_query: bool = False) -> np.ndarray:
+        vectors = []
+        task_type = "RETRIEVAL_QUERY" if is_query else "RETRIEVAL_DOCUMENT"
+        for i in range(0, len(texts), self.batch_size):
+            result = client.models.embed_content(
+                model=self.model,
+                contents=texts[i:i + self.batch_size],
+                config=types.EmbedContentConfig(task_type=task_type),
+            )
+            vectors.extend(e.values for e in result.embeddings)
+        return np.asarray(vectors, dtype=np.float32)
+
+class HashingTextEmbedder:
+    """오프라인 폴백: 문자 3-gram 해싱 벡터 (API 호출 없음)"""
+    name = "hashing-3gram-512"
+    dim = 512
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        return self.embed([query], is_query=True)[0]
+
+    def embed(self, texts: List[str], is_query: bool = False) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = f"  {text.lower()}  "
+            for i in range(len(text) - 2):
+                digest = hashlib.md5(text[i:i + 3].encode("utf-8")).digest()
+                matrix[row, int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        return matrix
+
+class FurnitureIndex:
+    """
+    카탈로그 벡터 인덱스.
+    - matrix: (N, D) float32, L2 정규화, np.load(mmap_mode="r")로 열어 메모리에 통째로 올리지 않음
+    - meta: {"embedder": ..., "catalog_seq": ..., "ids": [...], "text_hashes": [...]}
+    """
+    def __init__(self, embedder, index_path: str = FURNITURE_INDEX_PATH, meta_path: str = FURNITURE_INDEX_META_PATH):
+        self.embedder = embedder
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self.matrix = None
+        self.ids = []
+        self.text_hashes = []
+        self.catalog_seq = 0
+        self._load()
+
+    def _load(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.meta_path)): return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("embedder") != self.embedder.name:
+            print(f"⚠️ Index embedder changed ({meta.get('embedder')} -> {self.embedder.name}). Rebuilding.")
+            return
+        self.matrix = np.load(self.index_path, mmap_mode="r")
+        self.ids = meta["ids"]
+        self.text_hashes = meta["text_hashes"]
+        self.catalog_seq = meta.get("catalog_seq", 0)
+
+    def sync(self, catalog: "FurnitureCatalog"):
+        """
+        마지막 동기화 이후(catalog seq 기준) 변경된 아이템만 다시 임베딩합니다.
+        3D 모델(glb_url)이 없어진 아이템은 인덱스에서 제거됩니다.
+        """
+        version = catalog.version
+        upserts, dropped = {}, set()
+        for item in catalog.find(min_seq=self.catalog_seq):
+            dropped.add(item["id"])
+            if item.get("glb_url"):
+                text = item_search_text(item)
+                upserts[item["id"]] = (text, hashlib.sha1(text.encode("utf-8")).hexdigest())
+
+        keep_rows, ids, hashes = [], [], []
+        for row, (item_id, text_hash) in enumerate(zip(self.ids, self.text_hashes)):
+            if item_id in dropped and (item_id not in upserts or upserts[item_id][1] != text_hash): continue
+            keep_rows.append(row)
+            ids.append(item_id)
+            hashes.append(text_hash)
+
+        kept = set(ids)
+        new_ids = [item_id for item_id in upserts if item_id not in kept]
+        if not new_ids and len(ids) == len(self.ids) and self.matrix is not None:
+            self._write_meta(ids, hashes, version)
+            print(f"✅ Furniture index up to date ({len(ids)} items, catalog v{version})")
+            return
+
+        t0 = time.perf_counter()
+        new_vectors = self._normalize(self.embedder.embed([upserts[i][0] for i in new_ids])) if new_ids else None
+        parts = []
+        if keep_rows: parts.append(np.asarray(self.matrix[keep_rows]))
+        if new_vectors is not None: parts.append(new_vectors)
+        matrix = np.concatenate(parts) if parts else np.zeros((0, 1), dtype=np.float32)
+
+        # 임시 파일에 쓰고 교체 (읽는 중인 mmap을 깨뜨리지 않음)
+        tmp_path = self.index_path + ".tmp.npy"
+        np.save(tmp_path, matrix)
+        os.replace(tmp_path, self.index_path)
+        self._write_meta(ids + new_ids, hashes + [upserts[i][1] for i in new_ids], version)
+        self._load()
+        print(f"✅ Furniture index synced: +{len(new_ids)} embedded, {len(self.ids)} total ({time.perf_counter() - t0:.2f}s)")
+
+    def _write_meta(self, ids: List[str], text_hashes: List[str], catalog_seq: int):
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder.name, "catalog_seq": catalog_seq,
+                       "ids": ids, "text_hashes": text_hashes}, f)
+        self.catalog_seq = catalog_seq
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def search(self, query: str, k: int) -> List[str]:
+        if self.matrix is None or not self.ids: return []
+        return self.search_vector(self.embedder.embed([query], is_query=True)[0], k)
+
+    def search_vector(self, query_vec: np.ndarray, k: int) -> List[str]:
+        if self.matrix is None or not self.ids: return []
+        query_vec = self._normalize(query_vec[None, :])[0]
+        scores = np.asarray(self.matrix) @ query_vec
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.ids[i] for i in top]
+
+try:
+    furniture_index = FurnitureIndex(GeminiTextEmbedder())
+    furniture_index.sync(CATALOG)
+except Exception as e:
+    print(f"⚠️ Gemini embedding unavailable ({e}). Using offline hashing index.")
+    furniture_index = FurnitureIndex(HashingTextEmbedder())
+    furniture_index.sync(CATALOG)
+
+async def embed_consult_query(user_prompt: str, k: int = CONSULT_TOP_K) -> Optional[np.ndarray]:
+    """retrieve_candidates에 넘길 질의 벡터. 전체 목록을 쓰는 경우나 임베딩 실패 시 None (FTS 폴백)."""
+    if len(furniture_index.ids) <= k: return None
+    try:
+        return await furniture_index.embedder.embed_query(user_prompt)
+    except Exception as e:
+        print(f"⚠️ Query embedding failed, using FTS: {getattr(e, 'detail', e)}")
+        return None
+
+def retrieve_candidates(user_prompt: str, query_vec: Optional[np.ndarray] = None, k: int = CONSULT_TOP_K) -> List[Dict[str, Any]]:
+    """user_prompt와 가까운 Top-K 아이템. 추천 대상이 K개 이하면 전체 목록."""
+    if len(furniture_index.ids) <= k: return list(CATALOG.find(has_glb=True))
+    try:
+        top_ids = furniture_index.search_vector(query_vec, k) if query_vec is not None else []
+    except Exception as e:
+        print(f"⚠️ Vector retrieval failed, using FTS: {e}")
+        top_ids = []
+    if top_ids: return CATALOG.get_many(top_ids)
+    return CATALOG.search(user_prompt, k) or list(CATALOG.find(has_glb=True, limit=k))
+
+def build_consult_prompt(user_prompt: str, items: List[Dict[str, Any]]) -> str:
+    inventory_text = "\n".join([
+        f"- ID: {item['id']}, Name: {item['name']}, Style: {item.get('style_tags', [])}, Has3D: {'Yes' if item.get('glb_url') else 'No'}"
+        for item in items
+    ])
+
+    return f"""
+    You are an expert interior design curator using the Amazon Berkeley Objects dataset.
+    Analyze the user's room image and their request ("{user_prompt}").
+    Then, SELECT THE TOP 5 BEST ITEMS from the [Inventory List] below.
+    
+    [Inventory List]
+    {inventory_text}
+    
+    [Output Format]
+    Return ONLY a JSON Array of objects. No markdown.
+    [
+        {{
+            "selected_id": "Item ID",
+            "reason": "Reason in Korean",
+            "position_suggestion": "Placement suggestion"
+        }}
+    ]
+    """
+
+# Pydantic Models
+class FloorPoint(BaseModel): x: int; y: int
+class FloorMask(BaseModel): width: int; height: int; polygons: Optional[List[List[List[float]]]] = None; rle: Optional[Dict[str, Any]] = None
+class RemoveObjectResponse(BaseModel): status: str; image: str; mask_image: str; image_handle: Optional[str] = None; object_masks: List[str] = []; floor_mask: Optional[FloorMask] = None
+class UploadResponse(BaseModel): status: str; image_handle: str; url: str; size: int; mime_type: str
+class AnalyzeImageResponse(BaseModel): status: str; mask_image: str; floor_mask: Optional[FloorMask] = None
+class ConsultItem(BaseModel): selected_id: str; reason: str; position_suggestion: str; item_details: Optional[Dict[str, Any]] = None
+
+# ==========================================
+# [Perf] Panorama Cubemap Tiling
+# ==========================================
+# 2:1 equirectangular 파노라마를 통째로 줄여 넣으면 SAM(1024px) / BEiT(640px) 입력에서 1도당 픽셀이 크게 줄어듭니다.
+# panorama_mode="cubemap"이면 미리 계산한 remap 테이블로 90° 원근(gnomonic) 면을 잘라 모델에 넣고,
+# 결과 마스크 / 바닥 점수 맵을 다시 equirect로 투영합니다.
+#   SAM:  클릭한 방향의 면만 SAM_FACE_SIZE로 (방향은 PANORAMA_VIEW_STEP_DEG 단위로 반올림해서 remap 테이블 / 임베딩 재사용)
+#   바닥: 옆면 4개 + 바닥면 (천장 면은 바닥일 수 없으므로 생략), SegBatcher가 한 배치로 실행
+# 2:1이 아닌 이미지는 기존 전체 프레임 경로를 사용합니다. (bench/panorama.py에서 지연 / 메모리 / IoU 비교)
+PANORAMA_MODE = os.getenv("PANORAMA_MODE", "off")
+PANORAMA_MODES = ("off", "cubemap")
+PANORAMA_ASPECT_TOLERANCE = 0.02  # w / h가 2에서 이 비율 이내면 equirect로 간주
+PANORAMA_FACE_FOV = 90.0          # 면 하나의 화각 (도)
+PANORAMA_VIEW_STEP_DEG = 15       # SAM 면 방향(yaw, pitch) 반올림 단위
+PANORAMA_PROMPT_MARGIN = 0.9      # 프롬프트가 면 가장자리 10% 안쪽에 있어야 그 면에서 분할 (아니면 전체 프레임)
+PANORAMA_MAP_CACHE_SIZE = int(os.getenv("PANORAMA_MAP_CACHE_SIZE", 16))  # remap 테이블 LRU 개수 (1024px 면 ≈ 6MB)
+PANORAMA_UNCOVERED_SCORE = -1.0   # 어떤 면에도 없는 픽셀(천장)의 바닥 점수
+SAM_FACE_SIZE = int(os.getenv("SAM_FACE_SIZE", 1024))  # SAM 인코더 입력 크기 = 면 크기
+FLOOR_FACE_SIZE = 640  # BEiT 입력 크기 (microsoft/beit-base-finetuned-ade-640-640)
+FLOOR_CUBE_VIEWS = ((0, 0), (90, 0), (180, 0), (270, 0), (0, -90))  # (yaw, pitch): 정면 / 오른쪽 / 뒤 / 왼쪽 / 바닥
+
+def check_panorama_mode(panorama_mode: str) -> str:
+    if panorama_mode not in PANORAMA_MODES:
+        raise HTTPException(status_code=400, detail="panorama_mode must be 'off' or 'cubemap'")
+    return panorama_mode
+
+def is_equirect(size: Tuple[int, int]) -> bool:
+    w, h = size
+    return abs(w / h - 2) <= 2 * PANORAMA_ASPECT_TOLERANCE
+
+def use_cubemap(panorama_mode: str, size: Tuple[int, int]) -> bool:
+    return panorama_mode == "cubemap" and is_equirect(size)
+
+def view_basis(yaw: float, pitch: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (yaw, pitch) 방향 면의 (forward, right, down) 단위 벡터.
+    좌표계: x = 경도 90°, y = 위, z = 경도 0° (equirect 가로 중앙). pitch=-90이면 면 위쪽이 정면(z) 방향입니다.
+    """
+    yaw, pitch = np.radians(yaw), np.radians(pitch)
+    forward = np.array([np.cos(pitch) * np.sin(yaw), np.sin(pitch), np.cos(pitch) * np.cos(yaw)], np.float32)
+    right = np.array([np.cos(yaw), 0, -np.sin(yaw)], np.float32)
+    return forward, right, np.cross(right, forward)
 
-# 1. SAM (Segment Anything Model) - Apache 2.0 (OSI Approved)
-sam = sam_model_registry["vit_h"](checkpoint="sam_vit_h_4b8939.pth")
-sam.to(device=device)
-predictor = SamPredictor(sam)
+def equirect_directions(points: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """equirect 픽셀 좌표 (..., 2) [x, y] -> 단위 방향 벡터 (..., 3). 픽셀 중심 기준."""
+    w, h = size
+    lon = ((points[..., 0] + 0.5) / w - 0.5) * 2 * np.pi
+    lat = (0.5 - (points[..., 1] + 0.5) / h) * np.pi
+    return np.stack([np.cos(lat) * np.sin(lon), np.sin(lat), np.cos(lat) * np.cos(lon)], axis=-1).astype(np.float32)
 
-# 2. [교체 완료] Semantic Segmentation Model
-# Model: Microsoft BEiT (Base)
-# License: MIT License (OSI Approved, Commercial Use OK)
-# Dataset: ADE20K (Contains Floor, Rug, Carpet classes)
-print("⏳ Loading Microsoft BEiT Model (MIT License)...")
-processor = BeitImageProcessor.from_pretrained("microsoft/beit-base-finetuned-ade-640-640")
-seg_model = BeitForSemanticSegmentation.from_pretrained("microsoft/beit-base-finetuned-ade-640-640")
-seg_model.to(device)
-seg_model.eval()
-print("✅ BEiT Model Loaded.")
+def directions_to_view(directions: np.ndarray, view: Tuple[int, int], face_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """방향 벡터 (..., 3) -> 면 픽셀 좌표 (..., 2)와 면 안쪽 정도 max(|a|, |b|) / tan(fov/2) (1 이하면 면 안, 뒤쪽이면 inf)"""
+    forward, right, down = view_basis(*view)
+    t = np.tan(np.radians(PANORAMA_FACE_FOV) / 2)
+    z = directions @ forward
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.where(z > 0, (directions @ right) / z / t, np.inf)
+        b = np.where(z > 0, (directions @ down) / z / t, np.inf)
+    coords = np.stack([(a + 1) * face_size / 2 - 0.5, (b + 1) * face_size / 2 - 0.5], axis=-1)
+    return coords, np.maximum(np.abs(a), np.abs(b))
 
-# App Setup
-app = FastAPI()
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
-app.mount("/3d_models", StaticFiles(directory="/content/3d_models"), name="3d_models")
+@lru_cache(maxsize=PANORAMA_MAP_CACHE_SIZE)
+def gnomonic_maps(pano_size: Tuple[int, int], view: Tuple[int, int], face_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """equirect(pano_size) -> view 방향 face_size x face_size 원근 면 remap 테이블 (fixed-point, BORDER_WRAP으로 경계 연결)"""
+    w, h = pano_size
+    forward, right, down = view_basis(*view)
+    t = np.tan(np.radians(PANORAMA_FACE_FOV) / 2)
+    grid = ((np.arange(face_size, dtype=np.float32) + 0.5) / face_size * 2 - 1) * t
+    d = forward + grid[None, :, None] * right + grid[:, None, None] * down  # (face_size, face_size, 3)
+    lon = np.arctan2(d[..., 0], d[..., 2])
+    lat = np.arctan2(d[..., 1], np.hypot(d[..., 0], d[..., 2]))
+    map_x = ((lon / (2 * np.pi) + 0.5) * w - 0.5).astype(np.float32)
+    map_y = ((0.5 - lat / np.pi) * h - 0.5).astype(np.float32)
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
 
-# DB Load
-if os.path.exists("furniture_db.json"):
-    with open("furniture_db.json", "r", encoding="utf-8") as f:
-        FURNITURE_DB = json.load(f)
-else:
-    FURNITURE_DB = []
+@lru_cache(maxsize=PANORAMA_MAP_CACHE_SIZE)
+def equirect_maps(pano_size: Tuple[int, int], view: Tuple[int, int], face_size: int):
+    """
+    view 면(face_size) -> equirect(pano_size) 역투영 remap 테이블. 면 테두리의 위도 범위(극을 포함하면 끝까지) 행만 계산합니다.
+    반환: (row0, row1, map1, map2, visible), visible = 그 행 범위에서 면 안에 들어오는 픽셀
+    """
+    w, h = pano_size
+    forward, right, down = view_basis(*view)
+    t = np.tan(np.radians(PANORAMA_FACE_FOV) / 2)
+    edge = np.linspace(-t, t, 4 * face_size, dtype=np.float32)[:, None]
+    border = np.concatenate([forward + edge * right + side * t * down for side in (-1, 1)] +
+                            [forward + side * t * right + edge * down for side in (-1, 1)])
+    lat = np.arcsin(border[:, 1] / np.linalg.norm(border, axis=1))
+    poles = directions_to_view(np.array([[0, 1, 0], [0, -1, 0]], np.float32), view, face_size)[1] <= 1
+    lat_max, lat_min = np.pi / 2 if poles[0] else lat.max(), -np.pi / 2 if poles[1] else lat.min()
+    row0, row1 = max(0, int((0.5 - lat_max / np.pi) * h) - 1), min(h, int(np.ceil((0.5 - lat_min / np.pi) * h)) + 1)
 
-# Pydantic Models
-class FloorPoint(BaseModel): x: int; y: int
-class RemoveObjectResponse(BaseModel): status: str; image: str; mask_image: str
-class AnalyzeImageResponse(BaseModel): status: str; mask_image: str
-class ConsultItem(BaseModel): selected_id: str; reason: str; position_suggestion: str; item_details: Optional[Dict[str, Any]] = None
+    # 방향 = (cos(lat) sin(lon), sin(lat), cos(lat) cos(lon))의 내적을 행 / 열 벡터의 broadcast로 계산 (H x W x 3 배열 없이)
+    lon = ((np.arange(w, dtype=np.float32) + 0.5) / w - 0.5) * np.float32(2 * np.pi)
+    lat = (0.5 - (np.arange(row0, row1, dtype=np.float32) + 0.5) / h) * np.float32(np.pi)
+    cos_lat, sin_lat, sin_lon, cos_lon = np.cos(lat)[:, None], np.sin(lat)[:, None], np.sin(lon), np.cos(lon)
+    dot = lambda v: cos_lat * (sin_lon * v[0] + cos_lon * v[2]) + sin_lat * v[1]
+    z = dot(forward)
+    visible = z > 0
+    z[~visible] = 1  # 면 뒤쪽은 투영하지 않음 (0으로 나누기 방지)
+    a, b = dot(right) / (z * t), dot(down) / (z * t)
+    visible &= (np.abs(a) <= 1) & (np.abs(b) <= 1)
+    map_x = np.where(visible, (a + 1) * (face_size / 2) - 0.5, -1).astype(np.float32)
+    map_y = np.where(visible, (b + 1) * (face_size / 2) - 0.5, -1).astype(np.float32)
+    map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    return row0, row1, map1, map2, visible
+
+def face_from_equirect(image: np.ndarray, view: Tuple[int, int], face_size: int) -> np.ndarray:
+    maps = gnomonic_maps((image.shape[1], image.shape[0]), view, face_size)
+    return cv2.remap(image, *maps, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+
+def face_to_equirect(face: np.ndarray, pano_size: Tuple[int, int], view: Tuple[int, int]) -> Tuple[slice, np.ndarray, np.ndarray]:
+    """면 위의 값(마스크 / 점수 맵)을 equirect로 투영합니다. 반환: (행 slice, 투영된 값, visible)"""
+    row0, row1, map1, map2, visible = equirect_maps(tuple(pano_size), view, face.shape[1])
+    warped = cv2.remap(face, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return slice(row0, row1), warped, visible
+
+def panorama_map_stats() -> Dict[str, Any]:
+    return {"mode": PANORAMA_MODE, **{fn.__name__: fn.cache_info()._asdict() for fn in (gnomonic_maps, equirect_maps)}}
+
+def floor_input_size(pyramid: ImagePyramid, panorama_mode: str) -> Tuple[int, int]:
+    """바닥 분석 입력 크기: 긴 변 FLOOR_TARGET_SIZE, cubemap이면 면(FLOOR_FACE_SIZE) 해상도에 맞는 equirect 너비"""
+    if use_cubemap(panorama_mode, pyramid.original_size()):
+        return pyramid.width_size(4 * FLOOR_FACE_SIZE)
+    return pyramid.long_side_size(FLOOR_TARGET_SIZE)
+
+def floor_score_cubemap(image_bgr: np.ndarray, beit: BeitModel, size: Tuple[int, int]) -> np.ndarray:
+    """
+    [Panorama] FLOOR_CUBE_VIEWS 면들을 BEiT에 한 배치로 넣고, 면별 바닥 점수(floor_score_map)를
+    size=(w, h) equirect 하나로 투영합니다. 어떤 면에도 없는 천장 쪽은 PANORAMA_UNCOVERED_SCORE입니다.
+    """
+    h, w = image_bgr.shape[:2]
+    with stage("floor_resize"):
+        # 면 중심에서 equirect와 1도당 픽셀이 같아지는 너비 (90° 면 4개 = 360°)
+        source_w = min(w, 4 * FLOOR_FACE_SIZE)
+        if source_w < w:
+            image_bgr = cv2.resize(image_bgr, (source_w, int(h * source_w / w)), interpolation=cv2.INTER_AREA)
+        image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+
+    with stage("panorama_remap"):
+        faces = [face_from_equirect(image_rgb, view, FLOOR_FACE_SIZE) for view in FLOOR_CUBE_VIEWS]
+
+    # 면 5개를 따로 큐에 넣어 SegBatcher가 BEIT_MAX_BATCH씩 (다른 요청과도) 묶어 실행
+    with stage("beit_infer"):
+        logits = beit.batcher.infer_many([beit.processor(images=face, return_tensors="pt")["pixel_values"] for face in faces])
+
+    with stage("panorama_reproject"):
+        score = np.full((size[1], size[0]), PANORAMA_UNCOVERED_SCORE, np.float32)
+        for view, face_logits in zip(FLOOR_CUBE_VIEWS, logits):
+            # logits(입력의 1/4) 격자에 바로 역투영 (면 크기로 bilinear 업샘플링한 뒤 투영하는 것과 같은 좌표계)
+            rows, warped, visible = face_to_equirect(floor_score_map(face_logits), size, view)
+            np.copyto(score[rows], warped, where=visible)
+    return score
+
+# 바닥 분석 튜닝 값 (bench/pipeline.py에서 지연 시간 / 마스크 변화를 측정)
+FLOOR_TARGET_SIZE = int(os.getenv("FLOOR_TARGET_SIZE", 800))  # BEiT 입력 전 긴 변 (px)
+FLOOR_CLOSE_KSIZE = int(os.getenv("FLOOR_CLOSE_KSIZE", 50))   # 구멍 메우기 Closing 커널 (px)
+
+# ADE20K Index는 SegFormer와 동일합니다 (표준 데이터셋 인덱스 사용)
+# 3=Floor, 9=Carpet, 27=Mat, 29=Rug
+FLOOR_CLASSES = [3, 9, 27, 29]
+FLOOR_BOTTOM_RATIO = 0.95  # [Panorama Specific] 하단 5%는 무조건 바닥
+FLOOR_MASK_RESOLUTIONS = ("working", "original")  # working = FLOOR_TARGET_SIZE 기준 크기
+FLOOR_OVERLAY_BGRA = (0, 255, 0, 200)  # Green with Alpha 200 (바닥이 아닌 곳은 투명)
+
+# [Mask Formats] png = RGBA 오버레이(기존), polygon = 단순화한 바닥 외곽선, rle = Run-Length Encoding
+# 여러 개는 "polygon,rle"처럼 쉼표로 지정. polygon / rle는 응답의 floor_mask에 담깁니다.
+MASK_FORMATS = ("png", "polygon", "rle")
+FLOOR_POLYGON_EPSILON = float(os.getenv("FLOOR_POLYGON_EPSILON", 2.0))  # approxPolyDP 허용 오차 (작업 해상도 px)
+FLOOR_POLYGON_MIN_AREA = 0.0005  # 프레임 면적 대비 이보다 작은 조각은 polygon에서 제외
+
+def parse_mask_format(mask_format: str) -> set:
+    formats = {f.strip() for f in (mask_format or "").split(",") if f.strip()}
+    if not formats or not formats <= set(MASK_FORMATS):
+        raise HTTPException(status_code=400, detail=f"mask_format must be a comma-separated subset of {list(MASK_FORMATS)}")
+    return formats
+
+def check_mask_resolution(mask_resolution: str) -> str:
+    if mask_resolution not in FLOOR_MASK_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail="mask_resolution must be 'working' or 'original'")
+    return mask_resolution
+
+def floor_score_map(logits: torch.Tensor) -> np.ndarray:
+    """
+    (1, 150, h, w) logits -> (h, w) float32 '바닥 클래스 최대 - 나머지 클래스 최대'.
+    양수인 곳이 argmax가 바닥 클래스인 곳입니다.
+    """
+    other_classes = [c for c in range(logits.shape[1]) if c not in FLOOR_CLASSES]
+    floor = logits[0, FLOOR_CLASSES].amax(dim=0)
+    other = logits[0, other_classes].amax(dim=0)
+    return (floor - other).float().cpu().numpy()
+
+def floor_score_upsampled(logits: torch.Tensor, size: Tuple[int, int]) -> np.ndarray:
+    """
+    (1, 150, h, w) logits -> 작업 해상도 size=(w, h)의 floor_score_map.
+    최대값을 먼저 구하고 업샘플링하면 클래스 경계에서 기존 '150채널 업샘플링 -> argmax'와 달라지므로
+    (bench/floor_post.py IoU 0.979), 바닥 클래스와 logits 해상도에서 한 번이라도 '나머지 중 최대'였던 클래스만
+    기존과 같은 torch bilinear로 업샘플링한 뒤 최대값을 비교합니다. (보통 150채널 중 10개 안팎)
+    """
+    other_classes = torch.tensor([c for c in range(logits.shape[1]) if c not in FLOOR_CLASSES], device=logits.device)
+    top_other = other_classes[logits[0, other_classes].argmax(dim=0).unique()]
+    channels = torch.cat([torch.tensor(FLOOR_CLASSES, device=logits.device), top_other])
+    upsampled = torch.nn.functional.interpolate(
+        logits[:, channels], size=(size[1], size[0]), mode="bilinear", align_corners=False
+    )[0]
+    n_floor = len(FLOOR_CLASSES)
+    return (upsampled[:n_floor].amax(dim=0) - upsampled[n_floor:].amax(dim=0)).float().cpu().numpy()
+
+def floor_mask_from_logits(logits: torch.Tensor, size: Tuple[int, int]) -> np.ndarray:
+    """BEiT logits -> 작업 해상도 size=(w, h)의 uint8 바닥 마스크 (0 or 1)"""
+    return floor_mask_from_score(floor_score_upsampled(logits, size))
+
+def floor_mask_from_score(score: np.ndarray) -> np.ndarray:
+    """작업 해상도 (h, w) 바닥 점수 맵 -> uint8 바닥 마스크 (0 or 1)"""
+    h = score.shape[0]
+    floor_mask_binary = (score > 0).view(np.uint8)
+
+    # [Panorama Specific] Force Bottom Edge (5%)
+    # 파노라마 하단부는 무조건 바닥이라는 가정
+    floor_mask_binary[int(h * FLOOR_BOTTOM_RATIO):, :] = 1
+
+    # Morphology (Closing) - 구멍 메우기
+    # 사각 커널은 OpenCV가 가로 / 세로 1D 필터로 분리해서 처리 (bench/floor_post.py에서 측정)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (FLOOR_CLOSE_KSIZE, FLOOR_CLOSE_KSIZE))
+    cv2.morphologyEx(floor_mask_binary, cv2.MORPH_CLOSE, kernel, dst=floor_mask_binary)
+
+    # Fill Internal Holes (가구 자리 메우기) - 외곽 contour를 마스크 위에 바로 채움 (= 기존 OR 결과)
+    contours, hierarchy = cv2.findContours(floor_mask_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if contours:
+        cv2.drawContours(floor_mask_binary, contours, -1, 1, thickness=cv2.FILLED)
+    return floor_mask_binary
+
+def resize_floor_mask(floor_mask_binary: np.ndarray, output_size: Optional[Tuple[int, int]]) -> np.ndarray:
+    """output_size=(w, h)로 부드럽게 확대한 0/1 마스크 (None이거나 같은 크기면 그대로)"""
+    h, w = floor_mask_binary.shape[:2]
+    if not output_size or tuple(output_size) == (w, h): return floor_mask_binary
+    scaled = cv2.resize(floor_mask_binary * 255, tuple(output_size), interpolation=cv2.INTER_LINEAR)
+    cv2.threshold(scaled, 127, 1, cv2.THRESH_BINARY, dst=scaled)
+    return scaled
+
+def floor_overlay_png(floor_mask_binary: np.ndarray, output_size: Optional[Tuple[int, int]] = None) -> bytes:
+    """바닥 마스크 -> RGBA PNG. output_size=(w, h)를 주면 그 크기로 부드럽게 확대한 뒤 만듭니다."""
+    floor_mask_binary = resize_floor_mask(floor_mask_binary, output_size)
+    # 0/1 마스크에 채널 값을 곱한 1채널 plane 4개를 한 번에 merge (boolean 대입 4회 대신)
+    rgba_image = cv2.merge([floor_mask_binary * np.uint8(v) for v in FLOOR_OVERLAY_BGRA])
+    is_success, buffer = cv2.imencode(".png", rgba_image)
+    return buffer.tobytes() if is_success else b""
+
+def floor_polygons(floor_mask_binary: np.ndarray) -> List[List[List[float]]]:
+    """
+    바닥 외곽선을 approxPolyDP로 단순화한 polygon 목록. 좌표는 [x, y] 정규화(0~1, 픽셀 중심 기준).
+    내부 구멍은 detect 단계에서 이미 메웠으므로 외곽선만으로 마스크 전체를 표현합니다.
+    """
+    h, w = floor_mask_binary.shape[:2]
+    contours, hierarchy = cv2.findContours(floor_mask_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    polygons = []
+    for contour in contours:
+        if cv2.contourArea(contour) < FLOOR_POLYGON_MIN_AREA * w * h: continue
+        approx = cv2.approxPolyDP(contour, FLOOR_POLYGON_EPSILON, True).reshape(-1, 2)
+        if len(approx) < 3: continue
+        polygons.append(np.round((approx + 0.5) / (w, h), 5).tolist())
+    return polygons
+
+def floor_rle(floor_mask_binary: np.ndarray) -> Dict[str, Any]:
+    """
+    Row-major Run-Length Encoding. counts는 배경(0) run부터 시작해서 0 / 1 run 길이를 번갈아 담습니다.
+    정규화 좌표 (u, v)는 픽셀 (int(u * width), int(v * height))에 해당합니다.
+    """
+    h, w = floor_mask_binary.shape[:2]
+    flat = floor_mask_binary.ravel()
+    bounds = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1, [flat.size]))
+    counts = np.diff(bounds)
+    if flat.size and flat[0]: counts = np.concatenate(([0], counts))
+    return {"order": "row-major", "size": [h, w], "counts": counts.tolist()}
+
+def encode_floor_mask(floor_mask_binary: np.ndarray, formats: set,
+                      output_size: Optional[Tuple[int, int]] = None) -> Tuple[bytes, Optional[FloorMask]]:
+    """mask_format에 따라 (RGBA PNG 또는 b"", FloorMask 또는 None)을 만듭니다."""
+    png = b""
+    if "png" in formats:
+        with stage("floor_png"):
+            png = floor_overlay_png(floor_mask_binary, output_size)
+    if not formats & {"polygon", "rle"}: return png, None
+    with stage("floor_vector"):
+        # polygon은 정규화 좌표이므로 항상 작업 해상도 마스크에서, rle는 요청한 해상도에서 만듭니다.
+        rle_mask = resize_floor_mask(floor_mask_binary, output_size)
+        floor_mask = FloorMask(
+            width=rle_mask.shape[1],
+            height=rle_mask.shape[0],
+            polygons=floor_polygons(floor_mask_binary) if "polygon" in formats else None,
+            rle=floor_rle(rle_mask) if "rle" in formats else None,
+        )
+    return png, floor_mask
 
 def detect_floor_boundary(image_bgr) -> str:
     """
     Microsoft BEiT(ADE20K)를 사용하여 '바닥(Floor)' 영역을 찾고, 
     해당 영역을 마스크 이미지(Base64)로 반환합니다.
     """
-    if seg_model is None: 
-        print("⚠️ SegModel is None")
-        return ""
-    
+    png = detect_floor_mask_png(image_bgr)
+    if not png: return ""
+    return f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}"
+
+def detect_floor_mask_png(image_bgr, beit: Optional[BeitModel] = None,
+                          output_size: Optional[Tuple[int, int]] = None) -> bytes:
+    """
+    바닥 마스크를 RGBA PNG 바이트로 반환합니다. (실패 시 b"", beit를 주면 해당 모델 사용)
+    기본 크기는 FLOOR_TARGET_SIZE 기준 작업 해상도, output_size=(w, h)를 주면 그 크기로 반환합니다.
+    """
+    return detect_floor_outputs(image_bgr, {"png"}, output_size, beit)[0]
+
+def detect_floor_outputs(image_bgr, formats: set, output_size: Optional[Tuple[int, int]] = None,
+                         beit: Optional[BeitModel] = None, panorama_mode: str = PANORAMA_MODE) -> Tuple[bytes, Optional[FloorMask]]:
+    """
+    바닥을 검출해서 encode_floor_mask 결과를 반환합니다. (추론 / 후처리 실패 시 (b"", None), HTTPException은 그대로 전달)
+    panorama_mode="cubemap"이고 2:1 이미지면 cubemap 면별로 검출해서 같은 작업 해상도 equirect로 합칩니다.
+    """
+    # 모델 로드 실패 / warm-up 중(503)은 빈 마스크로 삼키지 않고 그대로 클라이언트에 전달
+    beit = beit or MODELS.get("beit")
     try:
         original_h, original_w = image_bgr.shape[:2]
         
         # 1. Resize logic for BEiT
         # BEiT는 내부적으로 리사이징을 처리하지만, 너무 큰 이미지는 속도를 위해 적절히 줄여서 넣습니다.
-        TARGET_SIZE = 800 
+        TARGET_SIZE = FLOOR_TARGET_SIZE
         scale = TARGET_SIZE / max(original_h, original_w)
         new_h, new_w = int(original_h * scale), int(original_w * scale)
-        
-        resized_img = cv2.resize(image_bgr, (new_w, new_h))
-        image_rgb = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
-        
-        # 2. Inference
-        inputs = processor(images=image_rgb, return_tensors="pt").to(device)
-        
-        with torch.no_grad():
-            outputs = seg_model(**inputs)
-            
-        # 3. Post-processing
-        # BEiT의 출력 로직은 SegFormer와 거의 동일합니다.
-        logits = outputs.logits
-        # 이미지가 리사이즈된 크기(new_h, new_w)로 업샘플링
-        upsampled_logits = torch.nn.functional.interpolate(
-            logits, size=(new_h, new_w), mode="bilinear", align_corners=False
-        )
-        
-        pred_seg = upsampled_logits.argmax(dim=1)[0].cpu().numpy()
-        
-        # 4. Floor Mask Enriched (Class Union)
-        # ADE20K Index는 SegFormer와 동일합니다 (표준 데이터셋 인덱스 사용)
-        # 3=Floor, 9=Carpet, 27=Mat, 29=Rug
-        floor_classes = [3, 9, 27, 29]
-        floor_mask_binary = np.isin(pred_seg, floor_classes).astype(np.uint8) # 0 or 1
-        
-        # [Panorama Specific] Force Bottom Edge (5%)
-        # 파노라마 하단부는 무조건 바닥이라는 가정
-        force_bottom_h = int(new_h * 0.95)
-        floor_mask_binary[force_bottom_h:, :] = 1
-
-        # 5. Morphology (Closing) - 구멍 메우기
-        kernel_size = 50 
-        kernel = np.ones((kernel_size, kernel_size), np.uint8)
-        floor_mask_binary = cv2.morphologyEx(floor_mask_binary, cv2.MORPH_CLOSE, kernel)
-        
-        # Fill Internal Holes (가구 자리 메우기)
-        contours, hierarchy = cv2.findContours(floor_mask_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if contours:
-            filled_mask = np.zeros_like(floor_mask_binary)
-            cv2.drawContours(filled_mask, contours, -1, 1, thickness=cv2.FILLED)
-            floor_mask_binary = cv2.bitwise_or(floor_mask_binary, filled_mask)
-
-        # 6. Create RGBA Image
-        rgba_image = np.zeros((new_h, new_w, 4), dtype=np.uint8)
-        
-        # Mask condition
-        mask_bool = (floor_mask_binary >= 1)
-        
-        # Green with Alpha 200
-        rgba_image[mask_bool, 0] = 0   # B
-        rgba_image[mask_bool, 1] = 255 # G
-        rgba_image[mask_bool, 2] = 0   # R
-        rgba_image[mask_bool, 3] = 200 # A
-        
-        # 7. Encode
-        is_success, buffer = cv2.imencode(".png", rgba_image)
-        if not is_success: return ""
-            
-        import base64
-        mask_base64 = base64.b64encode(buffer).decode("utf-8")
+
+        if use_cubemap(panorama_mode, (original_w, original_h)):
+            # [Panorama] 면별 BEiT 점수를 작업 해상도 equirect로 투영한 뒤 같은 후처리
+            score = floor_score_cubemap(image_bgr, beit, (new_w, new_h))
+            with stage("floor_post"):
+                floor_mask_binary = floor_mask_from_score(score)
+        else:
+            with stage("floor_resize"):
+                resized_img = cv2.resize(image_bgr, (new_w, new_h)) if (new_w, new_h) != (original_w, original_h) else image_bgr
+                image_rgb = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
+
+            # 2. Inference (동시 요청은 SegBatcher가 하나의 배치로 묶어 실행)
+            with stage("beit_infer"):
+                inputs = beit.processor(images=image_rgb, return_tensors="pt")
+                logits = beit.batcher.infer(inputs["pixel_values"])
+
+            # 3. Post-processing (바닥 / 후보 클래스만 업샘플링 -> Closing -> 구멍 메우기)
+            with stage("floor_post"):
+                floor_mask_binary = floor_mask_from_logits(logits, (new_w, new_h))
+
+        # 4. RGBA Image / Polygon / RLE Encode
+        png, floor_mask = encode_floor_mask(floor_mask_binary, formats, output_size)
         
         print("✅ Floor Mask Generated (BEiT)")
-        return f"data:image/png;base64,{mask_base64}"
-            
+        return png, floor_mask
+
+    except HTTPException:
+        raise  # 대기열 초과 / 타임아웃 등 과부하 상태는 클라이언트가 재시도할 수 있도록 전달
     except Exception as e:
         print(f"⚠️ Floor detection failed: {e}")
-        return ""
+        return b"", None
 
-def process_removal(image_bytes: bytes, x: int, y: int):
+SAM_PROCESS_WIDTH = int(os.getenv("SAM_PROCESS_WIDTH", 2048))  # SAM / Gemini 입력 너비
+
+# [Crop-and-Inpaint] 마스크 주변 Context 영역만 Gemini에 보내는 모드 ("full" | "crop")
+# 기본은 기존 출력과 같은 "full", 요청의 inpaint_mode 또는 INPAINT_MODE=crop으로 선택합니다.
+INPAINT_MODE = os.getenv("INPAINT_MODE", "full")
+INPAINT_CROP_CONTEXT = float(os.getenv("INPAINT_CROP_CONTEXT", 2.5))  # crop 한 변 = 마스크 bbox 변 x 배율
+INPAINT_CROP_MIN_SIZE = int(os.getenv("INPAINT_CROP_MIN_SIZE", 512))  # crop 최소 크기 (2048px 기준)
+INPAINT_CROP_MAX_AREA = 0.6  # crop이 프레임의 60%를 넘으면 full 모드와 차이가 없으므로 전체 전송
+
+REMOVE_MAX_OBJECTS = int(os.getenv("REMOVE_MAX_OBJECTS", 8))  # /remove-object 한 번에 지울 수 있는 물체 수
+
+class RemovalTarget(BaseModel):
     """
-    [Balanced Inpainting]
-    1024px(저화질) 대신 2048px(중화질)로 리사이징하여 디테일을 살리고,
-    복원 시 LANCZOS4 알고리즘을 사용하여 선명도를 극대화합니다.
+    /remove-object의 objects 항목 하나 = 지울 물체 하나 (원본 이미지 좌표)
+    points: 물체 위 클릭, negative_points: 마스크에서 뺄 지점, box: (x0, y0, x1, y1)
     """
-    if predictor is None:
-        raise ValueError("SAM model is not loaded")
-    
-    # 1. Image Conversion
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if image is None: raise ValueError("Invalid image")
-        
-    original_h, original_w = image.shape[:2]
-    
-    # 2048px Resizing Strategy
-    PROCESS_WIDTH = 2048
-    
-    if original_w > PROCESS_WIDTH:
-        scale = PROCESS_WIDTH / original_w
-        new_h = int(original_h * scale)
-        input_image = cv2.resize(image, (PROCESS_WIDTH, new_h), interpolation=cv2.INTER_AREA)
-        input_x = int(x * scale)
-        input_y = int(y * scale)
-    else:
-        input_image = image
-        input_x = x
-        input_y = y
-        
-    image_rgb = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
-    proc_h, proc_w = image_rgb.shape[:2]
+    points: List[Tuple[int, int]] = []
+    negative_points: List[Tuple[int, int]] = []
+    box: Optional[Tuple[int, int, int, int]] = None
+
+def parse_removal_targets(objects: Optional[str], x: Optional[int], y: Optional[int]) -> List[RemovalTarget]:
+    """objects(JSON 배열) 또는 기존 x, y 한 점을 RemovalTarget 목록으로 변환합니다."""
+    if objects is None:
+        if x is None or y is None:
+            raise HTTPException(status_code=400, detail="Either objects or x and y are required")
+        return [RemovalTarget(points=[(x, y)])]
+    try:
+        targets = [RemovalTarget(**item) for item in json.loads(objects)]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid objects: {e}")
+    if not 1 <= len(targets) <= REMOVE_MAX_OBJECTS:
+        raise HTTPException(status_code=400, detail=f"objects must contain 1 to {REMOVE_MAX_OBJECTS} items")
+    if any(not t.points and t.box is None for t in targets):
+        raise HTTPException(status_code=400, detail="Each object needs at least one point or a box")
+    return targets
+
+@dataclass
+class RemovalJob:
+    """process_removal 단계 사이에서 전달되는 중간 결과"""
+    image: np.ndarray          # 원본 BGR
+    input_image: np.ndarray    # 2048px BGR
+    image_rgb: np.ndarray      # 2048px RGB (SAM / Gemini 입력)
+    mask_dilated: np.ndarray   # 2048px uint8 마스크 (모든 물체 합집합)
+    crop: Optional[Tuple[int, int, int, int]] = None  # Gemini에 보낼 영역 (x0, y0, x1, y1), None이면 전체
+    object_masks: List[np.ndarray] = field(default_factory=list)  # 물체별 2048px bool 마스크 (Dilate 이전)
+
+def inpaint_crop_window(mask: np.ndarray, context: float = INPAINT_CROP_CONTEXT,
+                        min_size: int = INPAINT_CROP_MIN_SIZE) -> Optional[Tuple[int, int, int, int]]:
+    """마스크 bbox를 중심으로 context 배율만큼 넓힌 crop 영역. 프레임 대부분을 덮으면 None."""
+    bx, by, bw, bh = cv2.boundingRect(mask)
+    if bw == 0 or bh == 0: return None
+    h, w = mask.shape[:2]
+    cw = min(w, max(int(bw * context), min_size))
+    ch = min(h, max(int(bh * context), min_size))
+    x0 = min(max(0, int(bx + bw / 2 - cw / 2)), w - cw)
+    y0 = min(max(0, int(by + bh / 2 - ch / 2)), h - ch)
+    if cw * ch > INPAINT_CROP_MAX_AREA * w * h: return None
+    return (x0, y0, x0 + cw, y0 + ch)
 
-    # 2. SAM Prediction
-    predictor.set_image(image_rgb)
-    input_point = np.array([[input_x, input_y]])
-    input_label = np.array([1]) 
+def segment_object(image_bytes: bytes, x: int, y: int) -> RemovalJob:
+    """
+    [Stage 1 - SAM] 디코딩, 2048px 리사이징, 클릭 지점 객체 마스크 생성
+    """
+    return segment_objects(image_bytes, [RemovalTarget(points=[(x, y)])])
+
+def predict_target_mask(predictor: SamPredictor, target: RemovalTarget, scale: float) -> np.ndarray:
+    """이미 set_image된 임베딩으로 물체 하나의 마스크(bool)를 예측합니다."""
+    points = [(px * scale, py * scale) for px, py in target.points + target.negative_points]
+    labels = [1] * len(target.points) + [0] * len(target.negative_points)
+    box = np.array(target.box, dtype=np.float32) * scale if target.box is not None else None
+    # 클릭 한 번은 모호하므로 후보 3개의 합집합, 여러 점 / box가 있으면 SAM 권장대로 단일 마스크
+    single_click = len(target.points) == 1 and not target.negative_points and box is None
     masks, scores, logits = predictor.predict(
-        point_coords=input_point,
-        point_labels=input_label,
-        multimask_output=True, 
+        point_coords=np.array(points) if points else None,
+        point_labels=np.array(labels) if labels else None,
+        box=box,
+        multimask_output=single_click,
     )
+    return np.logical_or.reduce(masks) if single_click else masks[0]
+
+def predict_frame_masks(predictor: SamPredictor, pyramid: ImagePyramid, targets: List[RemovalTarget],
+                        process_size: Tuple[int, int]) -> List[np.ndarray]:
+    """전체 프레임(process_size) 임베딩 하나로 물체별 마스크(bool, process_size)를 예측합니다."""
+    scale = process_size[0] / pyramid.original_size()[0]
+    with stage("sam_set_image"):
+        sam_embedding_cache.set_image(predictor, pyramid.rgb(process_size), key=f"{pyramid.key}:{process_size}", encoder_input=pyramid.rgb)
+    with stage("sam_predict"):
+        return [predict_target_mask(predictor, target, scale) for target in targets]
+
+def target_prompt_points(target: RemovalTarget, samples: int = 9) -> np.ndarray:
+    """물체의 positive 프롬프트 (클릭 + box 둘레 샘플, equirect에서 box 변은 면 위에서 곡선) 원본 좌표 (N, 2)"""
+    points = [np.array(target.points, np.float32).reshape(-1, 2)]
+    if target.box is not None:
+        x0, y0, x1, y1 = target.box
+        s = np.linspace(0, 1, samples, dtype=np.float32)
+        xs, ys = x0 + (x1 - x0) * s, y0 + (y1 - y0) * s
+        points += [np.stack([xs, np.full_like(xs, y)], axis=-1) for y in (y0, y1)]
+        points += [np.stack([np.full_like(ys, x), ys], axis=-1) for x in (x0, x1)]
+    return np.concatenate(points)
+
+def panorama_view(points: np.ndarray, size: Tuple[int, int]) -> Tuple[int, int]:
+    """프롬프트 평균 방향을 PANORAMA_VIEW_STEP_DEG 단위로 반올림한 (yaw, pitch). 경도 0 / 360 경계를 넘는 물체도 처리합니다."""
+    d = equirect_directions(points, size).sum(axis=0)
+    yaw = np.degrees(np.arctan2(d[0], d[2]))
+    pitch = np.degrees(np.arctan2(d[1], np.hypot(d[0], d[2])))
+    step = PANORAMA_VIEW_STEP_DEG
+    return int(round(yaw / step) * step) % 360, int(np.clip(round(pitch / step) * step, -90, 90))
+
+def face_target(target: RemovalTarget, size: Tuple[int, int], view: Tuple[int, int], face_size: int) -> Optional[RemovalTarget]:
+    """
+    원본 좌표 target을 view 면 좌표로 옮깁니다. positive 프롬프트가 면 안쪽(PANORAMA_PROMPT_MARGIN)에 없으면 None.
+    면 밖의 negative point는 버리고, box는 둘레를 투영한 bbox로 바꿉니다.
+    """
+    def project(points):
+        return directions_to_view(equirect_directions(np.asarray(points, np.float32).reshape(-1, 2), size), view, face_size)
+
+    coords, reach = project(target_prompt_points(target))
+    if len(reach) == 0 or reach.max() > PANORAMA_PROMPT_MARGIN: return None
+    points = np.round(coords[:len(target.points)]).astype(int).tolist()
+    negatives, negative_reach = project(target.negative_points)
+    negatives = np.round(negatives[negative_reach <= 1]).astype(int).tolist()
+    box = None
+    if target.box is not None:
+        box_coords = coords[len(target.points):]
+        box = tuple(np.round(np.concatenate([box_coords.min(axis=0), box_coords.max(axis=0)])).astype(int).tolist())
+    return RemovalTarget(points=points, negative_points=negatives, box=box)
+
+def predict_panorama_masks(predictor: SamPredictor, pyramid: ImagePyramid, targets: List[RemovalTarget],
+                           process_size: Tuple[int, int]) -> List[np.ndarray]:
+    """
+    [Panorama] 물체마다 프롬프트 방향의 원근 면(SAM_FACE_SIZE)에서 마스크를 예측하고 process_size equirect로 투영합니다.
+    같은 면에 들어가는 물체끼리는 임베딩 하나를 공유하고, 한 면에 들어가지 않는 큰 물체는 전체 프레임에서 예측합니다.
+    """
+    size = pyramid.original_size()
+    groups = {}  # view (None = 전체 프레임) -> [(물체 index, 해당 좌표계 target)]
+    for i, target in enumerate(targets):
+        view = panorama_view(target_prompt_points(target), size)
+        face = face_target(target, size, view, SAM_FACE_SIZE)
+        groups.setdefault(view if face else None, []).append((i, face or target))
+
+    object_masks = [None] * len(targets)
+    for view, items in groups.items():
+        if view is None:
+            masks = predict_frame_masks(predictor, pyramid, [target for _, target in items], process_size)
+            for (i, _), mask in zip(items, masks): object_masks[i] = mask
+            continue
+
+        # 면 중심에서 equirect와 1도당 픽셀이 같아지는 너비(90° 면 4개 = 360°)의 level에서 잘라냄
+        source_size = pyramid.width_size(4 * SAM_FACE_SIZE)
+        with stage("panorama_remap"):
+            face_rgb = face_from_equirect(pyramid.rgb(source_size), view, SAM_FACE_SIZE)
+        with stage("sam_set_image"):
+            sam_embedding_cache.set_image(predictor, face_rgb, key=f"{pyramid.key}:pano:{view}:{SAM_FACE_SIZE}")
+        with stage("sam_predict"):
+            face_masks = [predict_target_mask(predictor, target, 1.0) for _, target in items]
+        with stage("panorama_reproject"):
+            for (i, _), face_mask in zip(items, face_masks):
+                rows, warped, visible = face_to_equirect(face_mask.astype(np.uint8) * 255, process_size, view)
+                mask = np.zeros((process_size[1], process_size[0]), bool)
+                mask[rows] = (warped > 127) & visible
+                object_masks[i] = mask
+    return object_masks
+
+def segment_objects(source, targets: List[RemovalTarget], panorama_mode: str = PANORAMA_MODE) -> RemovalJob:
+    """
+    [Stage 1 - SAM] 디코딩, 2048px 리사이징 후 하나의 이미지 임베딩으로 물체별 마스크를 예측하고 합칩니다.
+    source는 ImagePyramid 또는 이미지 바이트입니다. panorama_mode="cubemap"이면 클릭한 방향의 면에서 예측합니다.
+    """
+    pool = MODELS.get("sam")
+    pyramid = source if isinstance(source, ImagePyramid) else ImagePyramid(source)
     
-    # 3. Mask Processing
-    combined_mask = np.logical_or(masks[0], masks[1])
-    combined_mask = np.logical_or(combined_mask, masks[2])
-    mask_uint8 = (combined_mask * 255).astype(np.uint8)
+    # 1. Image Conversion (원본 디코딩 1회, 2048px Resizing Strategy)
+    # 합성 결과는 원본에 in-place로 쓰므로 공유되는 원본 level은 복사해서 사용
+    image = pyramid.level().copy()
+    process_size = pyramid.width_size(SAM_PROCESS_WIDTH)
+    input_image = pyramid.level(process_size)
+    image_rgb = pyramid.rgb(process_size)
+
+    # 2. SAM Prediction (동일 이미지면 캐시된 임베딩 재사용, 물체가 여러 개여도 인코딩은 한 번 - cubemap은 면마다 한 번)
+    # 요청마다 pool에서 빌린 predictor를 사용하므로 동시 요청이 서로의 이미지 상태를 덮어쓰지 않음
+    with pool.acquire() as predictor:
+        if use_cubemap(panorama_mode, pyramid.original_size()):
+            object_masks = predict_panorama_masks(predictor, pyramid, targets, process_size)
+        else:
+            object_masks = predict_frame_masks(predictor, pyramid, targets, process_size)
     
-    # Dilate
-    kernel = np.ones((10,10), np.uint8)
-    mask_dilated = cv2.dilate(mask_uint8, kernel, iterations=3)
+    # 3. Mask Processing (합집합 후 Dilate 한 번 = 물체별 Dilate의 합집합)
+    with stage("sam_mask_post"):
+        combined_mask = np.logical_or.reduce(object_masks)
+        mask_uint8 = (combined_mask * 255).astype(np.uint8)
+        
+        # Dilate
+        kernel = np.ones((10,10), np.uint8)
+        mask_dilated = cv2.dilate(mask_uint8, kernel, iterations=3)
+
+    return RemovalJob(image=image, input_image=input_image, image_rgb=image_rgb, mask_dilated=mask_dilated,
+                      object_masks=object_masks)
+
+def encode_inpaint_payload(job: RemovalJob) -> bytes:
+    """빨간 마스크를 칠한 JPEG. job.crop이 있으면 해당 영역만 잘라서 만듭니다."""
+    if job.crop:
+        x0, y0, x1, y1 = job.crop
+        image_with_mask = job.image_rgb[y0:y1, x0:x1].copy()
+        image_with_mask[job.mask_dilated[y0:y1, x0:x1] > 0] = [255, 0, 0] # Red
+    else:
+        image_with_mask = job.image_rgb.copy()
+        image_with_mask[job.mask_dilated > 0] = [255, 0, 0] # Red
+    payload = cv2.imencode('.jpg', image_with_mask)[1].tobytes()
+    print(f"📤 Gemini payload: {image_with_mask.shape[1]}x{image_with_mask.shape[0]}, {len(payload) / 1024:.0f} KB")
+    return payload
+
+def decode_inpaint_response(response) -> Optional[np.ndarray]:
+    if response.candidates and response.candidates[0].content.parts:
+        for part in response.candidates[0].content.parts:
+            if part.inline_data:
+                nparr_res = np.frombuffer(part.inline_data.data, np.uint8)
+                res_img = cv2.imdecode(nparr_res, cv2.IMREAD_COLOR)
+                if res_img is not None:
+                    return res_img
+    return None
 
-    # 4. Call Gemini
-    print(f"🚀 Calling Gemini (2.5 Flash Image) - 2K Mode ({proc_w}x{proc_h})")
+async def request_inpaint(job: RemovalJob) -> Optional[np.ndarray]:
+    """
+    [Stage 2 - Gemini] 빨간 마스크를 칠한 이미지를 보내고 결과 이미지(BGR)를 받습니다.
+    job.crop이 있으면 결과도 그 영역에 해당합니다. 재시도 / 속도 제한은 GEMINI 게이트웨이가 처리합니다.
+    """
+    with stage("gemini_payload"):
+        payload = await asyncio.to_thread(encode_inpaint_payload, job)
     
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            image_with_mask = image_rgb.copy()
-            image_with_mask[mask_dilated > 0] = [255, 0, 0] # Red
-            
-            prompt_text = (
-                "The area marked in RED is an unwanted object. "
-                "Remove it completely and fill the space with a realistic wooden floor and white wall to match the room. "
-                "The result should look like a high-quality real estate photo. "
-                "Make sure the lighting and shadows are consistent with the rest of the room."
-            )
-            
-            response = client.models.generate_content(
-                model='gemini-2.5-flash-image',
-                contents=[
-                    types.Part.from_bytes(
-                        data=cv2.imencode('.jpg', image_with_mask)[1].tobytes(),
-                        mime_type="image/jpeg"
-                    ),
-                    prompt_text
-                ],
-                config=types.GenerateContentConfig(
-                    response_modalities=["IMAGE"],
-                    candidate_count=1,
+    if len(job.object_masks) > 1:
+        target_text = "The areas marked in RED are unwanted objects. Remove them completely and fill the space"
+    else:
+        target_text = "The area marked in RED is an unwanted object. Remove it completely and fill the space"
+    prompt_text = (
+        f"{target_text} with a realistic wooden floor and white wall to match the room. "
+        "The result should look like a high-quality real estate photo. "
+        "Make sure the lighting and shadows are consistent with the rest of the room."
+    )
+    
+    with stage("gemini_inpaint"):
+        response = await GEMINI.generate_content(
+            model='gemini-2.5-flash-image',
+            contents=[
+                types.Part.from_bytes(
+                    data=payload,
+                    mime_type="image/jpeg"
                 ),
-            )
-            
-            if response.candidates and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if part.inline_data:
-                        img_data = part.inline_data.data
-                        nparr_res = np.frombuffer(img_data, np.uint8)
-                        
-                        # Gemini Result
-                        res_img = cv2.imdecode(nparr_res, cv2.IMREAD_COLOR)
-                        if res_img is None: continue
-                        
-                        # (A) Histogram Matching
-                        res_img_resized = cv2.resize(res_img, (proc_w, proc_h))
-                        
-                        try:
-                            from skimage import exposure
-                            matched = exposure.match_histograms(res_img_resized, input_image, channel_axis=-1)
-                            gemini_final_mid = matched.astype(np.uint8)
-                        except:
-                            gemini_final_mid = res_img_resized
-                            
-                        # (B) Upscaling & Compositing
-                        if original_w != proc_w:
-                            gemini_upscaled = cv2.resize(gemini_final_mid, (original_w, original_h), interpolation=cv2.INTER_LANCZOS4)
-                            mask_upscaled = cv2.resize(mask_dilated, (original_w, original_h), interpolation=cv2.INTER_NEAREST)
-                        else:
-                            gemini_upscaled = gemini_final_mid
-                            mask_upscaled = mask_dilated
-
-                        # Feathering
-                        mask_float = mask_upscaled.astype(np.float32) / 255.0
-                        mask_blurred = cv2.GaussianBlur(mask_float, (21, 21), 0)
-                        if len(mask_blurred.shape) == 2:
-                            mask_blurred = np.dstack([mask_blurred]*3)
-
-                        # Final Composite
-                        original_bgr = image.astype(np.float32)
-                        gemini_float = gemini_upscaled.astype(np.float32)
-                        
-                        final_composite = (gemini_float * mask_blurred) + \
-                                          (original_bgr * (1.0 - mask_blurred))
-                        
-                        print(f"✅ Inpainting Complete! (2048px -> Upscaled)")
-                        return final_composite.astype(np.uint8)
-                        
-            raise ValueError("No image part in Gemini response")
- 
+                prompt_text
+            ],
+            config=types.GenerateContentConfig(
+                response_modalities=["IMAGE"],
+                candidate_count=1,
+            ),
+        )
+    with stage("gemini_decode"):
+        return await asyncio.to_thread(decode_inpaint_response, response)
+
+COMPOSITE_FEATHER_KSIZE = 21  # Feathering Gaussian 커널 (원본 해상도 기준)
+
+def resize_roi(src: np.ndarray, full_size, roi, interpolation=cv2.INTER_LANCZOS4) -> np.ndarray:
+    """
+    cv2.resize(src, full_size) 결과 중 roi=(x0, y0, x1, y1) 영역만 계산합니다.
+    전체 해상도 이미지를 만들지 않고 같은 좌표 매핑(픽셀 중심 기준)을 사용합니다.
+    """
+    full_w, full_h = full_size
+    x0, y0, x1, y1 = roi
+    src_h, src_w = src.shape[:2]
+    if interpolation == cv2.INTER_NEAREST:
+        # cv2.resize(INTER_NEAREST)와 동일: src = floor(dst * scale)
+        cols = np.minimum((np.arange(x0, x1) * (src_w / full_w)).astype(np.int32), src_w - 1)
+        rows = np.minimum((np.arange(y0, y1) * (src_h / full_h)).astype(np.int32), src_h - 1)
+        return src[rows[:, None], cols]
+
+    sx, sy = src_w / full_w, src_h / full_h
+    if sx > 1 or sy > 1: interpolation = cv2.INTER_LINEAR  # 축소 시 LANCZOS 링잉 방지
+    M = np.float32([[sx, 0, (x0 + 0.5) * sx - 0.5], [0, sy, (y0 + 0.5) * sy - 0.5]])
+    return cv2.warpAffine(src, M, (x1 - x0, y1 - y0), flags=interpolation | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+def histogram_match_lut(source: np.ndarray, reference: np.ndarray, max_side: int = 512) -> np.ndarray:
+    """
+    source의 채널별 색 분포를 reference에 맞추는 LUT (exposure.match_histograms와 같은 CDF 매칭).
+    분포는 작은 썸네일에서 계산하고, 실제 적용은 cv2.LUT로 ROI에만 합니다.
+    """
+    def thumbnail(img):
+        scale = max_side / max(img.shape[:2])
+        if scale >= 1: return img
+        return cv2.resize(img, (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+
+    src, ref = thumbnail(source), thumbnail(reference)
+    lut = np.empty((1, 256, 3), dtype=np.uint8)
+    for c in range(3):
+        src_cdf = np.cumsum(np.bincount(src[..., c].ravel(), minlength=256)) / src[..., c].size
+        ref_cdf = np.cumsum(np.bincount(ref[..., c].ravel(), minlength=256)) / ref[..., c].size
+        lut[0, :, c] = np.clip(np.round(np.interp(src_cdf, ref_cdf, np.arange(256))), 0, 255)
+    return lut
+
+def composite_inpaint(job: RemovalJob, res_img: np.ndarray) -> np.ndarray:
+    """
+    [Stage 3 - Compositing]
+    1024px(저화질) 대신 2048px(중화질)로 처리한 결과를 LANCZOS4로 복원하여 합성합니다.
+    마스크 bounding box + feather margin(ROI) 안에서만 리사이즈/색 보정/블렌딩을 하고,
+    결과는 원본 이미지(job.image)에 in-place로 씁니다. (8K 파노라마에서도 임시 메모리는 ROI 크기)
+    Crop 모드에서는 res_img가 job.crop 영역에 해당하며, 마스크 경계만 Feathering으로 섞이므로
+    crop 경계(seam)는 결과에 드러나지 않습니다.
+    """
+    image, input_image, mask_dilated = job.image, job.input_image, job.mask_dilated
+    original_h, original_w = image.shape[:2]
+    proc_h, proc_w = input_image.shape[:2]
+
+    bx, by, bw, bh = cv2.boundingRect(mask_dilated)
+    if bw == 0 or bh == 0:
+        print("⚠️ Empty mask, nothing to composite")
+        return image
+
+    # Gemini 결과가 덮는 영역 (원본 좌표)
+    scale_x, scale_y = original_w / proc_w, original_h / proc_h
+    if job.crop:
+        cx0, cy0, cx1, cy1 = job.crop
+        fx0, fy0 = int(round(cx0 * scale_x)), int(round(cy0 * scale_y))
+        fx1, fy1 = int(round(cx1 * scale_x)), int(round(cy1 * scale_y))
+        reference = input_image[cy0:cy1, cx0:cx1]
+    else:
+        fx0, fy0, fx1, fy1 = 0, 0, original_w, original_h
+        reference = input_image
+
+    # ROI (원본 좌표) = 마스크 bbox + Feathering 반경
+    margin = COMPOSITE_FEATHER_KSIZE // 2 + 2
+    x0 = max(fx0, int(np.floor(bx * scale_x)) - margin)
+    y0 = max(fy0, int(np.floor(by * scale_y)) - margin)
+    x1 = min(fx1, int(np.ceil((bx + bw) * scale_x)) + margin)
+    y1 = min(fy1, int(np.ceil((by + bh) * scale_y)) + margin)
+    roi = (x0, y0, x1, y1)
+
+    # (A) Upscaling (ROI만) + Histogram Matching (썸네일 LUT)
+    with stage("composite_upscale"):
+        gemini_roi = resize_roi(res_img, (fx1 - fx0, fy1 - fy0), (x0 - fx0, y0 - fy0, x1 - fx0, y1 - fy0), cv2.INTER_LANCZOS4)
+    with stage("composite_histogram"):
+        try:
+            gemini_roi = cv2.LUT(gemini_roi, histogram_match_lut(res_img, reference))
         except Exception as e:
-            print(f"Attempt {attempt+1} failed: {e}")
-            if "429" in str(e) or "quota" in str(e).lower():
-                print("⏳ Quota exceeded. Waiting 40s...")
-                time.sleep(40)
-            elif attempt < max_retries - 1:
-                time.sleep(5)
-            else:
-                raise e
+            print(f"⚠️ Histogram matching skipped: {e}")
 
-@app.post("/remove-object", response_model=RemoveObjectResponse)
-async def remove_object(file: UploadFile = File(...), x: int = Form(...), y: int = Form(...)):
-    res = process_removal(await file.read(), x, y)
-    mask_img = detect_floor_boundary(res)
-    is_success, buffer = cv2.imencode(".jpg", res, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+    # (B) Feathering
+    with stage("composite_feather"):
+        mask_roi = resize_roi(mask_dilated, (original_w, original_h), roi, cv2.INTER_NEAREST)
+        alpha = cv2.GaussianBlur(mask_roi.astype(np.float32) / 255.0, (COMPOSITE_FEATHER_KSIZE, COMPOSITE_FEATHER_KSIZE), 0)
+
+    # (C) Final Composite (in-place)
+    with stage("composite_blend"):
+        target = image[y0:y1, x0:x1]
+        target[:] = cv2.blendLinear(gemini_roi, target, alpha, 1.0 - alpha)
     
-    import base64
-    img_base64 = base64.b64encode(buffer).decode("utf-8")
+    print(f"✅ Inpainting Complete! (ROI {x1 - x0}x{y1 - y0} of {original_w}x{original_h})")
+    return image
+
+async def process_removal(image: ImagePyramid, targets: List[RemovalTarget], inpaint_mode: str = INPAINT_MODE,
+                          panorama_mode: str = PANORAMA_MODE) -> Tuple[np.ndarray, RemovalJob]:
+    """
+    [Balanced Inpainting]
+    SAM(GPU) -> Gemini(Network) -> Compositing(CPU) 단계로 실행합니다.
+    SAM / Compositing은 Inference Executor, Gemini 호출은 공유 GEMINI 게이트웨이를 거칩니다.
+    물체가 여러 개면 마스크를 합쳐서 Gemini 호출 / 합성을 한 번만 합니다.
+    """
+    try:
+        job = await INFERENCE["sam"].run(segment_objects, image, targets, panorama_mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if inpaint_mode == "crop":
+        job.crop = inpaint_crop_window(job.mask_dilated)
+    proc_h, proc_w = job.image_rgb.shape[:2]
+    print(f"🚀 Calling Gemini (2.5 Flash Image) - 2K Mode ({proc_w}x{proc_h}, objects={len(targets)}, crop={job.crop})")
     
-    return RemoveObjectResponse(
+    # 429 / 5xx 재시도는 게이트웨이가 처리하고, 여기서는 이미지 없이 돌아온 응답만 한 번 더 요청합니다.
+    max_attempts = 2
+    for attempt in range(max_attempts):
+        res_img = await request_inpaint(job)
+        if res_img is not None:
+            return await INFERENCE["sam"].run(composite_inpaint, job, res_img), job
+        print(f"Attempt {attempt+1} failed: No image part in Gemini response")
+    raise HTTPException(status_code=502, detail="Inpainting failed: No image part in Gemini response")
+
+def object_mask_png(mask: np.ndarray) -> bytes:
+    """물체 선택 영역을 바닥 마스크와 같은 반투명 RGBA PNG로 (빨강, Alpha 160)"""
+    rgba_image = np.zeros((*mask.shape[:2], 4), dtype=np.uint8)
+    rgba_image[mask] = (0, 0, 255, 160)  # BGRA
+    return cv2.imencode(".png", rgba_image)[1].tobytes()
+
+@app.post("/upload", response_model=UploadResponse)
+async def upload_image(request: Request, file: UploadFile = File(...)):
+    """
+    방 사진을 한 번 업로드하고 image_handle을 받습니다.
+    이후 /consult, /analyze-image, /remove-object에 파일 대신 image_handle을 보내면 됩니다.
+    """
+    contents = await file.read()
+    mime_type = detect_image_mime(contents)
+    if not mime_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Unsupported image format")
+    handle = await asyncio.to_thread(blob_store.put, contents)
+    image_pyramids.put(contents, handle)  # 이후 요청은 같은 handle로 디코딩 / 리사이즈 결과를 공유
+    return UploadResponse(
         status="success",
-        image=f"data:image/jpeg;base64,{img_base64}",
-        mask_image=mask_img
+        image_handle=handle,
+        url=f"{str(request.base_url).rstrip('/')}/blobs/{handle}",
+        size=len(contents),
+        mime_type=mime_type,
     )
 
+@app.post("/remove-object", response_model=RemoveObjectResponse)
+async def remove_object(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    image_handle: Optional[str] = Form(None),
+    x: Optional[int] = Form(None),
+    y: Optional[int] = Form(None),
+    objects: Optional[str] = Form(None),
+    response_format: str = Form("url"),
+    inpaint_mode: str = Form(INPAINT_MODE),
+    mask_resolution: str = Form("working"),
+    mask_format: str = Form("png"),
+    panorama_mode: str = Form(PANORAMA_MODE),
+):
+    """
+    클릭한 물체를 지웁니다. 여러 물체는 objects에 JSON 배열로 보내면 한 번에 지웁니다.
+    예) [{"points": [[1200, 900]]}, {"points": [[3000, 950]], "negative_points": [[3050, 700]]},
+         {"box": [400, 800, 900, 1300]}]
+    object_masks에는 물체별 선택 영역(RGBA PNG, SAM 입력 해상도)이 objects 순서대로 담깁니다.
+    mask_resolution="original"이면 바닥 마스크(mask_image)를 결과 이미지와 같은 크기로 반환합니다.
+    mask_format: "png"(mask_image) / "polygon" / "rle"(floor_mask), 쉼표로 여러 개 지정 가능
+    panorama_mode="cubemap"이면 2:1 파노라마에서 클릭한 방향의 원근 면으로 물체를, cubemap 면별로 바닥을 분할합니다.
+    """
+    check_response_format(response_format)
+    check_mask_resolution(mask_resolution)
+    check_panorama_mode(panorama_mode)
+    formats = parse_mask_format(mask_format)
+    if inpaint_mode not in ("crop", "full"):
+        raise HTTPException(status_code=400, detail="inpaint_mode must be 'crop' or 'full'")
+    targets = parse_removal_targets(objects, x, y)
+    res, job = await process_removal(await load_image(file, image_handle), targets, inpaint_mode, panorama_mode)
+    output_size = (res.shape[1], res.shape[0]) if mask_resolution == "original" else None
+    mask_png, floor_mask = await INFERENCE["beit"].run(detect_floor_outputs, res, formats, output_size,
+                                                       panorama_mode=panorama_mode)
+    with stage("object_masks_png"):
+        object_pngs = await asyncio.to_thread(lambda: [object_mask_png(m) for m in job.object_masks])
+    with stage("result_jpeg"):
+        is_success, buffer = await asyncio.to_thread(cv2.imencode, ".jpg", res, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+        result_jpeg = buffer.tobytes()
+    
+    # 결과 이미지는 항상 Blob으로 저장하여 다음 요청에서 image_handle로 재사용 가능
+    with stage("blob_put"):
+        result_handle = await asyncio.to_thread(blob_store.put, result_jpeg)
+    
+    with stage("response_encode"):
+        return RemoveObjectResponse(
+            status="success",
+            image=encode_result(result_jpeg, "image/jpeg", response_format, request),
+            mask_image=encode_result(mask_png, "image/png", response_format, request),
+            image_handle=result_handle,
+            object_masks=[encode_result(png, "image/png", response_format, request) for png in object_pngs],
+            floor_mask=floor_mask,
+        )
+
 @app.post("/analyze-image", response_model=AnalyzeImageResponse)
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    image_handle: Optional[str] = Form(None),
+    response_format: str = Form("url"),
+    mask_resolution: str = Form("working"),
+    mask_format: str = Form("png"),
+    panorama_mode: str = Form(PANORAMA_MODE),
+):
     """
     [Phase 9.1] 이미지 구조 분석 (MIT License Model)
+    mask_resolution="original"이면 바닥 마스크를 업로드 원본 크기로 반환합니다. (기본: FLOOR_TARGET_SIZE 기준)
+    mask_format="polygon" / "rle"이면 정규화 좌표 바닥 polygon / RLE를 floor_mask로 반환합니다. (PNG보다 수백 배 작음)
+    panorama_mode="cubemap"이면 2:1 파노라마를 cubemap 면(옆면 4개 + 바닥면)별로 분석해서 equirect 마스크로 합칩니다.
     """
+    check_response_format(response_format)
+    check_mask_resolution(mask_resolution)
+    check_panorama_mode(panorama_mode)
+    formats = parse_mask_format(mask_format)
     try:
-        contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None: raise HTTPException(status_code=400, detail="Invalid image")
+        pyramid = await load_image(file, image_handle)
+        try:
+            # BEiT 입력 크기(FLOOR_TARGET_SIZE, cubemap이면 면 해상도에 맞는 너비)만 필요하므로 JPEG는 축소 디코딩
+            image = await asyncio.to_thread(lambda: pyramid.level(floor_input_size(pyramid, panorama_mode)))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid image")
             
         # Run Detection (BEiT)
-        mask_img = detect_floor_boundary(image)
+        output_size = pyramid.original_size() if mask_resolution == "original" else None
+        mask_png, floor_mask = await INFERENCE["beit"].run(detect_floor_outputs, image, formats, output_size,
+                                                           panorama_mode=panorama_mode)
         print(f"✅ Floor Mask Created (License Safe)")
         
-        return AnalyzeImageResponse(
-            status="success",
-            mask_image=mask_img
-        )
+        with stage("response_encode"):
+            return AnalyzeImageResponse(
+                status="success",
+                mask_image=encode_result(mask_png, "image/png", response_format, request),
+                floor_mask=floor_mask,
+            )
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error analysis: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/")
 def read_root():
-    return {"status": "ok", "message": "MyShow Room AI Server Running (OSI Compliant)"}
+    return {
+        "status": "ok",
+        "message": "MyShow Room AI Server Running (OSI Compliant)",
+        "startup": {**STARTUP, "peak_rss_mb": peak_rss_mb()},
+        "worker": WORKER,
+        "models": MODELS.stats(),
+        "sam_predictors": MODELS.peek("sam").stats() if MODELS.peek("sam") else None,
+        "sam_cache": sam_embedding_cache.stats(),
+        "panorama_maps": panorama_map_stats(),
+        "image_pyramids": image_pyramids.stats(),
+        "inference": {name: ex.stats() for name, ex in INFERENCE.items()},
+        "gemini": GEMINI.stats(),
+        "consult_cache": consult_cache.stats(),
+        "beit_batching": MODELS.peek("beit").batcher.stats() if MODELS.peek("beit") else None,
+        "blob_store": blob_store.stats(),
+    }
 
-@app.post("/consult", response_model=List[ConsultItem])
-async def consult(request: Request, image: UploadFile = File(...), user_prompt: str = Form(None)):
+def gauge_lines(name: str, help_text: str, samples: Dict[str, float], label: Optional[str] = None,
+                metric_type: str = "gauge") -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for key, value in samples.items():
+        lines.append(f'{name}{{{label}="{key}"}} {value}' if label else f"{name} {value}")
+    return lines
+
+def counter_lines(name: str, help_text: str, samples: Dict[str, float], label: Optional[str] = None) -> List[str]:
+    """프로세스 시작 후 단조 증가하는 값 (rate() / increase()로 조회). Prometheus 규칙대로 _total 접미사를 붙입니다."""
+    return gauge_lines(f"{name}_total", help_text, samples, label, metric_type="counter")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint (단계별 / 요청별 히스토그램 + 거부 / 캐시 / Gemini 카운터 + 큐, 모델 상태 게이지)"""
+    executors = {name: ex.stats() for name, ex in INFERENCE.items()}
+    gemini = GEMINI.stats()
+    sam_cache = sam_embedding_cache.stats()
+    lines = STAGE_SECONDS.render() + REQUEST_SECONDS.render()
+    lines += gauge_lines("showroom_inference_inflight", "Inference executor inflight",
+                         {name: s["inflight"] for name, s in executors.items()}, "executor")
+    for key in ("rejected", "timeouts"):
+        lines += counter_lines(f"showroom_inference_{key}", f"Inference executor {key}",
+                               {name: s[key] for name, s in executors.items()}, "executor")
+    lines += gauge_lines("showroom_gemini_queue_depth", "Gemini calls waiting for a slot", {"": gemini["queue_depth"]})
+    lines += gauge_lines("showroom_gemini_active", "Gemini calls in flight", {"": gemini["active"]})
+    lines += counter_lines("showroom_gemini_events", "Gemini gateway counters",
+                           {k: v for k, v in gemini.items() if k in GEMINI.counters}, "event")
+    lines += counter_lines("showroom_sam_cache_events", "SAM embedding cache counters",
+                           {k: sam_cache[k] for k in ("hits", "misses", "evictions")}, "event")
+    lines += counter_lines("showroom_image_pyramid_events", "Image preprocessing cache counters",
+                           {k: v for k, v in image_pyramids.stats().items() if k in ("hits", "misses", "evictions")}, "event")
+    lines += counter_lines("showroom_consult_cache_events", "Consult result cache counters",
+                           {k: v for k, v in consult_cache.stats().items() if k in ("hits", "misses", "expired")}, "event")
+    lines += gauge_lines("showroom_model_ready", "1 if the model is loaded",
+                         {name: int(s["status"] == "ready") for name, s in MODELS.stats().items()}, "model")
+    lines += gauge_lines("showroom_peak_rss_bytes", "Peak resident set size", {"": int(peak_rss_mb() * 2**20)})
+    return "\n".join(lines) + "\n"
+
+# ==========================================
+# [Perf] Consult Streaming + Result Cache
+# ==========================================
+# - Structured Output: response_schema로 항상 JSON 배열을 받습니다. (코드 펜스 제거 / 전체 json.loads 불필요)
+# - /consult/stream: Gemini 스트리밍 출력에서 추천 항목이 하나 완성될 때마다 카탈로그와 매칭해 바로 보냅니다.
+#   기본 NDJSON(한 줄에 이벤트 하나), Accept: text/event-stream이면 SSE
+#   이벤트: {"type": "item", "index", "item": ConsultItem} ... {"type": "done", "count", "cached"}
+#           스트림 도중 Gemini가 실패하면 {"type": "error", "status", "detail"} (시작 전 실패는 일반 HTTP 에러)
+# - ConsultCache: (이미지 Content Hash, 정규화한 프롬프트, 카탈로그 버전) -> Gemini가 고른 항목 (TTL + LRU)
+#   반복 / 재시도 요청은 Gemini 호출 없이 바로 응답합니다. (item_details는 요청마다 카탈로그에서 다시 조회)
+#   응답 헤더 X-Consult-Cache: HIT | MISS
+CONSULT_MODEL = "gemini-2.5-flash-lite"
+CONSULT_CACHE_TTL_S = float(os.getenv("CONSULT_CACHE_TTL_S", 600))
+CONSULT_CACHE_MAX_ENTRIES = int(os.getenv("CONSULT_CACHE_MAX_ENTRIES", 256))
+CONSULT_RESPONSE_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=types.Schema(
+        type=types.Type.ARRAY,
+        items=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "selected_id": types.Schema(type=types.Type.STRING),
+                "reason": types.Schema(type=types.Type.STRING),
+                "position_suggestion": types.Schema(type=types.Type.STRING),
+            },
+            required=["selected_id", "reason", "position_suggestion"],
+            property_ordering=["selected_id", "reason", "position_suggestion"],  # selected_id를 먼저 스트리밍
+        ),
+    ),
+)
+
+def normalize_consult_prompt(user_prompt: str) -> str:
+    """캐시 키용: 유니코드 정규화(NFKC) + 공백 정리 + 대소문자 무시"""
+    return " ".join(unicodedata.normalize("NFKC", user_prompt).split()).casefold()
+
+class ConsultCache:
+    """(이미지, 프롬프트, 카탈로그 버전) -> Gemini가 고른 항목 목록. TTL이 지난 항목은 조회 시 제거합니다."""
+    def __init__(self, ttl_s: float, max_entries: int):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, picks)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @staticmethod
+    def key(image_key: str, user_prompt: str, catalog_version: int) -> str:
+        payload = json.dumps([CONSULT_MODEL, image_key, normalize_consult_prompt(user_prompt), catalog_version], ensure_ascii=False)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, picks: List[Dict[str, Any]]):
+        if self.ttl_s <= 0 or not picks: return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, picks)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "ttl_s": self.ttl_s, "hits": self.hits,
+                    "misses": self.misses, "expired": self.expired}
+
+consult_cache = ConsultCache(CONSULT_CACHE_TTL_S, CONSULT_CACHE_MAX_ENTRIES)
+
+class ConsultPickStream:
     """
-    [Phase 10] RAG-based Furniture Recommendation
+    스트리밍 JSON 파서: feed(text)마다 새로 완성된 최상위 객체(dict) 목록을 반환합니다.
+    [{...}, {...}] 배열과 단일 객체 {...} 모두 지원하고, 첫 괄호 앞 / 마지막 괄호 뒤의 텍스트(코드 펜스 등)는 무시합니다.
     """
+    def __init__(self):
+        self._depth = 0
+        self._base = None  # 항목 객체가 시작되는 깊이 (배열 안이면 1, 단일 객체면 0)
+        self._in_string = False
+        self._escape = False
+        self._current = []
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        picks = []
+        for ch in text:
+            if self._base is not None and self._depth > self._base: self._current.append(ch)
+            if self._in_string:
+                if self._escape: self._escape = False
+                elif ch == "\\": self._escape = True
+                elif ch == '"': self._in_string = False
+                continue
+            if ch == '"' and self._depth > 0:
+                self._in_string = True
+            elif ch in "[{":
+                if self._base is None: self._base = 1 if ch == "[" else 0
+                if ch == "{" and self._depth == self._base: self._current = [ch]
+                self._depth += 1
+            elif ch in "]}" and self._depth > 0:
+                self._depth -= 1
+                if ch == "}" and self._depth == self._base:
+                    try:
+                        pick = json.loads("".join(self._current))
+                        if isinstance(pick, dict): picks.append(pick)
+                    except ValueError:
+                        print(f"⚠️ Skipping malformed consult item: {''.join(self._current)[:80]}")
+                    self._current = []
+        return picks
+
+def parse_consult_picks(text: str) -> List[Dict[str, Any]]:
+    return ConsultPickStream().feed(text or "")
+
+def resolve_consult_item(pick: Dict[str, Any], base_url: str) -> Optional[ConsultItem]:
+    """Gemini가 고른 항목을 카탈로그와 매칭합니다. (카탈로그에 없는 ID는 None)"""
+    selected_id = pick.get('selected_id')
+    det = CATALOG.get(selected_id) if selected_id else None
+    if not det: return None
+
+    if det.get('glb_url') and not det['glb_url'].startswith("http"):
+        path = det['glb_url']
+        if not path.startswith("/"): path = "/" + path
+        det['glb_url'] = f"{base_url}{path}"
+    # 클라이언트가 작은 LOD부터 로드할 수 있도록 LOD URL/크기 제공
+    assets = det.pop('assets', None)
+    if assets: det['lods'] = asset_lod_urls(assets, base_url)
+
+    return ConsultItem(
+        selected_id=selected_id,
+        reason=pick.get('reason', ""),
+        position_suggestion=pick.get("position_suggestion", ""),
+        item_details=det
+    )
+
+async def consult_request(image: Optional[UploadFile], image_handle: Optional[str],
+                          user_prompt: Optional[str]) -> Tuple[ImagePyramid, str, str]:
+    """요청 이미지 / 프롬프트와 캐시 키"""
     if not user_prompt:
         user_prompt = "Recommend furniture that best matches this room's style."
     print(f"🔍 Consult Request: {user_prompt}")
+    pyramid = await load_image(image, image_handle)
+    cache_key = ConsultCache.key(pyramid.key, user_prompt, CATALOG.version)
+    return pyramid, user_prompt, cache_key
 
+async def consult_prompt_parts(pyramid: ImagePyramid, user_prompt: str) -> list:
+    """캐시 MISS일 때만: Gemini용 이미지 + Top-K 후보 프롬프트"""
     try:
-        contents = await image.read()
+        # 실제 형식의 MIME, 큰 이미지는 CONSULT_IMAGE_MAX_SIDE로 줄인 JPEG
+        image_bytes, image_mime = await asyncio.to_thread(pyramid.consult_image)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid Image")
 
-    if not FURNITURE_DB:
+    if not furniture_index.ids:
         print("⚠️ Furniture DB is empty!")
-    
-    inventory_text = "\n".join([
-        f"- ID: {item['id']}, Name: {item['name']}, Style: {item.get('style_tags', [])}, Has3D: {'Yes' if item.get('glb_url') else 'No'}"
-        for item in FURNITURE_DB
-    ])
 
-    system_instruction = f"""
-    You are an expert interior design curator using the Amazon Berkeley Objects dataset.
-    Analyze the user's room image and their request ("{user_prompt}").
-    Then, SELECT THE TOP 5 BEST ITEMS from the [Inventory List] below.
-    
-    [Inventory List]
-    {inventory_text}
-    
-    [Output Format]
-    Return ONLY a JSON Array of objects. No markdown.
-    [
-        {{
-            "selected_id": "Item ID",
-            "reason": "Reason in Korean",
-            "position_suggestion": "Placement suggestion"
-        }}
-    ]
+    # Top-K 후보만 프롬프트에 포함 (Retrieval Index)
+    with stage("retrieval"):
+        # 질의 임베딩은 GEMINI 게이트웨이(비동기), 벡터 검색 / 카탈로그 조회는 retrieval Executor에서 실행
+        query_vec = await embed_consult_query(user_prompt)
+        candidates = await INFERENCE["retrieval"].run(retrieve_candidates, user_prompt, query_vec)
+    print(f"📚 Inventory candidates: {len(candidates)}/{len(furniture_index.ids)}")
+    with stage("prompt_build"):
+        system_instruction = build_consult_prompt(user_prompt, candidates)
+    return [types.Part.from_bytes(data=image_bytes, mime_type=image_mime), system_instruction]
+
+@app.post("/consult", response_model=List[ConsultItem])
+async def consult(
+    request: Request,
+    response: Response,
+    image: Optional[UploadFile] = File(None),
+    image_handle: Optional[str] = Form(None),
+    user_prompt: str = Form(None),
+):
+    """
+    [Phase 10] RAG-based Furniture Recommendation
     """
+    pyramid, user_prompt, cache_key = await consult_request(image, image_handle, user_prompt)
+    picks = consult_cache.get(cache_key)
+    response.headers["X-Consult-Cache"] = "MISS" if picks is None else "HIT"
 
+    if picks is None:
+        prompt_parts = await consult_prompt_parts(pyramid, user_prompt)
+        try:
+            with stage("gemini_consult"):
+                gemini_response = await GEMINI.generate_content(
+                    model=CONSULT_MODEL,
+                    contents=prompt_parts,
+                    config=CONSULT_RESPONSE_CONFIG,
+                )
+            picks = parse_consult_picks(gemini_response.text)
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"❌ Gemini/Parse Error: {e}")
+            picks = []
+        consult_cache.put(cache_key, picks)
+
+    base_url = str(request.base_url).rstrip("/")
+    results = [resolve_consult_item(pick, base_url) for pick in picks]
+    return [item for item in results if item is not None]
+
+def consult_event(event: str, data: Dict[str, Any], sse: bool) -> str:
+    payload = json.dumps({"type": event, **jsonable_encoder(data)}, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n" if sse else payload + "\n"
+
+async def cached_consult_picks(picks: List[Dict[str, Any]]):
+    for pick in picks: yield pick
+
+async def streamed_consult_picks(first_chunk: str, chunks):
+    """Gemini chunk를 파싱하면서 완성된 항목을 하나씩 yield"""
+    parser = ConsultPickStream()
+    text = first_chunk
+    while True:
+        for pick in parser.feed(text): yield pick
+        if chunks is None: return
+        try:
+            text = await chunks.__anext__()
+        except StopAsyncIteration:
+            return
+
+async def consult_events(picks, cached: bool, cache_key: str, base_url: str, sse: bool):
+    """항목을 받는 대로 카탈로그와 매칭해서 보냅니다. Gemini 스트림이 끝까지 성공한 경우에만 캐시에 저장합니다."""
+    received, count = [], 0
     try:
-        prompt_parts = [
-            types.Part.from_bytes(data=contents, mime_type="image/jpeg"),
-            system_instruction
-        ]
-        
-        response = client.models.generate_content(
-            model='gemini-2.5-flash-lite', 
-            contents=prompt_parts
-        )
-        
-        cleaned_text = response.text.replace("```json", "").replace("```", "").strip()
-        data = json.loads(cleaned_text)
-        if isinstance(data, dict): data = [data]
-        
-    except Exception as e:
-        print(f"❌ Gemini/Parse Error: {e}")
-        data = []
+        async for pick in picks:
+            received.append(pick)
+            item = resolve_consult_item(pick, base_url)
+            if item is None: continue
+            yield consult_event("item", {"index": count, "item": item}, sse)
+            count += 1
+    except HTTPException as e:
+        yield consult_event("error", {"status": e.status_code, "detail": e.detail}, sse)
+        return
 
-    results = []
-    for d in data:
-        selected_id = d.get('selected_id')
-        item = next((i for i in FURNITURE_DB if i['id'] == selected_id), None)
-        
-        if item:
-            det = item.copy()
-            if det.get('glb_url') and not det['glb_url'].startswith("http"):
-                base_url = str(request.base_url).rstrip("/")
-                path = det['glb_url']
-                if not path.startswith("/"): path = "/" + path
-                det['glb_url'] = f"{base_url}{path}"
-            
-            results.append(ConsultItem(
-                selected_id=selected_id,
-                reason=d.get('reason', ""),
-                position_suggestion=d.get("position_suggestion", ""),
-                item_details=det
-            ))
-            
-    return results
\ No newline at end of file
+    if not cached: consult_cache.put(cache_key, received)
+    yield consult_event("done", {"count": count, "cached": cached}, sse)
+
+@app.post("/consult/stream")
+async def consult_stream(
+    request: Request,
+    image: Optional[UploadFile] = File(None),
+    image_handle: Optional[str] = Form(None),
+    user_prompt: str = Form(None),
+):
+    """/consult와 같은 입력, 추천 항목을 하나씩 스트리밍 (NDJSON 또는 SSE)"""
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    pyramid, user_prompt, cache_key = await consult_request(image, image_handle, user_prompt)
+    picks = consult_cache.get(cache_key)
+
+    cached = picks is not None
+    if cached:
+        picks = cached_consult_picks(picks)
+    else:
+        prompt_parts = await consult_prompt_parts(pyramid, user_prompt)
+        chunks = GEMINI.generate_content_stream(model=CONSULT_MODEL, contents=prompt_parts, config=CONSULT_RESPONSE_CONFIG)
+        # 첫 chunk까지는 응답 전에 기다려서 대기열 초과 / 할당량 소진 같은 실패를 일반 HTTP 상태 코드로 반환
+        with stage("gemini_first_chunk"):
+            try:
+                first_chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                first_chunk, chunks = "", None
+        picks = streamed_consult_picks(first_chunk, chunks)
+
+    base_url = str(request.base_url).rstrip("/")
+    return StreamingResponse(
+        consult_events(picks, cached, cache_key, base_url, sse),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"X-Consult-Cache": "HIT" if cached else "MISS",
+                 "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ==========================================
+# [Perf] Multi-Process Serving
+# ==========================================
+# SERVE_WORKERS > 1 (CPU 전용): cell4가 serve_workers()로 uvicorn worker 프로세스를 fork합니다.
+# - 부모가 SAM / BEiT를 추론 없이 한 번만 로드한 뒤 fork하므로 가중치는 Copy-on-Write로 공유됩니다.
+#   (worker는 가중치를 읽기만 하고, gc.freeze()로 GC가 부모 객체를 건드려 페이지가 복사되는 것도 막음)
+#   ONNX 백엔드는 OnnxSession(share_weights=True)이 부모에서 읽어 둔 가중치를 각 worker의 세션이 입력으로 받아 공유합니다.
+# - 모든 worker가 부모가 bind한 같은 listening socket에서 accept합니다. (연결 분배는 커널이 담당)
+# - worker마다 torch / ONNX 스레드 = CPU 코어 / SERVE_WORKERS, Inference Executor / genai client / Gemini 게이트웨이를 새로 만듭니다.
+#   Gemini 초당 요청 수와 burst는 worker 수로 나눠 전체 할당량을 지킵니다.
+# - SAM 임베딩 캐시, 이미지 pyramid, /metrics, 헬스체크(/)는 worker별입니다. ("worker"로 응답한 프로세스 확인)
+# ⚠️ CUDA context는 fork할 수 없으므로 GPU 런타임에서는 단일 프로세스 + SamPredictorPool로 동작합니다.
+WORKER = {"id": 0, "pid": os.getpid(), "workers": 1}
+
+def preload_models_for_fork():
+    """fork 전에 부모에서 모델을 로드합니다. (warm-up은 worker에서: 부모에서 torch / ORT 스레드 풀을 띄우지 않음)"""
+    for name in ("sam", "beit"):
+        MODELS.get(name)
+    gc.collect()
+    gc.freeze()
+    print(f"🧬 Models preloaded for {SERVE_WORKERS} workers (peak RSS {peak_rss_mb()} MB)")
+
+def init_worker(worker_id: int, workers: int):
+    """fork 직후 worker에서 프로세스마다 필요한 자원(스레드 풀, 네트워크 연결)을 새로 만듭니다."""
+    global ONNX_THREADS, INFERENCE, client, GEMINI
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(threads)
+    ONNX_THREADS = threads
+    INFERENCE = {name: InferenceExecutor(name, *cfg) for name, cfg in INFERENCE_CONFIG.items()}
+    client = make_genai_client()  # 부모의 HTTP connection pool을 공유하지 않음
+    GEMINI = GeminiGateway(client, **{**GEMINI_CONFIG, "rate_per_s": GEMINI_CONFIG["rate_per_s"] / workers,
+                                      "burst": max(1, GEMINI_CONFIG["burst"] // workers)})
+    WORKER.update(id=worker_id, pid=os.getpid(), workers=workers)
+
+def run_worker(config: uvicorn.Config, sock, worker_id: int, workers: int):
+    code = 0
+    try:
+        init_worker(worker_id, workers)
+        asyncio.events._set_running_loop(None)  # fork 시점에 실행 중이던 노트북 이벤트 루프 해제
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(uvicorn.Server(config).serve(sockets=[sock]))
+    except BaseException as e:
+        print(f"❌ Worker {worker_id} crashed: {e!r}")
+        code = 1
+    finally:
+        os._exit(code)
+
+def spawn_worker(config: uvicorn.Config, sock, worker_id: int, workers: int) -> int:
+    pid = os.fork()
+    if pid == 0: run_worker(config, sock, worker_id, workers)
+    return pid
+
+async def serve_workers(config: uvicorn.Config, workers: int = SERVE_WORKERS):
+    """workers개의 uvicorn 프로세스로 서빙합니다. 비정상 종료한 worker는 다시 fork합니다."""
+    if device != "cpu" or workers <= 1:
+        if workers > 1: print("⚠️ SERVE_WORKERS > 1 requires a CPU runtime (CUDA cannot be forked). Serving in one process.")
+        return await uvicorn.Server(config).serve()
+
+    preload_models_for_fork()
+    sock = config.bind_socket()
+    pids = {spawn_worker(config, sock, worker_id, workers): worker_id for worker_id in range(1, workers + 1)}
+    print(f"🚀 {workers} workers serving on {config.host}:{config.port} (pids {list(pids)})")
+    try:
+        while pids:
+            await asyncio.sleep(1)
+            for pid in list(pids):
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if not done: continue
+                worker_id = pids.pop(pid)
+                if status != 0:
+                    print(f"⚠️ Worker {worker_id} (pid {pid}) exited with status {status}, restarting...")
+                    pids[spawn_worker(config, sock, worker_id, workers)] = worker_id
+    finally:
+        for pid in pids: os.kill(pid, signal.SIGTERM)
+        for pid in pids: os.waitpid(pid, 0)
+        sock.close()
@@ -46,5 +46,9 @@ except Exception as e:
 # 4. FastAPI 서버 실행
 print("\n🔥 Starting Uvicorn Server...")
 config = uvicorn.Config(app, host="0.0.0.0", port=8000, proxy_headers=True, forwarded_allow_ips="*")
-server = uvicorn.Server(config)
-await server.serve()
\ No newline at end of file
+if SERVE_WORKERS > 1:
+    # CPU 런타임: 모델을 한 번 로드한 뒤 worker 프로세스를 fork (cell3 [Perf] Multi-Process Serving)
+    await serve_workers(config, SERVE_WORKERS)
+else:
+    server = uvicorn.Server(config)
+    await server.serve()
\ No newline at end of file
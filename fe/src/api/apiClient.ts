@@ -143,6 +143,8 @@ export const analyzeRoomStructure = async (
   // 실제 API 호출
   const formData = new FormData();
   formData.append('file', imageFile);
+  // 마스크를 Canvas로 픽셀 피킹하므로 Data URI(Base64) 응답 사용
+  formData.append('response_format', 'base64');
 
   try {
 
@@ -197,6 +199,7 @@ export const removeObject = async (
   formData.append('file', imageFile);
   formData.append('x', x.toString());
   formData.append('y', y.toString());
+  formData.append('response_format', 'base64');
 
   try {
 